@@ -0,0 +1,123 @@
+"""
+Micro-benchmark of permission cases instantiation per request.
+
+Compares permission cases, which are instantiated in every request, with reusable
+ones (`reuse_instance = True`) on a model with 6 permission cases for every method.
+
+Run from the repository root::
+
+    python -m benchmarks.permission_cases
+"""
+import timeit
+import tracemalloc
+
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+
+from combojsonapi.permission import (
+    PermissionFields,
+    PermissionForGet,
+    PermissionMixin,
+    PermissionToMapper,
+    PermissionUser,
+)
+
+Base = declarative_base()
+
+CASES_COUNT = 6
+REQUESTS = 1000
+
+
+class Computer(Base):
+    __tablename__ = "computer"
+    id = Column(Integer, primary_key=True)
+    serial = Column(String)
+    owner = Column(String)
+    location = Column(String)
+    comment = Column(String)
+
+
+class ComputerCase(PermissionMixin):
+    """Stateless case: doesn't change the instance and returns new permissions in every call"""
+
+    COLUMNS = ["id", "serial", "owner"]
+
+    def get(self, *args, many=True, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+        return PermissionForGet(allow_columns=self.COLUMNS, weight=1)
+
+    def post_data(self, *args, data=None, user_permission: PermissionUser = None, **kwargs) -> dict:
+        return data
+
+    def delete(self, *args, obj=None, user_permission: PermissionUser = None, **kwargs) -> bool:
+        return True
+
+
+def make_cases(reuse_instance: bool) -> list:
+    return [
+        type(f"ComputerCase{i}", (ComputerCase,), {"reuse_instance": reuse_instance})
+        for i in range(CASES_COUNT)
+    ]
+
+
+permission_mapper = PermissionToMapper()
+
+
+def request() -> None:
+    """Permissions, which are requested by PermissionPlugin while handling GET, POST and DELETE requests"""
+    PermissionUser(request_type="get", many=True, permission_mapper=permission_mapper).permission_for_get(Computer)
+    PermissionUser(request_type="post", permission_mapper=permission_mapper).permission_for_post_data(
+        model=Computer, data={"serial": "1"}
+    )
+    PermissionUser(request_type="delete", permission_mapper=permission_mapper).permission_for_delete(
+        model=Computer, obj=None
+    )
+
+
+def count_instances(func) -> dict:
+    """Counts permission objects created by func"""
+    counters = {PermissionMixin: 0, PermissionFields: 0}
+    original_inits = {cls: cls.__init__ for cls in counters}
+
+    def counting_init(cls):
+        def wrapper(self, *args, **kwargs):
+            counters[cls] += 1
+            original_inits[cls](self, *args, **kwargs)
+        return wrapper
+
+    for cls in counters:
+        cls.__init__ = counting_init(cls)
+    try:
+        func()
+    finally:
+        for cls, init in original_inits.items():
+            cls.__init__ = init
+    return counters
+
+
+def measure(reuse_instance: bool) -> tuple:
+    cases = make_cases(reuse_instance)
+    for type_ in ("get_list", "post", "delete"):
+        permission_mapper.add_permission(type_, Computer, cases)
+
+    counters = count_instances(request)
+
+    tracemalloc.start()
+    request()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = timeit.timeit(request, number=REQUESTS)
+    return counters[PermissionMixin], counters[PermissionFields], peak, seconds / REQUESTS * 1e6
+
+
+def main() -> None:
+    print(f"{CASES_COUNT} permission cases per method, GET + POST + DELETE permissions per request")
+    print(f"{'mode':<16}{'cases':>8}{'permissions':>13}{'peak bytes':>12}{'us/request':>12}")
+    for reuse_instance in (False, True):
+        cases, permissions, peak, usec = measure(reuse_instance)
+        mode = "reuse_instance" if reuse_instance else "new instances"
+        print(f"{mode:<16}{cases:>8}{permissions:>13}{peak:>12}{usec:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Per-request cost of the permission plugin on realistic schemas.
+
+Models have many columns, a nested JSON schema and two levels of relationships
+(computer -> person -> department); every model has several permission cases
+(column restrictions of different weight and row filters). Measured:
+
+* permission_for_get - merging permission cases of the three models
+  (without cache and with PermissionCache);
+* schema trimming - PermissionPlugin restrictions on a fresh resource schema
+  with included relationships (schema construction is measured separately
+  as a baseline);
+* data_layer_get_collection_update_query - filters, load_only and include
+  options of GET /computers?include=person.department (without cache and with
+  PermissionCache, which also enables include plans).
+
+The collection query is executed once against in-memory SQLite to make sure
+it is valid. Run from the repository root::
+
+    python -m benchmarks.permission_plugin [requests]
+"""
+import sys
+import time
+from typing import Callable, Optional
+
+from flask import Flask
+from flask_combo_jsonapi import ResourceList
+from flask_combo_jsonapi.data_layers.alchemy import SqlalchemyDataLayer
+from flask_combo_jsonapi.querystring import QueryStringManager
+from marshmallow import Schema as MarshmallowSchema
+from marshmallow import fields as ma_fields
+from marshmallow_jsonapi import Schema, fields
+from sqlalchemy import Column, ForeignKey, Integer, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship, sessionmaker
+
+from combojsonapi.permission import (
+    PermissionCache,
+    PermissionForGet,
+    PermissionMixin,
+    PermissionPlugin,
+    PermissionToMapper,
+    PermissionUser,
+)
+from combojsonapi.utils import Relationship
+
+Base = declarative_base()
+# QueryStringManager reads its settings from the application config
+app = Flask(__name__)
+
+REQUESTS = 500
+REPEATS = 5
+COMPUTER_COLUMNS = [f"attr_{i}" for i in range(40)]
+PERSON_COLUMNS = [f"attr_{i}" for i in range(20)]
+DEPARTMENT_COLUMNS = [f"attr_{i}" for i in range(10)]
+SETTINGS_FIELDS = [f"option_{i}" for i in range(10)]
+
+
+def columns(names) -> dict:
+    return {i_name: Column(String) for i_name in names}
+
+
+Department = type("Department", (Base,), {
+    "__tablename__": "department",
+    "id": Column(Integer, primary_key=True),
+    **columns(DEPARTMENT_COLUMNS),
+})
+
+Person = type("Person", (Base,), {
+    "__tablename__": "person",
+    "id": Column(Integer, primary_key=True),
+    "department_id": Column(Integer, ForeignKey("department.id")),
+    "department": relationship(Department),
+    **columns(PERSON_COLUMNS),
+})
+
+Computer = type("Computer", (Base,), {
+    "__tablename__": "computer",
+    "id": Column(Integer, primary_key=True),
+    "person_id": Column(Integer, ForeignKey("person.id")),
+    "person": relationship(Person),
+    # JSON document, which is described by the nested SettingsSchema
+    "settings": Column(String),
+    **columns(COMPUTER_COLUMNS),
+})
+
+
+def schema_fields(names) -> dict:
+    return {i_name: fields.String() for i_name in names}
+
+
+SettingsSchema = type("SettingsSchema", (MarshmallowSchema,), {
+    i_name: ma_fields.String() for i_name in SETTINGS_FIELDS
+})
+
+DepartmentSchema = type("DepartmentSchema", (Schema,), {
+    "Meta": type("Meta", (), {"type_": "department", "model": Department}),
+    "id": fields.Integer(as_string=True, dump_only=True),
+    **schema_fields(DEPARTMENT_COLUMNS),
+})
+
+PersonSchema = type("PersonSchema", (Schema,), {
+    "Meta": type("Meta", (), {"type_": "person", "model": Person}),
+    "id": fields.Integer(as_string=True, dump_only=True),
+    "department": Relationship(nested="DepartmentSchema", schema="DepartmentSchema", type_="department"),
+    **schema_fields(PERSON_COLUMNS),
+})
+
+ComputerSchema = type("ComputerSchema", (Schema,), {
+    "Meta": type("Meta", (), {"type_": "computer", "model": Computer}),
+    "id": fields.Integer(as_string=True, dump_only=True),
+    "person": Relationship(nested="PersonSchema", schema="PersonSchema", type_="person"),
+    "settings": fields.Nested(SettingsSchema),
+    **schema_fields(COMPUTER_COLUMNS),
+})
+
+
+engine = create_engine("sqlite:///:memory:")
+Base.metadata.create_all(engine)
+session = sessionmaker(bind=engine)()
+
+
+class ComputerList(ResourceList):
+    schema = ComputerSchema
+    data_layer = {"session": session, "model": Computer}
+
+
+def make_cases(model, names, relationships=()) -> list:
+    """Cases of a typical role model: common columns, extra columns of a higher weight, a forbidden column, a filter"""
+    half = len(names) // 2
+
+    class CommonColumns(PermissionMixin):
+        reuse_instance = True
+
+        def get(self, *args, many=True, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+            return PermissionForGet(allow_columns=["id", *relationships, *names[:half]], weight=1)
+
+    class ExtraColumns(PermissionMixin):
+        reuse_instance = True
+
+        def get(self, *args, many=True, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+            return PermissionForGet(allow_columns=names[half:], forbidden_columns=names[-1:], weight=5)
+
+    class ActiveRows(PermissionMixin):
+        reuse_instance = True
+        FILTERS = [getattr(model, names[0]) != "deleted"]
+
+        def get(self, *args, many=True, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+            return PermissionForGet(filters=self.FILTERS)
+
+    return [CommonColumns, ExtraColumns, ActiveRows]
+
+
+permission_mapper = PermissionToMapper()
+for i_type in ("get", "get_list"):
+    permission_mapper.add_permission(
+        i_type, Computer,
+        make_cases(Computer, COMPUTER_COLUMNS, ["person", "person_id", *(f"settings.{i}" for i in SETTINGS_FIELDS[:5])]),
+    )
+    permission_mapper.add_permission(i_type, Person, make_cases(Person, PERSON_COLUMNS, ["department"]))
+    permission_mapper.add_permission(i_type, Department, make_cases(Department, DEPARTMENT_COLUMNS))
+
+data_layer = SqlalchemyDataLayer(dict(session=session, model=Computer, resource=ComputerList))
+
+QUERYSTRING = {
+    "include": "person.department",
+    "fields[computer]": ",".join(["person", *COMPUTER_COLUMNS[::2]]),
+    "fields[person]": ",".join(["department", *PERSON_COLUMNS]),
+}
+
+
+def role_cache() -> PermissionCache:
+    # all users of the benchmark have the same role
+    return PermissionCache(fingerprint=lambda permission_user: "role")
+
+
+def new_permission_user(permission_cache: Optional[PermissionCache] = None) -> PermissionUser:
+    return PermissionUser(request_type="get", many=True, permission_cache=permission_cache,
+                          permission_mapper=permission_mapper)
+
+
+def bench_permission_for_get(permission_cache: Optional[PermissionCache] = None) -> Callable[[], None]:
+    def request():
+        permission_user = new_permission_user(permission_cache)
+        for i_model in (Computer, Person, Department):
+            permission_user.permission_for_get(i_model)
+    return request
+
+
+def bench_schema_construction(permission_cache: Optional[PermissionCache] = None) -> Callable[[], None]:
+    """Baseline for schema trimming: the same schema without restrictions"""
+    def request():
+        ComputerSchema(include_data=("person",))
+    return request
+
+
+def bench_schema_trimming(permission_cache: Optional[PermissionCache] = None) -> Callable[[], None]:
+    def request():
+        schema = ComputerSchema(include_data=("person",))
+        PermissionPlugin._permission_for_schema(schema=schema, model=Computer,
+                                                _permission_user=new_permission_user(permission_cache))
+    return request
+
+
+def bench_update_query(permission_cache: Optional[PermissionCache] = None) -> Callable[[], None]:
+    plugin = PermissionPlugin(permission_cache=permission_cache)
+
+    def request():
+        plugin.data_layer_get_collection_update_query(
+            query=session.query(Computer),
+            qs=QueryStringManager(QUERYSTRING, ComputerSchema),
+            self_json_api=data_layer,
+            view_kwargs={"_permission_user": new_permission_user(permission_cache)},
+        )
+    return request
+
+
+def measure(request: Callable[[], None], requests: int) -> float:
+    """Best of REPEATS runs, microseconds per request"""
+    request()
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for _ in range(requests):
+            request()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / requests * 1e6
+
+
+def check_query() -> None:
+    """The measured query is valid and returns rows"""
+    person = Person(id=1, department=Department(id=1))
+    session.add(Computer(id=1, person=person, **{i_name: "active" for i_name in COMPUTER_COLUMNS}))
+    session.flush()
+    query = PermissionPlugin().data_layer_get_collection_update_query(
+        query=session.query(Computer),
+        qs=QueryStringManager(QUERYSTRING, ComputerSchema),
+        self_json_api=data_layer,
+        view_kwargs={"_permission_user": new_permission_user()},
+    )
+    assert [i_obj.id for i_obj in query] == [1]
+    session.rollback()
+
+
+def main() -> None:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else REQUESTS
+    check_query()
+    print(f"{requests} requests, best of {REPEATS}")
+    print(f"{'benchmark':<40}{'us/request':>12}{'with PermissionCache':>22}")
+    for name, bench in (
+        ("permission_for_get", bench_permission_for_get),
+        ("schema construction (baseline)", bench_schema_construction),
+        ("schema trimming", bench_schema_trimming),
+        ("data_layer_get_collection_update_query", bench_update_query),
+    ):
+        print(f"{name:<40}{measure(bench(), requests):>12.1f}{measure(bench(role_cache()), requests):>22.1f}")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        main()
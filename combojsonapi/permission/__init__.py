@@ -1,3 +1,5 @@
+from combojsonapi.permission.permission_cache import PermissionCache
+from combojsonapi.permission.permission_stats import PermissionStats
 from combojsonapi.permission.permission_system import (
     PermissionToMapper,
     PermissionFields,
@@ -12,6 +14,8 @@ from combojsonapi.permission.permission_plugin import PermissionPlugin
 
 __all__ = [
     "PermissionPlugin",
+    "PermissionCache",
+    "PermissionStats",
     "PermissionToMapper",
     "PermissionFields",
     "PermissionForPatch",
@@ -0,0 +1,81 @@
+import time
+from typing import Callable, Hashable, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Query
+from sqlalchemy.orm.query import _MapperEntity
+
+from combojsonapi.permission.lru_cache import LRUCache
+
+
+# count of the data layer: query.count() over the whole collection query (columns, loader options, ORDER BY)
+COLLECTION_COUNT_QUERY = "query"
+# COUNT over joins and filters of the collection query only, see get_count_query
+COLLECTION_COUNT_STRIPPED = "stripped"
+# stripped count, which is cached for equal count queries, see CollectionCountCache
+COLLECTION_COUNT_CACHED = "cached"
+COLLECTION_COUNT_MODES = (COLLECTION_COUNT_QUERY, COLLECTION_COUNT_STRIPPED, COLLECTION_COUNT_CACHED)
+
+
+def check_collection_count_mode(mode: str) -> str:
+    if mode not in COLLECTION_COUNT_MODES:
+        raise ValueError(f"Unknown collection count mode {mode!r}, available: {', '.join(COLLECTION_COUNT_MODES)}")
+    return mode
+
+
+def get_count_query(query: Query) -> Optional[Query]:
+    """
+    Query counting rows of the collection query: SELECT count(pk) with the same joins, filters and params,
+    without loaded columns, loader options and ORDER BY.
+    :param query: collection query of a single model
+    :return: count query, or None if rows can't be counted this way (DISTINCT, GROUP BY, LIMIT/OFFSET,
+             several entities, single table inheritance), then query.count() should be used
+    """
+    # у Query нет публичного API для проверки этих частей запроса
+    if len(query._entities) != 1 or not isinstance(query._entities[0], _MapperEntity):
+        return None
+    if (query._distinct or query._group_by or query._having is not None or query._limit is not None
+            or query._offset is not None or query._statement is not None):
+        return None
+    mapper = query._entities[0].mapper
+    # фильтр по дискриминатору наследника добавляется только для сущности модели
+    if mapper.single or query._entities[0].is_aliased_class:
+        return None
+    return query.enable_eagerloads(False).with_entities(func.count(mapper.primary_key[0])).order_by(None)
+
+
+class CollectionCountCache(LRUCache):
+    """
+    LRU cache of collection counts, keyed by SQL and params of the count query. Permission filters are
+    a part of the query, so users with equal permissions share counts. Counts are expired after ttl seconds
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, timer: Callable[[], float] = time.monotonic):
+        """
+        :param maxsize: max number of cached counts
+        :param ttl: seconds, while a count is used without querying the database
+        :param timer:
+        """
+        super().__init__(maxsize=maxsize)
+        self.ttl = ttl
+        self.timer = timer
+
+    @classmethod
+    def get_key(cls, count_query: Query) -> Hashable:
+        compiled = count_query.statement.compile()
+        return str(compiled), tuple(sorted((k, repr(v)) for k, v in compiled.params.items()))
+
+    def count(self, count_query: Query) -> int:
+        """
+        Cached result of the count query, the query is executed if there is no actual count
+        :param count_query: see get_count_query
+        :return:
+        """
+        key = self.get_key(count_query)
+        now = self.timer()
+        cached = self.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        count = count_query.scalar()
+        self.set(key, (count, now + self.ttl))
+        return count
@@ -0,0 +1,66 @@
+from typing import Dict, List, Optional, Set
+
+from werkzeug.datastructures import ImmutableMultiDict
+from flask_combo_jsonapi.querystring import QueryStringManager
+
+
+def update_querystring(qs: QueryStringManager, updates: Optional[Dict[str, str]]) -> None:
+    """
+    Записывает в qs новые значения параметров querystring (пустые параметры при этом убираются)
+    :param qs:
+    :param updates: новые значения параметров, None - qs не меняется
+    :return:
+    """
+    if updates is None:
+        return
+    new_qs = {k: v for k, v in qs.qs.items() if v != ""}
+    new_qs.update(updates)
+    qs.qs = ImmutableMultiDict(new_qs)
+
+
+class EffectiveQuery:
+    """
+    Параметры fields и include из querystring, которые PermissionPlugin ограничивает по пермишенам
+    связанных моделей. Разбираются из qs один раз, меняются на месте, а в qs записываются
+    один раз после обработки всех include (см. updates и update_querystring)
+    """
+
+    __slots__ = ("fields", "include", "_changed_fields", "_include_changed")
+
+    def __init__(self, qs: QueryStringManager):
+        # fields[...] по типам схем, как в QueryStringManager.fields
+        self.fields: Dict[str, List[str]] = qs.fields
+        include = qs.qs.get("include")
+        self.include: List[str] = include.split(",") if include else []
+        self._changed_fields: Set[str] = set()
+        self._include_changed: bool = False
+
+    def restrict_fields(self, type_schema: str, fields: List[str], name_foreign_key: str = None) -> None:
+        """
+        Оставляет в fields[type_schema] только доступные поля. Если доступных полей не осталось,
+        убирает name_foreign_key из include
+        :param type_schema: название типа схемы Meta.type_
+        :param fields: список доступных полей
+        :param name_foreign_key: название поля в схеме, которое ссылается на схему type_schema
+        :return:
+        """
+        if type_schema in self.fields:
+            new_fields = list(set(self.fields[type_schema]) & set(fields))
+        else:
+            new_fields = list(fields)
+        if not new_fields and name_foreign_key in self.include:
+            self.include = [i_include for i_include in self.include if i_include != name_foreign_key]
+            self._include_changed = True
+        else:
+            self.fields[type_schema] = new_fields
+            self._changed_fields.add(type_schema)
+
+    @property
+    def updates(self) -> Optional[Dict[str, str]]:
+        """Изменённые параметры querystring, None - если ничего не менялось"""
+        if not self._changed_fields and not self._include_changed:
+            return None
+        updates = {f"fields[{i_type}]": ",".join(self.fields[i_type]) for i_type in self._changed_fields}
+        if self._include_changed:
+            updates["include"] = ",".join(self.include)
+        return updates
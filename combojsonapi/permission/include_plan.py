@@ -0,0 +1,32 @@
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from combojsonapi.permission.lru_cache import LRUCache
+from combojsonapi.permission.permission_system import PermissionForGet, PermissionUser
+
+
+class IncludePlan(NamedTuple):
+    """Loader options for "include" param of querystring, built by PermissionPlugin once for equal requests"""
+
+    # options for query.options(*options)
+    options: Tuple[Any, ...]
+    # new values of include and fields[...] params for update_querystring, None if querystring is not changed
+    qs_updates: Optional[Dict[str, str]]
+    # permissions of models, which the plan was built with
+    permissions: Tuple[Tuple[Any, PermissionForGet], ...]
+
+    def is_actual(self, permission_user: PermissionUser) -> bool:
+        """
+        Plan is actual while the user gets the same (cached) permissions, which the plan was built with
+        :param permission_user:
+        :return:
+        """
+        return all(
+            permission_user.permission_for_get(i_model) is i_permission for i_model, i_permission in self.permissions
+        )
+
+
+class IncludePlanCache(LRUCache):
+    """
+    LRU cache of include plans, keyed by resource, include and fields params of querystring
+    and the principal fingerprint of the user (see PermissionCache)
+    """
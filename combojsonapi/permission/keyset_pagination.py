@@ -0,0 +1,235 @@
+import base64
+import datetime
+import decimal
+import json
+import uuid
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from flask import g
+from flask_combo_jsonapi.exceptions import BadRequest, InvalidSort
+from flask_combo_jsonapi.querystring import QueryStringManager
+from flask_combo_jsonapi.utils import SPLIT_REL
+from marshmallow import ValidationError, fields
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query, class_mapper
+from sqlalchemy.orm.properties import ColumnProperty
+from werkzeug.datastructures import ImmutableMultiDict
+
+
+CURSOR_PARAM = "page[cursor]"
+# атрибут flask.g, в котором хранится KeysetPage текущего запроса
+_G_KEYSET_PAGE = "_permission_keyset_page"
+
+# значения столбцов этих типов записываются в курсор строками
+_CURSOR_FIELDS = {
+    datetime.datetime: fields.DateTime(),
+    datetime.date: fields.Date(),
+    datetime.time: fields.Time(),
+    decimal.Decimal: fields.Decimal(as_string=True),
+    uuid.UUID: fields.UUID(),
+}
+
+
+def _cursor_field(column_property: ColumnProperty) -> Optional[fields.Field]:
+    try:
+        python_type = column_property.columns[0].type.python_type
+    except NotImplementedError:
+        return None
+    return _CURSOR_FIELDS.get(python_type)
+
+
+class KeysetPage:
+    """
+    Keyset (cursor) pagination of a collection request: rows are selected after (or before) the sort key
+    of the last (first) row of the previous page instead of OFFSET, so deep pages cost as much as the first one.
+
+    Sort key is the "sort" param of querystring (model columns only) and the primary key. The cursor
+    "page[cursor]" is urlsafe base64 of JSON: {"s": sort, "b": backward, "v": values of the sort key},
+    values are null for the first and the last pages.
+    """
+
+    __slots__ = ("model", "sort", "keys", "backward", "values", "next_values", "prev_values", "querystring")
+
+    def __init__(self, model, sort: str, keys: Tuple[Tuple[str, bool], ...], backward: bool = False,
+                 values: Optional[List[Any]] = None):
+        """
+        :param model:
+        :param sort: "sort" param of querystring, the cursor is valid only for the same sorting
+        :param keys: attributes of the sort key and whether they are sorted descending
+        :param backward: rows are selected before values (previous page)
+        :param values: sort key of the row, after (before) which the page starts, None - from the edge
+        """
+        self.model = model
+        self.sort = sort
+        self.keys = keys
+        self.backward = backward
+        self.values = values
+        # курсоры соседних страниц, рассчитываются в process
+        self.next_values: Optional[List[Any]] = None
+        self.prev_values: Optional[List[Any]] = None
+        self.querystring: Dict[str, str] = {}
+
+    @classmethod
+    def from_qs(cls, qs: QueryStringManager, model, allowed_columns: FrozenSet[str]) -> "KeysetPage":
+        """
+        Разбирает сортировку и курсор из qs. Параметр page[cursor] убирается из qs, чтобы его не разбирал
+        QueryStringManager.pagination
+        :param qs:
+        :param model:
+        :param allowed_columns: доступные пользователю атрибуты модели (пустые - доступны все). Значения ключа
+                                сортировки попадают в курсор, поэтому сортировать по недоступным атрибутам нельзя
+        :return:
+        """
+        if qs.qs.get("page[number]"):
+            raise BadRequest("page[number] is not supported by keyset pagination, use page[cursor]",
+                             source={"parameter": "page[number]"})
+        mapper = class_mapper(model)
+        primary_key = [mapper.get_property_by_column(i_column).key for i_column in mapper.primary_key]
+        keys = []
+        for i_sort in qs.sorting:
+            name = i_sort["field"]
+            if SPLIT_REL in name or not isinstance(mapper.attrs.get(name), ColumnProperty):
+                raise InvalidSort(f"Keyset pagination supports sorting by model columns only, not by {name}")
+            if allowed_columns and name not in allowed_columns and name not in primary_key:
+                raise InvalidSort(f"You can't sort on {name}")
+            if any(i_column.nullable for i_column in mapper.attrs[name].columns):
+                # строки с NULL нельзя сравнить с курсором, а порядок NULL зависит от СУБД
+                raise InvalidSort(f"Keyset pagination doesn't support sorting by nullable column {name}")
+            keys.append((name, i_sort["order"] == "desc"))
+        keys.extend((i_name, False) for i_name in primary_key if i_name not in dict(keys))
+
+        page = cls(model, qs.qs.get("sort", ""), tuple(keys))
+        cursor = qs.qs.get(CURSOR_PARAM)
+        if cursor:
+            page.backward, page.values = page.decode_cursor(cursor)
+            qs.qs = ImmutableMultiDict({k: v for k, v in qs.qs.items() if k != CURSOR_PARAM})
+        return page
+
+    @property
+    def columns(self) -> List[str]:
+        """Атрибуты ключа сортировки, они всегда выгружаются в load_only"""
+        return [i_name for i_name, _ in self.keys]
+
+    def encode_cursor(self, backward: bool, values: Optional[List[Any]]) -> str:
+        mapper = class_mapper(self.model)
+        if values is not None:
+            values = [
+                i_value if i_value is None or i_field is None else i_field.serialize("value", {"value": i_value})
+                for i_value, i_field in zip(values, (_cursor_field(mapper.attrs[i_name]) for i_name in self.columns))
+            ]
+        data = json.dumps({"s": self.sort, "b": backward, "v": values}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor: str) -> Tuple[bool, Optional[List[Any]]]:
+        mapper = class_mapper(self.model)
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            if data["s"] != self.sort:
+                raise ValueError("cursor was made for another sorting")
+            values = data["v"]
+            if values is not None:
+                if len(values) != len(self.keys):
+                    raise ValueError("wrong number of values")
+                values = [
+                    i_value if i_value is None or i_field is None else i_field.deserialize(i_value)
+                    for i_value, i_field in zip(values, (_cursor_field(mapper.attrs[i_name]) for i_name in self.columns))
+                ]
+            return bool(data["b"]), values
+        except (ValueError, TypeError, KeyError, ValidationError) as e:
+            raise BadRequest(f"Invalid cursor: {e}", source={"parameter": CURSOR_PARAM})
+
+    def paginate(self, query: Query, size: int) -> Query:
+        """
+        Сортирует запрос по ключу сортировки (в обратном порядке для предыдущей страницы) и выбирает
+        size + 1 строк после курсора, лишняя строка показывает, что есть следующая страница
+        :param query:
+        :param size: page[size], 0 - пагинация отключена
+        :return:
+        """
+        # порядок из sort_query заменяется порядком ключа сортировки
+        query = query.order_by(None)
+        order_by = []
+        for i_name, i_desc in self.keys:
+            attribute = getattr(self.model, i_name)
+            order_by.append(attribute.desc() if i_desc != self.backward else attribute.asc())
+        if size == 0:
+            return query.order_by(*order_by)
+        if self.values is not None:
+            query = query.filter(self._get_criterion())
+        return query.order_by(*order_by).limit(size + 1)
+
+    def _get_criterion(self):
+        """(a, b, c) > (x, y, z) с учётом направления сортировки каждого атрибута"""
+        clauses = []
+        for i, (i_name, i_desc) in enumerate(self.keys):
+            attribute = getattr(self.model, i_name)
+            value = self.values[i]
+            equals = [getattr(self.model, j_name) == self.values[j] for j, (j_name, _) in enumerate(self.keys[:i])]
+            after = attribute < value if i_desc != self.backward else attribute > value
+            clauses.append(and_(*equals, after))
+        return or_(*clauses)
+
+    def process(self, collection: List[Any], qs: QueryStringManager, size: int) -> List[Any]:
+        """
+        Убирает лишнюю строку (и восстанавливает порядок для предыдущей страницы), рассчитывает курсоры
+        соседних страниц
+        :param collection: результат запроса из paginate
+        :param qs:
+        :param size: page[size]
+        :return:
+        """
+        self.querystring = dict(qs.querystring)
+        if size == 0:
+            return collection
+        has_more = len(collection) > size
+        collection = list(collection[:size])
+        if self.backward:
+            collection.reverse()
+        if not collection:
+            return collection
+        first = [getattr(collection[0], i_name) for i_name in self.columns]
+        last = [getattr(collection[-1], i_name) for i_name in self.columns]
+        # страница после курсора: предыдущая есть всегда, следующая - если выбрана лишняя строка.
+        # Для страницы перед курсором наоборот, страницы от края (первая и последняя) без курсора
+        if self.backward:
+            self.prev_values = first if has_more else None
+            self.next_values = last if self.values is not None else None
+        else:
+            self.prev_values = first if self.values is not None else None
+            self.next_values = last if has_more else None
+        return collection
+
+    def get_links(self, base_url: str) -> Dict[str, str]:
+        """
+        Ссылки пагинации по курсорам вместо page[number]
+        :param base_url: url ресурса
+        :return:
+        """
+        querystring = {k: v for k, v in self.querystring.items() if k != CURSOR_PARAM}
+
+        def link(backward: Optional[bool] = None, values: Optional[List[Any]] = None) -> str:
+            args = dict(querystring)
+            if backward is not None:
+                args[CURSOR_PARAM] = self.encode_cursor(backward, values)
+            return f"{base_url}?{urlencode(args)}" if args else base_url
+
+        links = {
+            "self": link(self.backward, self.values) if self.backward or self.values is not None else link(),
+            "first": link(),
+            "last": link(True, None),
+        }
+        if self.next_values is not None:
+            links["next"] = link(False, self.next_values)
+        if self.prev_values is not None:
+            links["prev"] = link(True, self.prev_values)
+        return links
+
+
+def get_keyset_page() -> Optional[KeysetPage]:
+    """KeysetPage текущего запроса"""
+    return getattr(g, _G_KEYSET_PAGE, None)
+
+
+def set_keyset_page(page: Optional[KeysetPage]) -> None:
+    setattr(g, _G_KEYSET_PAGE, page)
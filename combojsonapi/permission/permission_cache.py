@@ -0,0 +1,75 @@
+import time
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from combojsonapi.permission.lru_cache import LRUCache
+
+
+CACHE_KEY = Tuple[Any, str, Hashable]
+
+
+class PermissionCache(LRUCache):
+    """
+    Process-wide cache of merged permissions, shared between requests.
+
+    Merged permissions depend on the user, so the cache has to know which users
+    share the same permissions. It is described by `fingerprint`: a callable, which
+    gets PermissionUser of the current request and returns a hashable value
+    (e.g. a frozenset of user roles). Users with equal fingerprints get the same
+    cached permissions, so everything permission cases depend on (including values
+    used in filters) must be covered by the fingerprint. If the fingerprint is None,
+    permissions are not cached for this request.
+
+    Cached permissions are shared between requests and must not be mutated.
+    Every PermissionPlugin has its own permission cases, so don't share one cache between plugins.
+    Items are (creation time, permissions) keyed by (model, request type, fingerprint).
+    """
+
+    def __init__(
+        self, fingerprint: Callable[[Any], Optional[Hashable]], maxsize: int = 1024, ttl: Optional[float] = None,
+    ):
+        """
+        :param fingerprint: callable returning the principal fingerprint for PermissionUser
+        :param maxsize: max number of cached permissions, least recently used are evicted first
+        :param ttl: lifetime of cached permissions in seconds, None - without expiration
+        """
+        super().__init__(maxsize=maxsize)
+        self.fingerprint = fingerprint
+        self.ttl = ttl
+
+    def get_or_create(self, model, type_: str, fingerprint: Hashable, factory: Callable[[], Any]):
+        """
+        Returns cached permissions, creates them with `factory` if they are missing or expired
+        :param model: sqlalchemy mapper which permissions are for
+        :param type_: get | get_list | post | patch | delete
+        :param fingerprint: principal fingerprint of the current user
+        :param factory: builds permissions if they are not in the cache
+        :return:
+        """
+        key: CACHE_KEY = (model, type_, fingerprint)
+        now = time.monotonic()
+        with self._lock:
+            item: Optional[Tuple[float, Any]] = self.get(key)
+            if item is not None:
+                if self.ttl is None or now - item[0] < self.ttl:
+                    return item[1]
+                self.pop(key)
+
+        # permissions are built outside of the lock, permission cases can be slow
+        value = factory()
+        self.set(key, (now, value))
+        return value
+
+    def invalidate(self, model=None, fingerprint: Hashable = None) -> None:
+        """
+        Drops cached permissions. Without arguments drops everything
+        :param model: drop permissions only for this model
+        :param fingerprint: drop permissions only for this principal fingerprint
+        :return:
+        """
+        if model is None and fingerprint is None:
+            self.clear()
+            return
+        with self._lock:
+            for key in self.keys():
+                if (model is None or key[0] is model) and (fingerprint is None or key[2] == fingerprint):
+                    self.pop(key)
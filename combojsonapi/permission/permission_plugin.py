@@ -1,14 +1,15 @@
 from collections import OrderedDict
 from functools import wraps
-from typing import Union, Tuple, List, Dict, Optional, Set, Type
+from typing import Any, Union, Tuple, List, Dict, Optional, Set, Type, FrozenSet, NamedTuple
 
+from flask import request
 from flask_combo_jsonapi.data_layers.alchemy import SqlalchemyDataLayer
-from werkzeug.datastructures import ImmutableMultiDict
 from marshmallow import class_registry, fields, Schema
 from marshmallow.base import SchemaABC
-from sqlalchemy import Column
-from sqlalchemy.orm.attributes import InstrumentedAttribute
-from sqlalchemy.orm import load_only, joinedload, ColumnProperty, Query
+from marshmallow.exceptions import RegistryError
+from marshmallow_jsonapi.fields import Relationship as GenericRelationship
+from sqlalchemy import event
+from sqlalchemy.orm import load_only, joinedload, selectinload, subqueryload, class_mapper, Mapper, Query
 
 from flask_combo_jsonapi.exceptions import InvalidInclude, BadRequest
 from flask_combo_jsonapi.querystring import QueryStringManager
@@ -18,64 +19,316 @@ from flask_combo_jsonapi.utils import SPLIT_REL
 from flask_combo_jsonapi.resource import ResourceList, ResourceDetail
 from flask_combo_jsonapi.plugin import BasePlugin
 
+from combojsonapi.permission.collection_count import (
+    COLLECTION_COUNT_QUERY,
+    COLLECTION_COUNT_CACHED,
+    CollectionCountCache,
+    check_collection_count_mode,
+    get_count_query,
+)
 from combojsonapi.permission.exceptions import PermissionException
-from combojsonapi.utils import Relationship, get_decorators_for_resource
-from combojsonapi.permission.permission_system import PermissionUser, PermissionToMapper, PermissionForGet
+from combojsonapi.permission.effective_query import EffectiveQuery, update_querystring
+from combojsonapi.permission.include_plan import IncludePlan, IncludePlanCache
+from combojsonapi.permission.keyset_pagination import KeysetPage, get_keyset_page, set_keyset_page
+from combojsonapi.permission.lru_cache import LRUCache
+from combojsonapi.permission.permission_cache import PermissionCache
+from combojsonapi.permission.permission_stats import (
+    PermissionStats,
+    STAGE_PERMISSION_FOR_SCHEMA,
+    STAGE_EAGERLOAD_INCLUDES,
+    STAGE_CREATE_CLEAN_DATA,
+    STAGE_UPDATE_CLEAN_DATA,
+    STAGE_DELETE_CLEAN_DATA,
+    STAGE_COLLECTION_COUNT,
+    measure,
+)
+from combojsonapi.utils import Relationship
+from combojsonapi.permission.restricted_schema import get_restricted_schema
+from combojsonapi.permission.permission_system import (
+    PermissionUser,
+    PermissionToMapper,
+    PermissionFields,
+    PermissionForGet,
+)
+
+
+EAGERLOAD_JOINED = "joined"
+EAGERLOAD_SELECTIN = "selectin"
+EAGERLOAD_SUBQUERY = "subquery"
+# selectin для связей *-to-many, joined для остальных
+EAGERLOAD_AUTO = "auto"
+EAGERLOAD_STRATEGIES = (EAGERLOAD_JOINED, EAGERLOAD_SELECTIN, EAGERLOAD_SUBQUERY, EAGERLOAD_AUTO)
+
+_LOADERS = {
+    EAGERLOAD_JOINED: joinedload,
+    EAGERLOAD_SELECTIN: selectinload,
+    EAGERLOAD_SUBQUERY: subqueryload,
+}
+
+
+def check_eagerload_strategy(strategy: str) -> str:
+    if strategy not in EAGERLOAD_STRATEGIES:
+        raise ValueError(f"Unknown eagerload strategy {strategy!r}, available: {', '.join(EAGERLOAD_STRATEGIES)}")
+    return strategy
+
+
+class EagerloadStrategy(NamedTuple):
+    """Стратегии загрузки связанных моделей из параметра include"""
+
+    # стратегия для всех связей ресурса
+    default: str = EAGERLOAD_JOINED
+    # стратегии для отдельных связей, ключ - путь из include, например "computers" или "computers.owner"
+    relationships: Dict[str, str] = {}
+
+    def get_strategy(self, include_path: str, relationship_property) -> str:
+        """
+        Стратегия загрузки для связи
+        :param include_path: путь до связи из параметра include
+        :param relationship_property: RelationshipProperty связи
+        :return: joined | selectin | subquery
+        """
+        strategy = self.relationships.get(include_path, self.default)
+        if strategy == EAGERLOAD_AUTO:
+            strategy = EAGERLOAD_SELECTIN if relationship_property.uselist else EAGERLOAD_JOINED
+        return strategy
+
+
+# Атрибуты-столбцы для каждой модели, см. get_columns_for_query
+_columns_for_query: Dict[Any, FrozenSet[str]] = {}
+# Запрещённые атрибуты-столбцы модели для набора доступных атрибутов, см. get_forbidden_columns
+_forbidden_columns = LRUCache(maxsize=1024)
+
 
+@event.listens_for(Mapper, "after_configured")
+def _clear_columns_for_query() -> None:
+    """После конфигурации мапперов (например, добавили новую модель-наследника) столбцы пересчитываются"""
+    _columns_for_query.clear()
+    _forbidden_columns.clear()
 
-def get_columns_for_query(model) -> List[str]:
+
+def get_columns_for_query(model) -> FrozenSet[str]:
     """
     Получаем список название атрибутов в моделе, именно как они названы в моделе, т.е., если у нас вот так описано поле
     _permissions = Column('permissions', JSONB, nullable=False), то в columns будет _permissions.
+    Учитываются и унаследованные атрибуты. Рассчитывается один раз для маппера модели
     :param model: модель sqlalchemy
     :return:
     """
-    columns = []
-    for key, value in model.__dict__.items():
-        # Оставляем только атрибуты Column
-        if (isinstance(value, InstrumentedAttribute) or isinstance(value, Column)) and (
-            hasattr(value, "prop") and isinstance(value.prop, ColumnProperty)
-        ):
-            columns.append(key)
+    columns = _columns_for_query.get(model)
+    if columns is None:
+        columns = _columns_for_query[model] = frozenset(i_attr.key for i_attr in class_mapper(model).column_attrs)
     return columns
 
 
-def get_required_fields(field_name: str, model) -> List[str]:
+# Транзитивное замыкание Meta.required_fields для каждой модели, см. get_required_fields_closure
+_required_fields_closures: Dict[Any, Dict[str, Tuple[str, ...]]] = {}
+
+
+def _build_required_fields_closure(model) -> Dict[str, Tuple[str, ...]]:
+    required_fields = getattr(getattr(model, "Meta", {}), "required_fields", {})
+    closure: Dict[str, Tuple[str, ...]] = {}
+
+    def visit(field_name: str, path: List[str]) -> Tuple[str, ...]:
+        if field_name in closure:
+            return closure[field_name]
+        if field_name in path:
+            cycle = " -> ".join(path[path.index(field_name):] + [field_name])
+            raise PermissionException(f"Cycle in {model.__name__}.Meta.required_fields: {cycle}")
+        found_fields = list(required_fields.get(field_name, []))
+        for i_field in required_fields.get(field_name, []):
+            found_fields.extend(visit(i_field, path + [field_name]))
+        closure[field_name] = tuple(dict.fromkeys(found_fields))
+        return closure[field_name]
+
+    for i_field_name in required_fields:
+        visit(i_field_name, [])
+    return {i_name: i_fields for i_name, i_fields in closure.items() if i_fields}
+
+
+def get_forbidden_columns(model, permission: PermissionFields) -> FrozenSet[str]:
+    """
+    Атрибуты-столбцы модели, которые недоступны по пермишенам (для JSONB столбцов достаточно доступа к
+    одному из полей). Рассчитывается один раз для модели и набора доступных атрибутов
+    :param model: модель sqlalchemy
+    :param permission: пермишены пользователя (PermissionForPost, PermissionForPatch)
+    :return: пустое множество, если в пермишен кейсах не указаны ни allow_columns, ни forbidden_columns
+             (доступны все). Если указаны, но доступных атрибутов не осталось, то недоступны все
+    """
+    if not permission.allow_columns and not permission.forbidden_columns:
+        return frozenset()
+    allow_columns = frozenset(
+        i_column.split(SPLIT_REL)[0] for i_column in permission.columns_and_jsonb_columns
+    )
+    key = (model, allow_columns)
+    forbidden_columns = _forbidden_columns.get(key)
+    if forbidden_columns is None:
+        forbidden_columns = get_columns_for_query(model) - allow_columns
+        _forbidden_columns.set(key, forbidden_columns)
+    return forbidden_columns
+
+
+def strip_forbidden_columns(data: Dict[str, Any], model, permission: PermissionFields) -> Dict[str, Any]:
+    """
+    Убирает из data атрибуты-столбцы, недоступные по пермишенам. Остальные ключи (например, связи) не трогаем
+    :param data: данные для создания или обновления объекта
+    :param model: модель sqlalchemy
+    :param permission: пермишены пользователя (PermissionForPost, PermissionForPatch)
+    :return: data, если недоступных атрибутов в нём нет, иначе новый словарь
+    """
+    forbidden_columns = get_forbidden_columns(model, permission)
+    if forbidden_columns.isdisjoint(data):
+        return data
+    return {i_key: i_value for i_key, i_value in data.items() if i_key not in forbidden_columns}
+
+
+def get_required_fields_closure(model) -> Dict[str, Tuple[str, ...]]:
     """
-    Вытаскиваем обязательные поля для загрузки из БД (нужно, например, когда в каком-либо проперти
-    идет неявное обращение к другому отрибуту модели, который не был указан в запросе)
-    :param field_name:
-    :param model:
+    Все обязательные поля (с учётом вложенности) для каждого поля модели из Meta.required_fields.
+    Рассчитывается один раз для модели, при циклических зависимостях выбрасывает PermissionException
+    :param model: модель sqlalchemy
     :return:
     """
-    required_fields = getattr(getattr(model, "Meta", {}), "required_fields", {})
-    found_fields = []
-    if field_name in required_fields:
-        found_fields.extend(required_fields[field_name])
-        for i_field in required_fields[field_name]:
-            found_fields.extend(get_required_fields(i_field, model))
-    return found_fields
+    closure = _required_fields_closures.get(model)
+    if closure is None:
+        closure = _required_fields_closures[model] = _build_required_fields_closure(model)
+    return closure
+
+
+def check_required_fields(schema) -> None:
+    """
+    Рассчитывает get_required_fields_closure для моделей схемы и всех схем, доступных через её связи
+    (Relationship), чтобы циклические зависимости в Meta.required_fields находились при регистрации ресурса,
+    а не в запросе с include
+    :param schema: схема ресурса
+    :return:
+    """
+    schemas = [schema]
+    checked_schemas = set()
+    while schemas:
+        schema_cls = schemas.pop()
+        if isinstance(schema_cls, SchemaABC):
+            schema_cls = type(schema_cls)
+        if schema_cls in checked_schemas:
+            continue
+        checked_schemas.add(schema_cls)
+        model = getattr(getattr(schema_cls, "Meta", None), "model", None)
+        if model is not None:
+            get_required_fields_closure(model)
+        for i_field in schema_cls._declared_fields.values():
+            if not isinstance(i_field, GenericRelationship):
+                continue
+            related_schema = i_field.__dict__["_Relationship__schema"]
+            if related_schema == "self":
+                related_schema = schema_cls
+            elif isinstance(related_schema, str):
+                try:
+                    related_schema = class_registry.get_class(related_schema)
+                except RegistryError:
+                    # схема ещё не объявлена, её модель проверится при первом запросе
+                    continue
+            schemas.append(related_schema)
+
+
+def get_required_columns(name_columns, model) -> Set[str]:
+    """
+    Обязательные поля из Meta.required_fields для столбцов, которые будут загружены из БД
+    :param name_columns: столбцы, которые будут загружены из БД
+    :param model: модель sqlalchemy
+    :return:
+    """
+    required_fields = get_required_fields_closure(model)
+    required_columns = set()
+    for i_name in name_columns:
+        required_columns.update(required_fields.get(i_name, ()))
+    return required_columns
+
+
+class SchemaLayout(NamedTuple):
+    """Поля схемы, доступные пользователю, см. PermissionPlugin._get_schema_layout"""
 
+    # поля схемы, которые будут выгружены
+    only: Tuple[str, ...]
+    # связи схемы из include, которые будут выгружены
+    include_data: Tuple[str, ...]
+    # Nested поля (не Relationship), на схемы которых тоже навешиваются ограничения
+    nested_fields: Tuple[str, ...]
 
-def permission(method, request_type: str, many=False, decorators=None):
+
+# Раскладки полей схем, см. PermissionPlugin._get_schema_layout
+_schema_layouts = LRUCache(maxsize=4096)
+_MISSING = object()
+
+
+def permission(method, request_type: str, many=False, permission_cache: PermissionCache = None,
+               permission_mapper: PermissionToMapper = None, restrict_schema: bool = False,
+               stats: PermissionStats = None, keyset_pagination: bool = False):
     @wraps(method)
     def wrapper(*args, **kwargs):
-        permission_user = PermissionUser(request_type=request_type, many=many)
-        return method(*args, **kwargs, _permission_user=permission_user)
+        permission_user = PermissionUser(request_type=request_type, many=many, permission_cache=permission_cache,
+                                         permission_mapper=permission_mapper, stats=stats)
+        if restrict_schema:
+            # args[0] - экземпляр ресурса, он создаётся на каждый запрос
+            resource = args[0]
+            permission_for_get = permission_user.permission_for_get(resource.data_layer["model"])
+            resource.schema = get_restricted_schema(resource.schema, permission_for_get.columns_and_jsonb_columns)
+        if not keyset_pagination:
+            return method(*args, **kwargs, _permission_user=permission_user)
+
+        set_keyset_page(None)
+        result = method(*args, **kwargs, _permission_user=permission_user)
+        page = get_keyset_page()
+        if page is not None and isinstance(result, dict) and "links" in result:
+            # ссылки по page[number] из add_pagination_links заменяем ссылками по курсорам
+            result["links"] = page.get_links(result["links"]["self"].split("?", 1)[0])
+        return result
 
-    for i_decorator in decorators or []:
-        wrapper = i_decorator(wrapper)
     return wrapper
 
 
 class PermissionPlugin(BasePlugin):
-    def __init__(self, strict: bool = False):
+    def __init__(self, strict: bool = False, permission_cache: PermissionCache = None,
+                 include_plan_cache_size: int = 1024, eagerload_strategy: str = EAGERLOAD_JOINED,
+                 restrict_schemas: bool = False, stats: PermissionStats = None, strip_forbidden_columns: bool = False,
+                 collection_count: str = COLLECTION_COUNT_QUERY, collection_count_ttl: float = 60.0,
+                 collection_count_cache_size: int = 1024):
         """
 
         :param strict: отключать HTTP методы, если не указан ни один пермишен кейс (класс) для них.
                        Событийное API это не касается
+        :param permission_cache: кеш пермишенов, общий для всех запросов. По умолчанию пермишены
+                                 рассчитываются заново в каждом запросе
+        :param include_plan_cache_size: сколько планов загрузки include (опций joinedload/load_only) хранить.
+                                        Планы кешируются, только если указан permission_cache
+        :param eagerload_strategy: стратегия загрузки связей из include по умолчанию: joined | selectin | subquery |
+                                   auto (selectin для связей *-to-many, joined для остальных). Ресурс может
+                                   переопределить её в data_layer ключами eagerload_strategy и eagerload_strategies
+        :param restrict_schemas: в GET запросах заменять схему ресурса подклассом, в котором объявлены только
+                                 доступные пользователю поля (см. get_restricted_schema)
+        :param stats: собирать количество и время выполнения этапов плагина (расчёт пермишенов, ограничение
+                      схем, загрузка include, обработка данных) по моделям, см. PermissionStats
+        :param strip_forbidden_columns: в POST и PATCH запросах убирать из данных атрибуты, недоступные по
+                                        PermissionForPost/PermissionForPatch, до вызова post_data/patch_data кейсов
+        :param collection_count: как считать количество объектов в GET запросах к ResourceList:
+                                 query (по умолчанию) - запросом слоя данных (query.count() по всему запросу
+                                 коллекции),
+                                 stripped - COUNT только по joins и фильтрам запроса, без выгружаемых полей,
+                                 опций загрузки include и сортировки,
+                                 cached - как stripped, но результат кешируется на collection_count_ttl секунд.
+                                 Ресурс может переопределить его в data_layer ключом collection_count
+        :param collection_count_ttl: сколько секунд хранить количество объектов в режиме cached
+        :param collection_count_cache_size: сколько результатов хранить в режиме cached
         """
         self.strict = strict
+        self.permission_cache = permission_cache
+        self.include_plans = IncludePlanCache(maxsize=include_plan_cache_size)
+        self.eagerload_strategy = check_eagerload_strategy(eagerload_strategy)
+        self.restrict_schemas = restrict_schemas
+        self.stats = stats
+        self.strip_forbidden_columns = strip_forbidden_columns
+        self.collection_count = check_collection_count_mode(collection_count)
+        self.collection_counts = CollectionCountCache(maxsize=collection_count_cache_size, ttl=collection_count_ttl)
+        # пермишен кейсы моделей ресурсов данного Api
+        self.permission_mapper = PermissionToMapper()
 
     def after_route(
         self,
@@ -141,18 +394,40 @@ class PermissionPlugin(BasePlugin):
         model = resource.data_layer["model"]
         if not hasattr(resource, l_type):
             return
+        # проверяем Meta.required_fields моделей (в том числе доступных через связи) и стратегии загрузки include
+        # при регистрации роутера
+        get_required_fields_closure(model)
+        if getattr(resource, "schema", None) is not None:
+            check_required_fields(resource.schema)
+        if "eagerload_strategy" in resource.data_layer:
+            check_eagerload_strategy(resource.data_layer["eagerload_strategy"])
+        for i_strategy in resource.data_layer.get("eagerload_strategies", {}).values():
+            check_eagerload_strategy(i_strategy)
+        if "collection_count" in resource.data_layer:
+            check_collection_count_mode(resource.data_layer["collection_count"])
+        keyset_pagination = many and l_type == "get" and resource.data_layer.get("keyset_pagination", False)
 
         permissions = resource.data_layer.get(f"permission_{l_type}", [])
-        PermissionToMapper.add_permission(type_=type_, model=model, permission_class=permissions)
+        self.permission_mapper.add_permission(type_=type_, model=model, permission_class=permissions)
 
         if self.strict and getattr(resource, "event", False) is False and u_type in methods:
             if not permissions:
                 raise PermissionException(f"No permission case for {model.__name__} {type_}")
 
         if u_type in methods:
+            restrict_schema = self.restrict_schemas and l_type == "get"
+            if (not permissions and not restrict_schema and not keyset_pagination
+                    and getattr(resource, "event", False) is False):
+                # без пермишен кейсов метод не оборачиваем: PermissionUser создаётся только если к нему обратятся
+                # хуки плагина (например, для пермишенов моделей из include), см. _get_or_create_permission_user
+                return
             old_method = getattr(resource, l_type)
-            decorators = get_decorators_for_resource(resource, self_json_api)
-            new_method = permission(old_method, request_type=l_type, many=many, decorators=decorators)
+            # Декораторы ресурса и глобальные декораторы Api (Api.route добавляет их в resource.decorators)
+            # применяются только во Flask (Resource.as_view), метод ресурса ими не оборачиваем
+            new_method = permission(old_method, request_type=l_type, many=many,
+                                    permission_cache=self.permission_cache, permission_mapper=self.permission_mapper,
+                                    restrict_schema=restrict_schema, stats=self.stats,
+                                    keyset_pagination=keyset_pagination)
             setattr(resource, l_type, new_method)
         else:
             setattr(resource, l_type, self._resource_method_bad_request)
@@ -183,73 +458,47 @@ class PermissionPlugin(BasePlugin):
         """
         if not columns:
             return
-        # уровень вложенности
-        nesting_size_prefix_column: int = len(prefix_name_column.split(".")) if prefix_name_column else 0
-
-        permission_column: List[str] = []
-        _prefix = f"{prefix_name_column}." if prefix_name_column else ""
-        for i_column in columns:
-            if i_column.startswith(_prefix) and i_column != prefix_name_column:
-                i_name = i_column.split(".")[nesting_size_prefix_column:]
-                permission_column.append(i_name[0])
-        permission_column = list(set(permission_column))
-
+        layout = cls._get_schema_layout(schema, prefix_name_column, columns)
         # если не нашли ни одного разрешённого атрибута, значит все атрибуты доступны (иначе не нужно разрешать
         # выгружать в принципе схему)
-        if not permission_column:
+        if layout is None:
             return
 
-        name_fields = []
-        for i_name_field, i_field in schema.declared_fields.items():
-            if i_name_field in permission_column:
-                name_fields.append(i_name_field)
-
-        only = getattr(schema, "only")
-        only = set(only) if only else set(name_fields)
-        # Оставляем поля только те, которые пользователь запросил через параметр fields[...]
-        only &= set(name_fields)
-        only = tuple(only)
+        only = layout.only
         schema.fields = OrderedDict(**{name: val for name, val in schema.fields.items() if name in only})
         schema.dump_fields = OrderedDict(**{name: val for name, val in schema.fields.items() if name in only})
-
         schema.only = only
-
-        include_data = tuple(i_include for i_include in getattr(schema, "include_data", []) if i_include in name_fields)
-        setattr(schema, "include_data", include_data)
+        setattr(schema, "include_data", layout.include_data)
 
         # навешиваем ограничения на поля схемы, на которую указывает поле JSONB. Если
         # ограничений нет, то выгружаем все поля
-        for i_field_name, i_field in schema.fields.items():
-            if (
-                i_field_name in permission_column
-                and isinstance(i_field, fields.Nested)
-                and not isinstance(i_field, Relationship)
-            ):
-                i_schema = i_field.schema
-                if isinstance(i_schema, SchemaABC):
-                    cls_schema = type(i_schema)
-                else:
-                    cls_schema = i_schema
-                context = getattr(i_field.parent, "context", {})
-                i_schema = cls_schema(
-                    many=i_field.many,
-                    only=i_field.only,
-                    exclude=i_field.exclude,
-                    context=context,
-                    load_only=i_field._nested_normalized_option("load_only"),
-                    dump_only=i_field._nested_normalized_option("dump_only"),
-                )
-                i_field._schema = i_schema
-                cls._permission_for_link_schema(
-                    schema=i_schema,
-                    prefix_name_column=f"{prefix_name_column}.{i_field_name}" if prefix_name_column else i_field_name,
-                    columns=columns,
-                    is_nested=True,
-                    **kwargs,
-                )
+        for i_field_name in layout.nested_fields:
+            i_field = schema.fields[i_field_name]
+            i_schema = i_field.schema
+            if isinstance(i_schema, SchemaABC):
+                cls_schema = type(i_schema)
+            else:
+                cls_schema = i_schema
+            context = getattr(i_field.parent, "context", {})
+            i_schema = cls_schema(
+                many=i_field.many,
+                only=i_field.only,
+                exclude=i_field.exclude,
+                context=context,
+                load_only=i_field._nested_normalized_option("load_only"),
+                dump_only=i_field._nested_normalized_option("dump_only"),
+            )
+            i_field._schema = i_schema
+            cls._permission_for_link_schema(
+                schema=i_schema,
+                prefix_name_column=f"{prefix_name_column}.{i_field_name}" if prefix_name_column else i_field_name,
+                columns=columns,
+                is_nested=True,
+                **kwargs,
+            )
         if not is_nested:
             # Выдераем из схем поля, которые пользователь не должен увидеть
-            for i_include in getattr(schema, "include_data", []):
+            for i_include in layout.include_data:
                 if i_include in schema.fields:
                     cls._permission_for_link_schema(
                         schema=schema.declared_fields[i_include].__dict__["_Relationship__schema"],
@@ -258,6 +507,64 @@ class PermissionPlugin(BasePlugin):
                         **kwargs,
                     )
 
+    @classmethod
+    def _get_schema_layout(
+        cls, schema, prefix_name_column: str, columns: Union[List[str], Set[str]]
+    ) -> Optional[SchemaLayout]:
+        """
+        Поля схемы, доступные по пермишенам. Рассчитываются один раз для класса схемы, набора
+        доступных атрибутов и запрошенных полей (only, include_data)
+        :param schema: экземпляр схемы
+        :param prefix_name_column: путь до схемы в атрибутах модели
+        :param columns: доступные атрибуты модели
+        :return: None, если ограничений на схему нет
+        """
+        columns = columns if isinstance(columns, frozenset) else frozenset(columns)
+        requested_only = getattr(schema, "only")
+        include_data = tuple(getattr(schema, "include_data", []))
+        key = (
+            type(schema),
+            prefix_name_column,
+            columns,
+            frozenset(requested_only) if requested_only else None,
+            frozenset(schema.exclude),
+            include_data,
+        )
+        layout = _schema_layouts.get(key, _MISSING)
+        if layout is not _MISSING:
+            return layout
+
+        # уровень вложенности
+        nesting_size_prefix_column: int = len(prefix_name_column.split(".")) if prefix_name_column else 0
+
+        permission_column: Set[str] = set()
+        _prefix = f"{prefix_name_column}." if prefix_name_column else ""
+        for i_column in columns:
+            if i_column.startswith(_prefix) and i_column != prefix_name_column:
+                i_name = i_column.split(".")[nesting_size_prefix_column:]
+                permission_column.add(i_name[0])
+
+        layout = None
+        if permission_column:
+            name_fields = [i_name_field for i_name_field in schema.declared_fields if i_name_field in permission_column]
+            only = set(requested_only) if requested_only else set(name_fields)
+            # Оставляем поля только те, которые пользователь запросил через параметр fields[...]
+            only &= set(name_fields)
+            layout = SchemaLayout(
+                only=tuple(only),
+                include_data=tuple(i_include for i_include in include_data if i_include in name_fields),
+                nested_fields=tuple(
+                    i_field_name
+                    for i_field_name, i_field in schema.fields.items()
+                    if i_field_name in only
+                    and i_field_name in permission_column
+                    and isinstance(i_field, fields.Nested)
+                    and not isinstance(i_field, Relationship)
+                ),
+            )
+        _schema_layouts.set(key, layout)
+        return layout
+
     @classmethod
     def _permission_for_schema(cls, *args, schema=None, model=None, **kwargs):
         """
@@ -273,20 +580,25 @@ class PermissionPlugin(BasePlugin):
             raise Exception("No permission for user")
 
         permission_column: Set[str] = permission_user.permission_for_get(model=model).columns_and_jsonb_columns
-        cls._permission_for_link_schema(
-            schema=schema, prefix_name_column="", columns=permission_column, **kwargs
-        )
+        with measure(permission_user.stats, STAGE_PERMISSION_FOR_SCHEMA, model):
+            cls._permission_for_link_schema(
+                schema=schema, prefix_name_column="", columns=permission_column, **kwargs
+            )
 
     def after_init_schema_in_resource_list_post(self, *args, schema=None, model=None, **kwargs):
+        self._get_or_create_permission_user(kwargs, many=True)
         self._permission_for_schema(self, *args, schema=schema, model=model, **kwargs)
 
     def after_init_schema_in_resource_list_get(self, *args, schema=None, model=None, **kwargs):
+        self._get_or_create_permission_user(kwargs, many=True)
         self._permission_for_schema(self, *args, schema=schema, model=model, **kwargs)
 
     def after_init_schema_in_resource_detail_get(self, *args, schema=None, model=None, **kwargs):
+        self._get_or_create_permission_user(kwargs, many=False)
         self._permission_for_schema(self, *args, schema=schema, model=model, **kwargs)
 
     def after_init_schema_in_resource_detail_patch(self, *args, schema=None, model=None, **kwargs):
+        self._get_or_create_permission_user(kwargs, many=False)
         self._permission_for_schema(self, *args, schema=schema, model=model, **kwargs)
 
     def data_layer_create_object_clean_data(
@@ -303,10 +615,15 @@ class PermissionPlugin(BasePlugin):
         :param kwargs:
         :return:
         """
-        permission: PermissionUser = self._get_permission_user(view_kwargs)
-        return permission.permission_for_post_data(
-            model=self_json_api.model, data=data, join_fields=join_fields, **view_kwargs
-        )
+        permission: PermissionUser = self._get_or_create_permission_user(view_kwargs, many=True)
+        with measure(self.stats, STAGE_CREATE_CLEAN_DATA, self_json_api.model):
+            if self.strip_forbidden_columns:
+                data = strip_forbidden_columns(
+                    data, self_json_api.model, permission.permission_for_post_permission(self_json_api.model)
+                )
+            return permission.permission_for_post_data(
+                model=self_json_api.model, data=data, join_fields=join_fields, **view_kwargs
+            )
 
     def data_layer_get_object_update_query(
         self, *args, query: Query = None, qs: QueryStringManager = None, view_kwargs=None, self_json_api=None, **kwargs
@@ -324,30 +641,33 @@ class PermissionPlugin(BasePlugin):
         :param kwargs:
         :return: возвращает пропатченный запрос к бд
         """
-        permission: PermissionUser = self._get_permission_user(view_kwargs)
+        permission: PermissionUser = self._get_or_create_permission_user(view_kwargs, many=False)
         permission_for_get: PermissionForGet = permission.permission_for_get(self_json_api.model)
 
         # Навешиваем фильтры (например пользователь не должен видеть некоторые поля)
-        for i_join in permission_for_get.joins:
-            query = query.join(*i_join)
-        query = query.filter(*permission_for_get.filters)
+        row_permission = permission_for_get
+        if permission.request_type == "delete":
+            # доступ на удаление проверяем тем же запросом, которым выгружаем удаляемый объект
+            permission_for_delete = permission.permission_for_delete_permission(self_json_api.model)
+            if permission_for_delete.joins or permission_for_delete.get_filters():
+                row_permission = permission_for_get + permission_for_delete
+        query = self._apply_row_permissions(query, row_permission, permission)
 
         # Навешиваем ограничения по атрибутам (которые доступны & которые запросил пользователь)
         name_columns = permission_for_get.columns
         if qs:
             user_requested_columns = qs.fields.get(self_json_api.resource.schema.Meta.type_)
             if user_requested_columns:
-                name_columns = list(set(name_columns) & set(user_requested_columns))
+                name_columns = name_columns.intersection(user_requested_columns)
         # Убираем relationship поля
-        name_columns = [i_name for i_name in name_columns if i_name in self_json_api.model.__table__.columns.keys()]
-        required_columns_names = []
-        for i_name in name_columns:
-            required_columns_names.extend(get_required_fields(i_name, self_json_api.model))
-        name_columns = list(set(name_columns) | set(required_columns_names))
+        name_columns = list(get_columns_for_query(self_json_api.model).intersection(name_columns))
+        name_columns = list(set(name_columns) | get_required_columns(name_columns, self_json_api.model))
 
         query = query.options(load_only(*name_columns))
         if qs:
-            query = self._eagerload_includes(query, qs, permission, self_json_api=self_json_api)
+            query = self._eagerload_includes(query, qs, permission, self_json_api=self_json_api,
+                                             include_plans=self.include_plans,
+                                             eagerload_strategy=self._get_eagerload_strategy(self_json_api))
 
         # Запретим использовать стандартную функцию eagerload_includes для присоединения сторонних молелей
         self_json_api.eagerload_includes = lambda x, y: x
@@ -366,34 +686,51 @@ class PermissionPlugin(BasePlugin):
         :param kwargs:
         :return: возвращает пропатченный запрос к бд
         """
-        permission: PermissionUser = self._get_permission_user(view_kwargs)
+        permission: PermissionUser = self._get_or_create_permission_user(view_kwargs, many=True)
         permission_for_get: PermissionForGet = permission.permission_for_get(self_json_api.model)
 
         # Навешиваем фильтры (например пользователь не должен видеть некоторые поля)
-        for i_join in permission_for_get.joins:
-            query = query.join(*i_join)
-        query = query.filter(*permission_for_get.filters)
+        query = self._apply_row_permissions(query, permission_for_get, permission)
+
+        keyset_page = None
+        if getattr(self_json_api, "keyset_pagination", False):
+            keyset_page = KeysetPage.from_qs(qs, self_json_api.model, permission_for_get.columns)
+            set_keyset_page(keyset_page)
+            self._set_keyset_pagination(self_json_api)
 
         # Навешиваем ограничения по атрибутам (которые доступны & которые запросил пользователь)
         name_columns = permission_for_get.columns
         user_requested_columns = qs.fields.get(self_json_api.resource.schema.Meta.type_)
         if user_requested_columns:
-            name_columns = list(set(name_columns) & set(user_requested_columns))
+            name_columns = name_columns.intersection(user_requested_columns)
 
         # required fields (from Meta.required_fields)
-        required_columns_names = []
-        for i_name in name_columns:
-            required_columns_names.extend(get_required_fields(i_name, self_json_api.model))
+        required_columns_names = get_required_columns(name_columns, self_json_api.model)
 
         # remove relationship fields
-        name_columns = list(set(name_columns) & set(get_columns_for_query(self_json_api.model)))
-        name_columns = list(set(name_columns) | set(required_columns_names))
+        name_columns = list(get_columns_for_query(self_json_api.model).intersection(name_columns))
+        name_columns = list(set(name_columns) | required_columns_names)
+        if keyset_page is not None:
+            # по ключу сортировки строятся курсоры, поэтому он выгружается, даже если его нет в fields
+            name_columns = list(set(name_columns).union(keyset_page.columns))
 
         query = query.options(load_only(*name_columns))
 
         # Запретим использовать стандартную функцию eagerload_includes для присоединения сторонних молелей
         setattr(self_json_api, "eagerload_includes", False)
-        query = self._eagerload_includes(query, qs, permission, self_json_api=self_json_api)
+        query = self._eagerload_includes(query, qs, permission, self_json_api=self_json_api,
+                                         include_plans=self.include_plans,
+                                         eagerload_strategy=self._get_eagerload_strategy(self_json_api))
+
+        # Количество объектов считается по запросу уже с фильтрами и сортировкой из qs, поэтому подменяем
+        # функцию подсчёта слоя данных (если он не переопределил её сам)
+        collection_count = getattr(self_json_api, "collection_count", self.collection_count)
+        if (collection_count != COLLECTION_COUNT_QUERY
+                and type(self_json_api).get_collection_count is SqlalchemyDataLayer.get_collection_count):
+            setattr(
+                self_json_api, "get_collection_count",
+                lambda count_query, *_, **__: self._get_collection_count(count_query, self_json_api, collection_count),
+            )
         return query
 
     def data_layer_update_object_clean_data(
@@ -417,10 +754,15 @@ class PermissionPlugin(BasePlugin):
         :param kwargs:
         :return: возвращает обновлённый набор данных для нового объекта
         """
-        permission: PermissionUser = self._get_permission_user(view_kwargs)
-        clean_data = permission.permission_for_patch_data(
-            model=self_json_api.model, data=data, obj=obj, join_fields=join_fields, **view_kwargs
-        )
+        permission: PermissionUser = self._get_or_create_permission_user(view_kwargs, many=False)
+        with measure(self.stats, STAGE_UPDATE_CLEAN_DATA, self_json_api.model):
+            if self.strip_forbidden_columns:
+                data = strip_forbidden_columns(
+                    data, self_json_api.model, permission.permission_for_patch_permission(self_json_api.model)
+                )
+            clean_data = permission.permission_for_patch_data(
+                model=self_json_api.model, data=data, obj=obj, join_fields=join_fields, **view_kwargs
+            )
         return clean_data
 
     def data_layer_delete_object_clean_data(
@@ -435,15 +777,95 @@ class PermissionPlugin(BasePlugin):
         :param kwargs:
         :return:
         """
-        permission: PermissionUser = self._get_permission_user(view_kwargs)
-        permission.permission_for_delete(model=self_json_api.model, obj=obj, **view_kwargs)
+        permission: PermissionUser = self._get_or_create_permission_user(view_kwargs, many=False)
+        with measure(self.stats, STAGE_DELETE_CLEAN_DATA, self_json_api.model):
+            permission.permission_for_delete(model=self_json_api.model, obj=obj, **view_kwargs)
+
+    @classmethod
+    def _apply_row_permissions(cls, query: Query, permission_for_get: PermissionForGet,
+                               permission_user: PermissionUser) -> Query:
+        """
+        Навешиваем на запрос joins и filters из пермишенов, а также значения их bindparam
+        :param query:
+        :param permission_for_get:
+        :param permission_user:
+        :return:
+        """
+        for i_join in permission_for_get.joins:
+            query = query.join(*i_join)
+        query = query.filter(*permission_for_get.get_filters())
+        if permission_for_get.params:
+            query = query.params(**permission_for_get.resolve_params(permission_user))
+        return query
 
     @classmethod
-    def _get_permission_user(cls, view_kwargs) -> PermissionUser:
+    def _set_keyset_pagination(cls, self_json_api: SqlalchemyDataLayer) -> None:
+        """
+        Подменяем пагинацию слоя данных на пагинацию по курсорам (KeysetPage текущего запроса)
+        :param self_json_api:
+        :return:
+        """
+        data_layer_cls = type(self_json_api)
+
+        def paginate_query(query: Query, paginate_info: Dict[str, int]) -> Query:
+            page = get_keyset_page()
+            if page is None:
+                return data_layer_cls.paginate_query(self_json_api, query, paginate_info)
+            return page.paginate(query, paginate_info.get("size"))
+
+        def after_get_collection(collection, qs: QueryStringManager, view_kwargs):
+            page = get_keyset_page()
+            if page is not None:
+                collection = page.process(collection, qs, qs.pagination.get("size"))
+            return data_layer_cls.after_get_collection(self_json_api, collection, qs, view_kwargs)
+
+        setattr(self_json_api, "paginate_query", paginate_query)
+        setattr(self_json_api, "after_get_collection", after_get_collection)
+
+    def _get_collection_count(self, query: Query, self_json_api: SqlalchemyDataLayer, collection_count: str) -> int:
+        """
+        Количество объектов коллекции без выгружаемых полей, опций загрузки include и сортировки в запросе
+        :param query: запрос коллекции с пермишенами и параметрами из qs
+        :param self_json_api:
+        :param collection_count: stripped | cached
+        :return:
+        """
+        if self_json_api.disable_collection_count is True:
+            return self_json_api.default_collection_count
+        with measure(self.stats, STAGE_COLLECTION_COUNT, self_json_api.model):
+            count_query = get_count_query(query)
+            if count_query is None:
+                return query.count()
+            if collection_count == COLLECTION_COUNT_CACHED:
+                return self.collection_counts.count(count_query)
+            return count_query.scalar()
+
+    def _get_eagerload_strategy(self, self_json_api: SqlalchemyDataLayer) -> EagerloadStrategy:
+        """
+        Стратегии загрузки include для ресурса (ключи eagerload_strategy и eagerload_strategies в data_layer)
+        :param self_json_api:
+        :return:
+        """
+        return EagerloadStrategy(
+            default=getattr(self_json_api, "eagerload_strategy", self.eagerload_strategy),
+            relationships=getattr(self_json_api, "eagerload_strategies", {}),
+        )
+
+    def _get_or_create_permission_user(self, view_kwargs: Dict[str, Any], many: bool) -> PermissionUser:
+        """
+        PermissionUser текущего запроса. Если метод ресурса не обёрнут декоратором permission (у ресурса нет
+        пермишен кейсов), то PermissionUser создаётся при первом обращении и сохраняется в view_kwargs
+        :param view_kwargs:
+        :param many: запрос к ResourceList или ResourceDetail
+        :return:
+        """
         permission_user = view_kwargs.get("_permission_user")
-        if permission_user is not None:
-            return permission_user
-        raise Exception("No permission for user")
+        if permission_user is None:
+            permission_user = view_kwargs["_permission_user"] = PermissionUser(
+                request_type=request.method.lower(), many=many, permission_cache=self.permission_cache,
+                permission_mapper=self.permission_mapper, stats=self.stats,
+            )
+        return permission_user
 
     @classmethod
     def _get_model(cls, model, name_foreign_key: str) -> str:
@@ -479,28 +901,24 @@ class PermissionPlugin(BasePlugin):
 
     @classmethod
     def _update_qs_fields(
-        cls, type_schema: str, fields: List[str], qs: QueryStringManager = None, name_foreign_key: str = None
+        cls, type_schema: str, fields: List[str], qs: Union[QueryStringManager, EffectiveQuery] = None,
+        name_foreign_key: str = None
     ) -> None:
         """
         Обновляем fields в qs для работы схемы (чтобы она не обращалась к полям, которые не доступны пользователю)
         :param str type_schema: название типа схемы Meta.type_
         :param List[str] fields: список доступных полей
-        :param QueryStringManager qs: параметры из get запроса
+        :param qs: параметры из get запроса, либо EffectiveQuery, которое меняется на месте
         :param str name_foreign_key: название поля в схеме, которое ссылается на схему type_schema
         :return:
         """
-        old_fields = qs._get_key_values("fields")
-        if type_schema in old_fields:
-            new_fields = list(set(old_fields.get(type_schema, [])) & set(fields))
-        else:
-            new_fields = fields
-        new_qs = {k: v for k, v in qs.qs.items() if v != ""}
-        include = new_qs.get("include", "").split(",")
-        if not new_fields and include and name_foreign_key in include:
-            new_qs["include"] = ",".join([inc for inc in include if inc != name_foreign_key])
-        else:
-            new_qs[f"fields[{type_schema}]"] = ",".join(new_fields)
-        qs.qs = ImmutableMultiDict(new_qs)
+        if isinstance(qs, EffectiveQuery):
+            # изменения запишутся в qs один раз, после обработки всех include
+            qs.restrict_fields(type_schema, fields, name_foreign_key=name_foreign_key)
+            return
+        effective_query = EffectiveQuery(qs)
+        effective_query.restrict_fields(type_schema, fields, name_foreign_key=name_foreign_key)
+        update_querystring(qs, effective_query.updates)
 
     @classmethod
     def _get_access_fields_in_schema(
@@ -526,9 +944,7 @@ class PermissionPlugin(BasePlugin):
         current_schema = cls._get_schema(cls_schema, name_foreign_key)
         permission_for_get: PermissionForGet = permission_user.permission_for_get(mapper)
         # ограничиваем выгрузку полей в соответствие с пермишенами
-        name_columns = []
-        if permission_for_get.columns is not None:
-            name_columns = list(set(current_schema._declared_fields.keys()) & permission_for_get.columns)
+        name_columns = list(permission_for_get.columns.intersection(current_schema._declared_fields))
         cls._update_qs_fields(current_schema.Meta.type_, name_columns, qs=qs, name_foreign_key=name_foreign_key)
         return name_columns
 
@@ -551,10 +967,12 @@ class PermissionPlugin(BasePlugin):
 
     @classmethod
     def _get_or_update_joinedload_object(cls, joinedload_object, qs: QueryStringManager, permission_user: PermissionUser,
-                                         model, current_schema: Schema, field: str, include: str, path_index: int):
+                                         model, current_schema: Schema, field: str, include: str, path_index: int,
+                                         include_path: str = None, eagerload_strategy: EagerloadStrategy = None):
         """
-        Checks permissions and makes query joinedload option for accessed fields.
-        :param joinedload_object: sqlalchemy joinedload or None
+        Checks permissions and makes query eagerload option (joinedload, selectinload or subqueryload)
+        for accessed fields.
+        :param joinedload_object: sqlalchemy loader option or None
         :param qs:
         :param permission_user:
         :param model:
@@ -562,12 +980,18 @@ class PermissionPlugin(BasePlugin):
         :param field: attribute of the schema field, pointing to a field from another model
         :param include: param or part of dot-splitted param from querystring "include"
         :param path_index:
+        :param include_path: path from querystring "include" up to this field
+        :param eagerload_strategy: loading strategies of the resource, joinedload by default
         :return:
         """
+        attribute = getattr(model, field)
+        strategy = EAGERLOAD_JOINED
+        if eagerload_strategy is not None:
+            strategy = eagerload_strategy.get_strategy(include_path or include, attribute.property)
         if joinedload_object is None:
-            joinedload_object = joinedload(getattr(model, field))
+            joinedload_object = _LOADERS[strategy](attribute)
         else:
-            joinedload_object = joinedload_object.joinedload(getattr(model, field))
+            joinedload_object = getattr(joinedload_object, _LOADERS[strategy].__name__)(attribute)
 
         # ограничиваем список полей (которые доступны & которые запросил пользователь)
         name_columns = cls._get_access_fields_in_schema(include, current_schema, permission_user, model=model, qs=qs)
@@ -576,64 +1000,104 @@ class PermissionPlugin(BasePlugin):
         if user_requested_columns:
             name_columns = set(name_columns) & set(user_requested_columns)
         # Убираем relationship поля
-        name_columns = set(name_columns) & set(
-            get_columns_for_query(joinedload_object.path[path_index].property.mapper.class_)
-        )
-        required_columns_names = []
-        for i_name in name_columns:
-            required_columns_names.extend(
-                get_required_fields(i_name, joinedload_object.path[path_index].property.mapper.class_)
-            )
-        name_columns = list(set(name_columns) | set(required_columns_names))
+        related_model = joinedload_object.path[path_index].property.mapper.class_
+        name_columns = get_columns_for_query(related_model).intersection(name_columns)
+        name_columns = list(name_columns | get_required_columns(name_columns, related_model))
 
         joinedload_object.load_only(*list(name_columns))
         return joinedload_object, related_schema_cls
 
     @classmethod
-    def _get_joinedload_object_for_splitted_include(cls, include: str, qs: QueryStringManager,
-                                                    permission_user: PermissionUser, current_schema: Schema, model):
+    def _get_include_tree(cls, include: List[str]) -> Dict[str, dict]:
         """
-        Processes dot-splitted params from "include" and makes joinedload option for query.
+        Разбирает параметр include в дерево связей, общие префиксы путей объединяются:
+        ["a.b.c", "a.b.d", "e"] -> {"a": {"b": {"c": {}, "d": {}}}, "e": {}}
+        :param include: список путей из параметра include
+        :return:
+        """
+        tree: Dict[str, dict] = {}
+        for i_include in include:
+            node = tree
+            for i_part in i_include.split(SPLIT_REL):
+                node = node.setdefault(i_part, {})
+        return tree
+
+    @classmethod
+    def _get_options_for_include_tree(
+        cls, tree: Dict[str, dict], qs: QueryStringManager, permission_user: PermissionUser, current_schema: Schema,
+        model, joinedload_object=None, path_index: int = 0, prefix: str = "", eagerload_strategy: EagerloadStrategy = None,
+    ) -> list:
         """
-        joinedload_object = None
-        for i, obj in enumerate(include.split(SPLIT_REL)):
+        Обходит дерево include и делает опции загрузки связей. Каждая связь обрабатывается один раз,
+        недоступные пользователю связи отбрасываются вместе со всеми вложенными в них путями
+        :param tree: дерево связей, см. _get_include_tree
+        :param joinedload_object: опция загрузки родительской связи, None для связей модели ресурса
+        :param path_index: глубина связей дерева в include
+        :param prefix: путь из include до связей дерева
+        :return: опции загрузки для связей tree
+        """
+        options = []
+        for i_include, i_children in tree.items():
             try:
-                field = get_model_field(current_schema, obj)
+                field = get_model_field(current_schema, i_include)
             except Exception as e:
                 raise InvalidInclude(str(e))
 
-            if cls._is_access_foreign_key(obj, model, permission_user) is False:
+            # Возможно пользователь не имеет доступа к данному внешнему ключу
+            if cls._is_access_foreign_key(i_include, model, permission_user) is False:
                 continue
 
-            joinedload_object, current_schema = cls._get_or_update_joinedload_object(
+            include_path = f"{prefix}{i_include}"
+            option, related_schema = cls._get_or_update_joinedload_object(
                 joinedload_object=joinedload_object, qs=qs, permission_user=permission_user, model=model,
-                current_schema=current_schema, field=field, include=obj, path_index=i
+                current_schema=current_schema, field=field, include=i_include, path_index=path_index,
+                include_path=include_path, eagerload_strategy=eagerload_strategy,
             )
-            try:
-                model = cls._get_model(model, field)
-            except ValueError as e:
-                raise InvalidInclude(str(e))
-
-        return joinedload_object
+            if i_children:
+                try:
+                    related_model = cls._get_model(model, field)
+                except ValueError as e:
+                    raise InvalidInclude(str(e))
+                # опции вложенных связей строятся от опции родительской связи и попадают в неё же
+                cls._get_options_for_include_tree(
+                    i_children, qs, permission_user, related_schema, related_model, joinedload_object=option,
+                    path_index=path_index + 1, prefix=f"{include_path}{SPLIT_REL}",
+                    eagerload_strategy=eagerload_strategy,
+                )
+            options.append(option)
+        return options
 
     @classmethod
-    def _get_joinedload_object_for_include(cls, include, qs, permission_user, current_schema, model):
+    def _get_include_options(
+        cls, qs: QueryStringManager, permission_user: PermissionUser, self_json_api: SqlalchemyDataLayer,
+        eagerload_strategy: EagerloadStrategy = None,
+    ) -> Tuple[list, Optional[Dict[str, str]]]:
         """
-        Processes params from "include" and makes joinedload option for query
+        Processes "include" param from querystring and makes eagerload options for included models
+        according to permissions. Paths are merged into a tree first, so common prefixes of paths
+        (e.g. "a.b" in "a.b.c,a.b.d") are checked and loaded once
+        :return: loader options and querystring updates for update_querystring
         """
-        try:
-            field = get_model_field(current_schema, include)
-        except Exception as e:
-            raise InvalidInclude(str(e))
+        effective_query = EffectiveQuery(qs)
+        options = cls._get_options_for_include_tree(
+            cls._get_include_tree(qs.include), effective_query, permission_user, self_json_api.resource.schema,
+            self_json_api.model, eagerload_strategy=eagerload_strategy,
+        )
+        return options, effective_query.updates
 
-        joinedload_object, _ = cls._get_or_update_joinedload_object(joinedload_object=None, model=model, path_index=0,
-                                                                    permission_user=permission_user, qs=qs, field=field,
-                                                                    current_schema=current_schema, include=include)
-        return joinedload_object
+    @classmethod
+    def _build_include_plan(cls, qs: QueryStringManager, permission_user: PermissionUser,
+                            self_json_api: SqlalchemyDataLayer, eagerload_strategy: EagerloadStrategy = None) -> IncludePlan:
+        options, qs_updates = cls._get_include_options(qs, permission_user, self_json_api,
+                                                       eagerload_strategy=eagerload_strategy)
+        # все пермишены, которые были рассчитаны для пользователя к этому моменту
+        permissions = tuple(permission_user._cache_get.items())
+        return IncludePlan(options=tuple(options), qs_updates=qs_updates, permissions=permissions)
 
     @classmethod
     def _eagerload_includes(cls, query: Query, qs: QueryStringManager, permission_user: PermissionUser = None,
-                            self_json_api: SqlalchemyDataLayer = None):
+                            self_json_api: SqlalchemyDataLayer = None, include_plans: IncludePlanCache = None,
+                            eagerload_strategy: EagerloadStrategy = None):
         """
         Processes "include" param from querystring and applies permissions for included models.
         Use eagerload feature of sqlalchemy to optimize data retrieval for include querystring parameter
@@ -642,20 +1106,32 @@ class PermissionPlugin(BasePlugin):
         :param QueryStringManager qs: a querystring manager to retrieve information from url
         :param PermissionUser permission_user: пермишены для пользователя
         :param self_json_api:
+        :param IncludePlanCache include_plans: cache of loader options for equal requests,
+                                               used only if permissions are cached (see PermissionCache)
+        :param EagerloadStrategy eagerload_strategy: loading strategies of the resource, joinedload by default
         :return Query: the query with includes eagerloaded
         """
-        current_schema = self_json_api.resource.schema
-        model = self_json_api.model
-        for include in qs.include:
-            if SPLIT_REL in include:
-                joinedload_object = cls._get_joinedload_object_for_splitted_include(include, qs, permission_user,
-                                                                                    current_schema, model)
-            else:
-                # Возможно пользовать неимеет доступа, к данному внешнему ключу
-                if cls._is_access_foreign_key(include, model, permission_user) is False:
-                    continue
-                joinedload_object = cls._get_joinedload_object_for_include(include, qs, permission_user,
-                                                                           current_schema, model)
-            query = query.options(joinedload_object)
-
-        return query
+        if not qs.include:
+            return query
+        with measure(permission_user.stats, STAGE_EAGERLOAD_INCLUDES, self_json_api.model):
+            fingerprint = permission_user.fingerprint
+            if include_plans is None or fingerprint is None:
+                options, qs_updates = cls._get_include_options(qs, permission_user, self_json_api,
+                                                               eagerload_strategy=eagerload_strategy)
+                update_querystring(qs, qs_updates)
+                return query.options(*options) if options else query
+
+            key = (
+                self_json_api.resource,
+                permission_user.request_type,
+                permission_user.many,
+                fingerprint,
+                qs.qs.get("include"),
+                tuple(sorted((k, v) for k, v in qs.qs.items() if k.startswith("fields["))),
+            )
+            plan = include_plans.get(key)
+            if plan is None or not plan.is_actual(permission_user):
+                plan = cls._build_include_plan(qs, permission_user, self_json_api, eagerload_strategy=eagerload_strategy)
+                include_plans.set(key, plan)
+            update_querystring(qs, plan.qs_updates)
+            return query.options(*plan.options) if plan.options else query
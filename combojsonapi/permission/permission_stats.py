@@ -0,0 +1,110 @@
+import time
+from contextlib import contextmanager
+from threading import RLock
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+
+# stages of PermissionPlugin, which are measured
+STAGE_PERMISSION_FOR_GET = "permission_for_get"
+STAGE_PERMISSION_FOR_SCHEMA = "permission_for_schema"
+STAGE_EAGERLOAD_INCLUDES = "eagerload_includes"
+STAGE_CREATE_CLEAN_DATA = "create_object_clean_data"
+STAGE_UPDATE_CLEAN_DATA = "update_object_clean_data"
+STAGE_DELETE_CLEAN_DATA = "delete_object_clean_data"
+STAGE_COLLECTION_COUNT = "collection_count"
+
+STATS_KEY = Tuple[str, Any]
+
+
+class StageStats(NamedTuple):
+    """Aggregated measurements of a stage for a model"""
+
+    count: int = 0
+    # durations in seconds
+    total: float = 0.0
+    max: float = 0.0
+
+
+class PermissionStats:
+    """
+    Process-wide counts and durations of PermissionPlugin stages (permission merge, schema trimming,
+    include planning, clean data hooks, collection count), grouped by stage and model.
+
+    Measurements are aggregated in `snapshot()` and, if `callback` is set, reported one by one,
+    e.g. to export them to metrics: callback(stage, model, duration).
+    """
+
+    def __init__(self, callback: Optional[Callable[[str, Any, float], None]] = None):
+        """
+        :param callback: called with stage name, model and duration in seconds after every measurement
+        """
+        self.callback = callback
+        self._data: Dict[STATS_KEY, StageStats] = {}
+        self._lock = RLock()
+
+    def record(self, stage: str, model, duration: float) -> None:
+        """
+        Adds a measurement
+        :param stage: name of the stage, see STAGE_* constants
+        :param model: sqlalchemy mapper which the stage was executed for
+        :param duration: duration in seconds
+        :return:
+        """
+        key = (stage, model)
+        with self._lock:
+            stats = self._data.get(key, EMPTY_STAGE_STATS)
+            self._data[key] = StageStats(
+                count=stats.count + 1, total=stats.total + duration, max=max(stats.max, duration),
+            )
+        if self.callback is not None:
+            self.callback(stage, model, duration)
+
+    @contextmanager
+    def measure(self, stage: str, model):
+        """
+        Measures duration of the block, also if it raises an exception
+        :param stage: name of the stage, see STAGE_* constants
+        :param model: sqlalchemy mapper which the stage is executed for
+        :return:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, model, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[STATS_KEY, StageStats]:
+        """Copy of aggregated measurements: {(stage, model): StageStats}"""
+        with self._lock:
+            return dict(self._data)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+EMPTY_STAGE_STATS = StageStats()
+
+
+class _NoMeasure:
+    """Context manager doing nothing (contextlib.nullcontext is not available in python 3.6)"""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_MEASURE = _NoMeasure()
+
+
+def measure(stats: Optional[PermissionStats], stage: str, model):
+    """
+    Measures the block with stats, if they are set
+    :param stats:
+    :param stage: name of the stage, see STAGE_* constants
+    :param model: sqlalchemy mapper which the stage is executed for
+    :return:
+    """
+    return _NO_MEASURE if stats is None else stats.measure(stage, model)
@@ -1,46 +1,99 @@
 import math
-from copy import deepcopy
-from typing import Set, List, Dict, Any, Tuple, Type, Union
+from types import MappingProxyType
+from typing import (
+    FrozenSet, Mapping, List, Dict, Any, Tuple, Type, Union, Optional, Hashable, NamedTuple, Iterable, Sequence,
+)
 
+from sqlalchemy import and_, or_, exists, select, literal_column
 from sqlalchemy.orm import class_mapper, ColumnProperty, RelationshipProperty
+from sqlalchemy.orm.attributes import QueryableAttribute
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.expression import BindParameter, ClauseElement, ColumnElement
+from sqlalchemy.sql.util import ClauseAdapter
 
 from flask_combo_jsonapi.exceptions import JsonApiException
 from flask_combo_jsonapi.utils import SPLIT_REL
 
+from combojsonapi.permission.exceptions import PermissionException
+from combojsonapi.permission.permission_cache import PermissionCache
+from combojsonapi.permission.permission_stats import PermissionStats, STAGE_PERMISSION_FOR_GET, measure
 
-PERMISSION_TO_MAPPER = Dict[
-    str, Dict[
-        str, Any
-    ]
-]
+
+# permission case class and its instance, if the case is reused between requests (see PermissionMixin.reuse_instance)
+PERMISSION_CASE = Tuple[Type['PermissionMixin'], Optional['PermissionMixin']]
+
+
+class ModelPermissions(NamedTuple):
+    """Permission cases of the model for all request types"""
+
+    get: Tuple[PERMISSION_CASE, ...] = ()
+    get_list: Tuple[PERMISSION_CASE, ...] = ()
+    post: Tuple[PERMISSION_CASE, ...] = ()
+    patch: Tuple[PERMISSION_CASE, ...] = ()
+    delete: Tuple[PERMISSION_CASE, ...] = ()
+
+
+EMPTY_MODEL_PERMISSIONS = ModelPermissions()
 
 
 class PermissionToMapper:
     """
     Contains all system permissions
-    Grouped by get/post/patch/delete
+    Grouped by model (sqlalchemy mapper) and get/get_list/post/patch/delete.
+    Every PermissionPlugin has its own registry, so several Api in one process don't share permissions
     """
 
-    get: PERMISSION_TO_MAPPER = {}
-    get_list: PERMISSION_TO_MAPPER = {}
-    post: PERMISSION_TO_MAPPER = {}
-    patch: PERMISSION_TO_MAPPER = {}
-    delete: PERMISSION_TO_MAPPER = {}
+    __slots__ = ("_permissions",)
 
-    @classmethod
-    def add_permission(cls, type_: str, model, permission_class: list) -> None:
+    def __init__(self):
+        self._permissions: Dict[Any, ModelPermissions] = {}
+
+    def add_permission(self, type_: str, model, permission_class: list) -> None:
         """
         Adds new permission class
-        :param type_: get | post | patch | delete
+        :param type_: get | get_list | post | patch | delete
         :param model: sqlalchemy mapper which permissions are for
         :param permission_class:
         :return:
         """
-        data = getattr(cls, type_)
-        data[model.__name__] = {
-            "model": model,
-            "permission": permission_class,
-        }
+        if type_ not in ModelPermissions._fields:
+            raise ValueError(f"Unknown permission type {type_}")
+        # permission cases, which can be reused, are instantiated once
+        permission_cases = tuple(
+            (i_permission, i_permission() if getattr(i_permission, "reuse_instance", False) else None)
+            for i_permission in permission_class
+        )
+        model_permissions = self._permissions.get(model, EMPTY_MODEL_PERMISSIONS)
+        self._permissions[model] = model_permissions._replace(**{type_: permission_cases})
+
+    def get_model_permissions(self, model) -> ModelPermissions:
+        """
+        Returns permission cases of the model for all request types
+        :param model: sqlalchemy mapper which permissions are for
+        :return:
+        """
+        return self._permissions.get(model, EMPTY_MODEL_PERMISSIONS)
+
+    def get_permission_classes(self, type_: str, model) -> List[Type['PermissionMixin']]:
+        """
+        Returns permission classes for the request
+        :param type_: get | get_list | post | patch | delete
+        :param model: sqlalchemy mapper which permissions are for
+        :return:
+        """
+        return [i_permission for i_permission, _ in getattr(self.get_model_permissions(model), type_)]
+
+    def get_permission_cases(self, type_: str, model) -> List['PermissionMixin']:
+        """
+        Returns permission cases (instances) for the request
+        :param type_: get | get_list | post | patch | delete
+        :param model: sqlalchemy mapper which permissions are for
+        :return:
+        """
+        return [
+            i_instance if i_instance is not None else i_permission()
+            for i_permission, i_instance in getattr(self.get_model_permissions(model), type_)
+        ]
 
 
 class PermissionFields:
@@ -50,14 +103,7 @@ class PermissionFields:
     для этого будет нужен вес, пермишен с наибольшим весом победит
     """
 
-    # словарь с разрешёнными столбцами и найбольшим весом пермишена
-    # Например: {'id': 4, 'user_id':1}
-    _allow_columns = {}
-    # словарь с запрещёнными столбцами и найбольшим весом пермишена
-    # Например: {'id': 4, 'user_id':1}
-    _forbidden_columns = {}
-    # Вес данного пермишена. Это нужно для столбцов
-    weight = 0
+    __slots__ = ("_allow_columns", "_forbidden_columns", "weight", "_resolved_columns", "_frozen")
 
     @classmethod
     def _update_columns(cls, self_columns: Dict[str, int], value: Tuple[List[str], int]) -> None:
@@ -65,101 +111,207 @@ class PermissionFields:
             old_weight = self_columns.get(i_name_col, -math.inf)
             self_columns[i_name_col] = value[1] if old_weight < value[1] else old_weight
 
+    def _check_not_frozen(self) -> None:
+        if self._frozen:
+            raise PermissionException(
+                f"{type(self).__name__} is frozen, merged permissions can be shared between requests"
+            )
+
     @property
-    def allow_columns(self) -> Dict[str, int]:
+    def frozen(self) -> bool:
+        return self._frozen
+
+    @property
+    def allow_columns(self) -> Mapping[str, int]:
         return self._allow_columns
 
     @allow_columns.setter
     def allow_columns(self, value: Tuple[List[str], int]) -> None:
+        self._check_not_frozen()
         self._allow_columns = {}
         self._update_columns(self._allow_columns, value)
+        self._resolved_columns = None
 
     @property
-    def forbidden_columns(self) -> Dict[str, int]:
+    def forbidden_columns(self) -> Mapping[str, int]:
         return self._forbidden_columns
 
     @forbidden_columns.setter
     def forbidden_columns(self, value: Tuple[List[str], int]) -> None:
+        self._check_not_frozen()
         self._forbidden_columns = {}
         self._update_columns(self._forbidden_columns, value)
+        self._resolved_columns = None
 
-    def columns_for_jsonb(self, name_col_jsonb):
+    def _resolve_columns(self) -> Tuple[FrozenSet[str], FrozenSet[str], Dict[str, Tuple[str, ...]]]:
+        """
+        Рассчитываем доступные столбцы с учётом весов запрещающих пермишенов:
+        (столбцы без JSONB полей, все столбцы, JSONB поля сгруппированные по столбцам).
+        Рассчитываются при первом обращении и сбрасываются при изменении пермишенов
+        """
+        if self._resolved_columns is None:
+            columns_and_jsonb_columns = [
+                i_name
+                for i_name, i_weight in self._allow_columns.items()
+                if self._forbidden_columns.get(i_name, -math.inf) <= i_weight
+            ]
+            # группируем jsonb поля
+            jsonb_columns: Dict[str, List[str]] = {}
+            for i_col in columns_and_jsonb_columns:
+                if SPLIT_REL in i_col:
+                    col_jsonb = i_col.split(SPLIT_REL)
+                    jsonb_columns.setdefault(col_jsonb[0], []).append(".".join(col_jsonb[1:]))
+            self._resolved_columns = (
+                frozenset(c for c in columns_and_jsonb_columns if SPLIT_REL not in c),
+                frozenset(columns_and_jsonb_columns),
+                {i_name: tuple(i_columns) for i_name, i_columns in jsonb_columns.items()},
+            )
+        return self._resolved_columns
+
+    def columns_for_jsonb(self, name_col_jsonb) -> Optional[Tuple[str, ...]]:
         """
         Выгружает список доступных полей для схемы JSONB для данного пользователя.
         Если ограничений нет, то вернёт None
         :param name_col_jsonb: название поля, которое является JSONB в БД
         :return:
         """
-        columns: Dict[str, int] = self._allow_columns
-
-        for i_name, i_weight in self._forbidden_columns.items():
-            if i_name in columns and columns[i_name] < i_weight:
-                del columns[i_name]
-        jsonb_columns = {}
-        for i_name, i_weight in columns.items():
-            if SPLIT_REL in i_name:
-                jsonb_columns[i_name] = i_weight
-
-        # группируем jsonb поля
-        jsonb_columns_list_allow = {}
-        for i_col in jsonb_columns.keys():
-            col_jsonb = i_col.split(SPLIT_REL)
-            if col_jsonb[0] not in jsonb_columns_list_allow:
-                jsonb_columns_list_allow[col_jsonb[0]] = []
-            jsonb_columns_list_allow[col_jsonb[0]].append(".".join(col_jsonb[1:]))
-
-        return jsonb_columns_list_allow.get(name_col_jsonb)
+        return self._resolve_columns()[2].get(name_col_jsonb)
 
     @property
-    def columns(self) -> Set[str]:
+    def columns(self) -> FrozenSet[str]:
         """Список столбцов, с которыми пользователь может что-либо делать"""
-        columns = deepcopy(self._allow_columns)
-        for i_name, i_weight in self._forbidden_columns.items():
-            if i_name in columns and columns[i_name] < i_weight:
-                del columns[i_name]
-        return {c for c in columns.keys() if SPLIT_REL not in c}
+        return self._resolve_columns()[0]
 
     @property
-    def columns_and_jsonb_columns(self) -> Set[str]:
+    def columns_and_jsonb_columns(self) -> FrozenSet[str]:
         """Список столбцов указанных в пермишен кейсах, с которыми пользователь может что-либо делать"""
-        columns = deepcopy(self._allow_columns)
-        for i_name, i_weight in self._forbidden_columns.items():
-            if i_name in columns and columns[i_name] < i_weight:
-                del columns[i_name]
-        return set(columns.keys())
+        return self._resolve_columns()[1]
+
+    def copy(self) -> 'PermissionFields':
+        """Изменяемая копия пермишенов"""
+        permission = type(self)(weight=self.weight)
+        permission._allow_columns.update(self._allow_columns)
+        permission._forbidden_columns.update(self._forbidden_columns)
+        return permission
+
+    def freeze(self) -> 'PermissionFields':
+        """
+        Делаем пермишены неизменяемыми (например, объединённые пермишены пользователя),
+        чтобы их можно было использовать в разных запросах и потоках без копирования
+        """
+        if not self._frozen:
+            self._allow_columns = MappingProxyType(self._allow_columns)
+            self._forbidden_columns = MappingProxyType(self._forbidden_columns)
+            self._resolve_columns()
+            self._frozen = True
+        return self
 
     def __add__(self, other: 'PermissionFields') -> 'PermissionFields':
+        # неизменяемые пермишены не трогаем, объединяем в их копию
+        permission = self.copy() if self._frozen else self
         for i_name, i_weight in other._allow_columns.items():
-            old_weight = self._allow_columns.get(i_name, -math.inf)
-            self._allow_columns[i_name] = i_weight if old_weight < i_weight else old_weight
+            old_weight = permission._allow_columns.get(i_name, -math.inf)
+            permission._allow_columns[i_name] = i_weight if old_weight < i_weight else old_weight
 
         for i_name, i_weight in other._forbidden_columns.items():
-            old_weight = self._forbidden_columns.get(i_name, -math.inf)
-            self._forbidden_columns[i_name] = i_weight if old_weight < i_weight else old_weight
-        return self
+            old_weight = permission._forbidden_columns.get(i_name, -math.inf)
+            permission._forbidden_columns[i_name] = i_weight if old_weight < i_weight else old_weight
+        permission._resolved_columns = None
+        return permission
 
     def __init__(self, *args, allow_columns: List = None, forbidden_columns: List = None, weight=0, **kwargs):
+        self._frozen: bool = False
+        # Рассчитанные по весам доступные столбцы, см. _resolve_columns
+        self._resolved_columns: Optional[Tuple[FrozenSet[str], FrozenSet[str], Dict[str, Tuple[str, ...]]]] = None
+        # словарь с разрешёнными столбцами и найбольшим весом пермишена
+        # Например: {'id': 4, 'user_id':1}
         self.allow_columns = (allow_columns or [], weight)
+        # словарь с запрещёнными столбцами и найбольшим весом пермишена
+        # Например: {'id': 4, 'user_id':1}
         self.forbidden_columns = (forbidden_columns or [], weight)
+        # Вес данного пермишена. Это нужно для столбцов
         self.weight = weight
 
 
 class PermissionForPatch(PermissionFields):
     """Разрешения для пользователя в методе patch"""
 
+    __slots__ = ()
+
 
 class PermissionForPost(PermissionFields):
     """Разрешения для пользователя в методе post"""
 
+    __slots__ = ()
+
+
+FILTERS_AND = "and"
+FILTERS_OR = "or"
+JOINS_JOIN = "join"
+JOINS_EXISTS = "exists"
+
+
+def _get_bindparam_keys(clause: ClauseElement) -> List[str]:
+    """Имена bindparam выражения, кроме анонимных (значения анонимных параметров сравнивает compare)"""
+    return [
+        i_element.key
+        for i_element in visitors.iterate(clause, {})
+        if isinstance(i_element, BindParameter) and not i_element.unique
+    ]
+
+
+def is_same_clause(clause, other_clause) -> bool:
+    """
+    Сравнение выражений sqlalchemy по структуре (операторы сравнения у выражений строят новые выражения)
+    :param clause:
+    :param other_clause:
+    :return:
+    """
+    if clause is other_clause:
+        return True
+    if isinstance(clause, ClauseElement) and isinstance(other_clause, ClauseElement):
+        # compare не учитывает имена bindparam: owner_id == :user_id и owner_id == :manager_id "одинаковые"
+        return clause.compare(other_clause) and _get_bindparam_keys(clause) == _get_bindparam_keys(other_clause)
+    if isinstance(clause, (ClauseElement, QueryableAttribute)) or isinstance(
+        other_clause, (ClauseElement, QueryableAttribute)
+    ):
+        return False
+    return clause == other_clause
+
+
+def as_join(join) -> tuple:
+    """
+    Join из пермишенов в виде аргументов query.join: атрибут связи или модель (Model.relationship)
+    превращается в (Model.relationship,), пара (модель, условие соединения) остаётся парой
+    :param join:
+    :return:
+    """
+    return tuple(join) if isinstance(join, (list, tuple)) else (join,)
+
+
+def is_same_join(join, other_join) -> bool:
+    join, other_join = as_join(join), as_join(other_join)
+    return len(join) == len(other_join) and all(is_same_clause(i, j) for i, j in zip(join, other_join))
+
+
+def unique_clauses(clauses: Iterable, is_same=is_same_clause) -> list:
+    """
+    Убираем повторяющиеся (по структуре) выражения, порядок сохраняется
+    :param clauses:
+    :param is_same: функция сравнения выражений
+    :return:
+    """
+    result = []
+    for i_clause in clauses:
+        if not any(is_same(i_clause, i_unique_clause) for i_unique_clause in result):
+            result.append(i_clause)
+    return result
+
 
 class PermissionForGet(PermissionFields):
     """Разрешения для пользователя в методе get"""
 
-    # Необходимые фильтры для выгрузки только тех строк, которые доступны данному пользователю (например только
-    # активные пользователи)
-    filters: List = []
-    # joins с другими таблицами для работы фильтров
-    joins: List = []
+    __slots__ = ("filters", "_joins", "params", "combine_filters", "filter_groups", "join_mode")
 
     def __init__(
         self,
@@ -168,16 +320,176 @@ class PermissionForGet(PermissionFields):
         filters: List = None,
         joins: List = None,
         weight=0,
+        params: Dict[str, Any] = None,
+        combine_filters: str = FILTERS_AND,
+        join_mode: str = JOINS_JOIN,
     ):
         super().__init__(allow_columns=allow_columns, forbidden_columns=forbidden_columns, weight=weight)
-        self.filters: List = [] if filters is None else filters
-        self.joins: List = [] if joins is None else joins
+        # Необходимые фильтры для выгрузки только тех строк, которые доступны данному пользователю (например только
+        # активные пользователи)
+        self.filters: Union[List, Tuple] = [] if filters is None else filters
+        # joins с другими таблицами для работы фильтров
+        self.joins = unique_clauses([] if joins is None else joins, is_same=is_same_join)
+        # Значения bindparam из filters и joins. Значение может быть функцией от PermissionUser, тогда оно
+        # вычисляется в каждом запросе, а сами фильтры можно создать один раз и закешировать для всех пользователей
+        self.params: Mapping[str, Any] = {} if params is None else params
+        # Как фильтры объединяются с фильтрами других кейсов при сложении пермишенов: and - строки должны
+        # удовлетворять всем кейсам, or - "разрешающий" кейс, строки должны удовлетворять хотя бы одному из таких кейсов
+        if combine_filters not in (FILTERS_AND, FILTERS_OR):
+            raise ValueError(f"combine_filters must be {FILTERS_AND!r} or {FILTERS_OR!r}")
+        self.combine_filters: str = combine_filters
+        # Как применяются joins: join - присоединяются к запросу, exists - joins вместе с filters кейса сворачиваются
+        # в коррелированный EXISTS, чтобы связи один-ко-многим (например, таблицы ACL) не размножали строки запроса
+        if join_mode not in (JOINS_JOIN, JOINS_EXISTS):
+            raise ValueError(f"join_mode must be {JOINS_JOIN!r} or {JOINS_EXISTS!r}")
+        self.join_mode: str = join_mode
+        # Фильтры "разрешающих" кейсов после сложения пермишенов: внутри группы через AND, группы через OR
+        self.filter_groups: Union[List, Tuple] = []
+
+    @property
+    def joins(self) -> Union[List[tuple], Tuple[tuple, ...]]:
+        return self._joins
+
+    @joins.setter
+    def joins(self, value: Union[List, Tuple]) -> None:
+        # join и exists режимы получают joins в одном виде, см. as_join
+        joins = [as_join(i_join) for i_join in value]
+        self._joins = tuple(joins) if isinstance(value, tuple) else joins
+
+    def resolve_params(self, permission_user: 'PermissionUser') -> Dict[str, Any]:
+        """
+        Значения bindparam для запроса текущего пользователя
+        :param permission_user:
+        :return:
+        """
+        return {
+            i_name: i_value(permission_user) if callable(i_value) else i_value for i_name, i_value in self.params.items()
+        }
+
+    def get_filters(self) -> list:
+        """
+        Фильтры для запроса: filters и, если есть "разрешающие" кейсы, OR их групп фильтров
+        :return:
+        """
+        filters = list(self.filters)
+        if self.combine_filters == FILTERS_OR:
+            groups = [tuple(self.filters)] if self.filters else []
+            filters = []
+        else:
+            groups = list(self.filter_groups)
+        # группа без фильтров разрешает все строки
+        if groups and all(groups):
+            filters.append(or_(*[and_(*i_group) if len(i_group) > 1 else i_group[0] for i_group in groups]))
+        return filters
+
+    def copy(self) -> 'PermissionForGet':
+        permission = super().copy()
+        permission.filters = list(self.filters)
+        permission.joins = list(self.joins)
+        permission.params = dict(self.params)
+        permission.filter_groups = list(self.filter_groups)
+        permission.combine_filters = self.combine_filters
+        permission.join_mode = self.join_mode
+        return permission
+
+    def freeze(self) -> 'PermissionForGet':
+        if not self._frozen:
+            self.filters = tuple(self.filters)
+            self.joins = tuple(self.joins)
+            self.params = MappingProxyType(dict(self.params))
+            self.filter_groups = tuple(self.filter_groups)
+        return super().freeze()
+
+    def get_exists_clause(self) -> ClauseElement:
+        """
+        joins и filters кейса в виде коррелированного подзапроса EXISTS. Join задаётся атрибутом связи
+        (Model.relationship) или парой (модель, условие соединения), как в query.join
+        :return:
+        """
+        from_clauses, where_clauses = [], []
+        for i_join in self.joins:
+            relationship = i_join[-1]
+            if isinstance(relationship, QueryableAttribute) and isinstance(relationship.property, RelationshipProperty):
+                from_clauses_, where_clauses_ = self._get_relationship_join(relationship.property)
+                from_clauses.extend(from_clauses_)
+                where_clauses.extend(where_clauses_)
+            elif len(i_join) == 2:
+                from_clauses.append(i_join[0])
+                where_clauses.append(i_join[1])
+            else:
+                raise PermissionException(
+                    f"Join {i_join} can't be used in {JOINS_EXISTS!r} join_mode, specify relationship or on clause"
+                )
+        subquery = select([literal_column("1")])
+        for i_from in from_clauses:
+            subquery = subquery.select_from(i_from)
+        # все остальные таблицы берутся из внешнего запроса
+        subquery = subquery.where(and_(*where_clauses, *self.filters)).correlate_except(*from_clauses)
+        return exists(subquery)
+
+    @classmethod
+    def _get_relationship_join(cls, prop: RelationshipProperty) -> Tuple[List, List]:
+        """
+        Таблицы и условия соединения связи для подзапроса EXISTS. Таблица self-referential связи
+        заменяется алиасом, иначе подзапрос коррелирует её с внешним запросом
+        :param prop:
+        :return: (таблицы, условия)
+        """
+        target, primaryjoin, secondaryjoin = prop.target, prop.primaryjoin, prop.secondaryjoin
+        if target is prop.parent.local_table:
+            target = target.alias()
+            if prop.secondary is not None:
+                secondaryjoin = ClauseAdapter(target).traverse(secondaryjoin)
+            else:
+                # столбцы связанной строки помечены в primaryjoin аннотацией remote
+                primaryjoin = visitors.replacement_traverse(
+                    primaryjoin, {},
+                    lambda i_element: target.corresponding_column(i_element)
+                    if isinstance(i_element, ColumnElement) and i_element._annotations.get("remote") else None,
+                )
+        if prop.secondary is None:
+            return [target], [primaryjoin]
+        return [target, prop.secondary], [primaryjoin, secondaryjoin]
+
+    def _joins_as_exists(self) -> None:
+        """joins и filters кейса в режиме exists заменяем одним фильтром EXISTS"""
+        if self.join_mode == JOINS_EXISTS:
+            if self.joins:
+                self.filters = [self.get_exists_clause()]
+                self.joins = []
+            self.join_mode = JOINS_JOIN
+
+    def _filters_as_group(self) -> None:
+        """Фильтры "разрешающего" кейса переносим в отдельную группу"""
+        if self.combine_filters == FILTERS_OR:
+            self.filter_groups = unique_clauses(
+                list(self.filter_groups) + [tuple(self.filters)], is_same=is_same_join
+            )
+            self.filters = []
+            self.combine_filters = FILTERS_AND
 
     def __add__(self, other: 'PermissionForGet') -> 'PermissionForGet':
-        super().__add__(other)
-        self.filters += other.filters
-        self.joins += other.joins
-        return self
+        permission = super().__add__(other)
+        permission._joins_as_exists()
+        permission._filters_as_group()
+        if other.join_mode == JOINS_EXISTS and other.joins:
+            other = other.copy()
+            other._joins_as_exists()
+        if other.combine_filters == FILTERS_OR:
+            other_filters, other_groups = [], list(other.filter_groups) + [tuple(other.filters)]
+        else:
+            other_filters, other_groups = other.filters, other.filter_groups
+        permission.filters = unique_clauses(list(permission.filters) + list(other_filters))
+        permission.filter_groups = unique_clauses(
+            list(permission.filter_groups) + list(other_groups), is_same=is_same_join
+        )
+        permission.joins = unique_clauses(list(permission.joins) + list(other.joins), is_same=is_same_join)
+        for i_name, i_value in other.params.items():
+            if i_name in permission.params and permission.params[i_name] is not i_value \
+                    and permission.params[i_name] != i_value:
+                raise PermissionException(f"Bind parameter {i_name} has different values in permissions")
+        permission.params = {**permission.params, **other.params}
+        return permission
 
 
 PermissionFieldType = Type[Union[PermissionForGet, PermissionForPatch, PermissionForPost]]
@@ -186,28 +498,67 @@ PermissionFieldType = Type[Union[PermissionForGet, PermissionForPatch, Permissio
 class PermissionUser:
     """Ограничения для данного пользователя"""
 
-    def __init__(self, request_type: str, many: bool = False):
+    __slots__ = (
+        "request_type",
+        "many",
+        "permission_cache",
+        "permission_mapper",
+        "stats",
+        "_fingerprint",
+        "_fingerprint_calculated",
+        "_cache_get",
+        "_cache_post",
+        "_cache_patch",
+    )
+
+    def __init__(
+        self,
+        request_type: str,
+        many: bool = False,
+        *,
+        permission_mapper: PermissionToMapper,
+        permission_cache: PermissionCache = None,
+        stats: PermissionStats = None,
+    ):
         """
         :param request_type: тип запроса get|post|delete|patch
         :param many: один элемент или множество
+        :param permission_mapper: пермишен кейсы моделей (из PermissionPlugin)
+        :param permission_cache: кеш пермишенов, общий для всех запросов (если не указан, то не используется)
+        :param stats: статистика времени работы PermissionPlugin (если не указана, то не собирается)
         """
         self.request_type: str = request_type
         self.many: bool = many
+        self.permission_cache: Optional[PermissionCache] = permission_cache
+        self.permission_mapper: PermissionToMapper = permission_mapper
+        self.stats: Optional[PermissionStats] = stats
+        self._fingerprint: Optional[Hashable] = None
+        self._fingerprint_calculated: bool = False
         # Уже расчитанные пермишены для GET запроса в данном запросе для current_user
-        self._cache_get: Dict[str, PermissionForGet] = {}
+        self._cache_get: Dict[Any, PermissionForGet] = {}
         # Уже расчитанные пермишены для POST запроса в данном запросе для current_user
-        self._cache_post: Dict[str, PermissionForPost] = {}
+        self._cache_post: Dict[Any, PermissionForPost] = {}
         # Уже расчитанные пермишены для POST запроса в данном запросе для current_user
-        self._cache_patch: Dict[str, PermissionForPatch] = {}
+        self._cache_patch: Dict[Any, PermissionForPatch] = {}
 
     def _join_permissions(self, permission_type: PermissionFieldType, permission_func: str, *args, many: bool = True,
-                          permission_classes: List['PermissionMixin'] = None, **kwargs):
+                          permission_cases: List['PermissionMixin'] = None, **kwargs):
         # unite all permissions available to user for request method (permission_type)
         permission = permission_type()
-        for i_custom_perm in permission_classes:
-            obj_custom_perm = i_custom_perm()
-            permission += getattr(obj_custom_perm, permission_func)(*args, user_permission=self, many=many, **kwargs)
-        return permission
+        for i_custom_perm in permission_cases:
+            permission += getattr(i_custom_perm, permission_func)(*args, user_permission=self, many=many, **kwargs)
+        # merged permissions can be cached and shared between requests
+        return permission.freeze()
+
+    @property
+    def fingerprint(self) -> Optional[Hashable]:
+        """Fingerprint of the current user for the permission cache, calculated once per request"""
+        if not self._fingerprint_calculated:
+            self._fingerprint = (
+                self.permission_cache.fingerprint(self) if self.permission_cache is not None else None
+            )
+            self._fingerprint_calculated = True
+        return self._fingerprint
 
     def permission_for_get(self, model) -> PermissionForGet:
         """
@@ -215,25 +566,46 @@ class PermissionUser:
         :param model: модель
         :return:
         """
-        model_name = model.__name__
-        if model_name not in self._cache_get:
+        if model not in self._cache_get:
             type_ = "get_list" if self.many else "get"
-            if model_name in getattr(PermissionToMapper, type_):
-                permission_classes = getattr(PermissionToMapper, type_)[model_name]["permission"]
-                if permission_classes:
-                    permission = self._join_permissions(permission_type=PermissionForGet, permission_func='get',
-                                                        many=self.many, permission_classes=permission_classes)
-                    self._cache_get[model_name] = permission
-                    return self._cache_get[model_name]
-            # Если у данной схемы нет ограничений знчит доступны все поля в маппере
-            self._cache_get[model_name] = PermissionForGet(
-                allow_columns=[
-                    prop.key
-                    for prop in class_mapper(model).iterate_properties
-                    if isinstance(prop, ColumnProperty) or isinstance(prop, RelationshipProperty)
-                ]
-            )
-        return self._cache_get[model_name]
+            with measure(self.stats, STAGE_PERMISSION_FOR_GET, model):
+                fingerprint = self.fingerprint
+                if fingerprint is None:
+                    self._cache_get[model] = self._calculate_permission_for_get(model, type_)
+                else:
+                    self._cache_get[model] = self.permission_cache.get_or_create(
+                        model, type_, fingerprint, lambda: self._calculate_permission_for_get(model, type_)
+                    )
+        return self._cache_get[model]
+
+    def _calculate_permission_for_get(self, model, type_: str) -> PermissionForGet:
+        permission_cases = self.permission_mapper.get_permission_cases(type_, model)
+        if permission_cases:
+            return self._join_permissions(permission_type=PermissionForGet, permission_func='get',
+                                          many=self.many, permission_cases=permission_cases)
+        # Если у данной схемы нет ограничений знчит доступны все поля в маппере
+        return PermissionForGet(
+            allow_columns=[
+                prop.key
+                for prop in class_mapper(model).iterate_properties
+                if isinstance(prop, ColumnProperty) or isinstance(prop, RelationshipProperty)
+            ]
+        ).freeze()
+
+    def permission_for_get_many(self, model, ids: Iterable) -> PermissionForGet:
+        """
+        Получить ограничения на выгрузку (get) набора объектов модели с известными id. Кейсы получают
+        ids в get и могут проверить доступ ко всем объектам одним запросом. Результат не кешируется
+        :param model: модель
+        :param ids: id объектов
+        :return:
+        """
+        type_ = "get_list" if self.many else "get"
+        permission_cases = self.permission_mapper.get_permission_cases(type_, model)
+        if permission_cases:
+            return self._join_permissions(permission_type=PermissionForGet, permission_func='get', many=self.many,
+                                          permission_cases=permission_cases, ids=frozenset(ids))
+        return self.permission_for_get(model)
 
     def permission_for_post_permission(self, model) -> PermissionForPost:
         """
@@ -241,23 +613,21 @@ class PermissionUser:
         :param model: модель
         :return:
         """
-        model_name = model.__name__
-        if model_name not in self._cache_post:
-            if model_name in PermissionToMapper.post:
-                permission_classes = PermissionToMapper.post[model_name]["permission"]
-                if permission_classes:
-                    permission = self._join_permissions(permission_type=PermissionForPost,
-                                                        permission_func='post_permission',
-                                                        permission_classes=permission_classes)
-                    self._cache_post[model_name] = permission
-                    return self._cache_post[model_name]
+        if model not in self._cache_post:
+            permission_cases = self.permission_mapper.get_permission_cases("post", model)
+            if permission_cases:
+                permission = self._join_permissions(permission_type=PermissionForPost,
+                                                    permission_func='post_permission',
+                                                    permission_cases=permission_cases)
+                self._cache_post[model] = permission
+                return self._cache_post[model]
             # Если у данной схемы нет ограничений знчит доступны все поля в маппере
-            self._cache_post[model_name] = PermissionForPost(
+            self._cache_post[model] = PermissionForPost(
                 allow_columns=[
                     prop.key for prop in class_mapper(model).iterate_properties if isinstance(prop, ColumnProperty)
                 ]
-            )
-        return self._cache_post[model_name]
+            ).freeze()
+        return self._cache_post[model]
 
     def permission_for_patch_permission(self, model) -> PermissionForPatch:
         """
@@ -265,23 +635,31 @@ class PermissionUser:
         :param model: модель
         :return:
         """
-        model_name = model.__name__
-        if model_name not in self._cache_patch:
-            if model_name in PermissionToMapper.patch:
-                permission_classes: List = PermissionToMapper.patch[model_name]["permission"]
-                if permission_classes:
-                    permission = self._join_permissions(permission_type=PermissionForPatch,
-                                                        permission_func='patch_permission',
-                                                        permission_classes=permission_classes)
-                    self._cache_patch[model_name] = permission
-                    return self._cache_patch[model_name]
+        if model not in self._cache_patch:
+            permission_cases = self.permission_mapper.get_permission_cases("patch", model)
+            if permission_cases:
+                permission = self._join_permissions(permission_type=PermissionForPatch,
+                                                    permission_func='patch_permission',
+                                                    permission_cases=permission_cases)
+                self._cache_patch[model] = permission
+                return self._cache_patch[model]
             # Если у данной схемы нет ограничений знчит доступны все поля в маппере
-            self._cache_patch[model_name] = PermissionForPatch(
+            self._cache_patch[model] = PermissionForPatch(
                 allow_columns=[
                     prop.key for prop in class_mapper(model).iterate_properties if isinstance(prop, ColumnProperty)
                 ]
-            )
-        return self._cache_patch[model_name]
+            ).freeze()
+        return self._cache_patch[model]
+
+    def permission_for_delete_permission(self, model) -> PermissionForGet:
+        """
+        Получить ограничения на удаление (delete) в виде filters и joins, которые PermissionPlugin навешивает
+        на запрос, выгружающий удаляемый объект. Доступ проверяется тем же запросом, недоступный объект не найдётся
+        :param model: модель
+        :return:
+        """
+        return self._join_permissions(permission_type=PermissionForGet, permission_func='delete_permission',
+                                      permission_cases=self.permission_mapper.get_permission_cases("delete", model))
 
     def permission_for_post_data(self, *args, model, data: dict, **kwargs) -> dict:
         """
@@ -290,12 +668,8 @@ class PermissionUser:
         :param data: данные, которые нужно очистить
         :return:
         """
-        model_name = model.__name__
-        if model_name in PermissionToMapper.post:
-            permission_classes = PermissionToMapper.post[model_name]["permission"]
-            for i_custom_perm in permission_classes:
-                obj_custom_perm = i_custom_perm()
-                data = obj_custom_perm.post_data(*args, data=data, user_permission=self, **kwargs)
+        for i_custom_perm in self.permission_mapper.get_permission_cases("post", model):
+            data = i_custom_perm.post_data(*args, data=data, user_permission=self, **kwargs)
         return data
 
     def permission_for_patch_data(self, *args, model, data: dict, obj=None, **kwargs) -> dict:
@@ -306,14 +680,27 @@ class PermissionUser:
         :param obj: объект из БД, который обновляем
         :return:
         """
-        model_name = model.__name__
-        if model_name in PermissionToMapper.patch:
-            permission_classes = PermissionToMapper.patch[model_name]["permission"]
-            for i_custom_perm in permission_classes:
-                obj_custom_perm = i_custom_perm()
-                data = obj_custom_perm.patch_data(*args, data=data, obj=obj, user_permission=self, **kwargs)
+        for i_custom_perm in self.permission_mapper.get_permission_cases("patch", model):
+            data = i_custom_perm.patch_data(*args, data=data, obj=obj, user_permission=self, **kwargs)
         return data
 
+    def permission_for_patch_data_many(self, *args, model, data_list: Sequence[dict], objs: Sequence,
+                                       **kwargs) -> List[dict]:
+        """
+
+        :param model: модель
+        :param data_list: данные для каждого объекта, которые нужно очистить
+        :param objs: объекты из БД, которые обновляем (в том же порядке, что и data_list)
+        :return: очищенные данные для каждого объекта
+        """
+        if len(data_list) != len(objs):
+            raise ValueError("data_list and objs must have the same length")
+        data_list = list(data_list)
+        for i_custom_perm in self.permission_mapper.get_permission_cases("patch", model):
+            data_list = i_custom_perm.patch_data_many(*args, data_list=data_list, objs=objs, user_permission=self,
+                                                      **kwargs)
+        return data_list
+
     def permission_for_delete(self, *args, model, obj=None, **kwargs) -> None:
         """
 
@@ -321,22 +708,67 @@ class PermissionUser:
         :param obj: объект из БД, который удаляем
         :return:
         """
-        model_name = model.__name__
-        if model_name in PermissionToMapper.delete:
-            permission_classes = PermissionToMapper.delete[model_name]["permission"]
-            for i_custom_perm in permission_classes:
-                obj_custom_perm = i_custom_perm()
-                if obj_custom_perm.delete(*args, obj=obj, user_permission=self, **kwargs) is False:
-                    raise JsonApiException("It is forbidden to delete the object")
+        for i_custom_perm in self.permission_mapper.get_permission_cases("delete", model):
+            if i_custom_perm.delete(*args, obj=obj, user_permission=self, **kwargs) is False:
+                raise JsonApiException("It is forbidden to delete the object")
+
+    def permission_for_delete_many(self, *args, model, objs: Sequence, **kwargs) -> None:
+        """
+
+        :param model: модель
+        :param objs: объекты из БД, которые удаляем
+        :return:
+        """
+        for i_custom_perm in self.permission_mapper.get_permission_cases("delete", model):
+            # как и в permission_for_delete, запрещает только False (кейс может ничего не вернуть)
+            if any(i is False for i in i_custom_perm.delete_many(*args, objs=objs, user_permission=self, **kwargs)):
+                raise JsonApiException("It is forbidden to delete the object")
 
 
 class PermissionMixin:
     """Миксин для кейсов с пермишенами"""
 
+    # Создавать один экземпляр кейса при регистрации роутера и использовать его во всех запросах.
+    # Можно включать только для кейсов без состояния: такие кейсы не должны изменять атрибуты экземпляра
+    # (в том числе permission_for_get, permission_for_patch, permission_for_post) и должны возвращать
+    # новые объекты с пермишенами в каждом вызове
+    reuse_instance: bool = False
+
     def __init__(self):
-        self.permission_for_get: PermissionForGet = PermissionForGet()
-        self.permission_for_patch: PermissionForPatch = PermissionForPatch()
-        self.permission_for_post: PermissionForPost = PermissionForPost()
+        # объекты с пермишенами создаются при первом обращении, многие кейсы используют только часть из них
+        self._permission_for_get: Optional[PermissionForGet] = None
+        self._permission_for_patch: Optional[PermissionForPatch] = None
+        self._permission_for_post: Optional[PermissionForPost] = None
+
+    @property
+    def permission_for_get(self) -> PermissionForGet:
+        if self._permission_for_get is None:
+            self._permission_for_get = PermissionForGet()
+        return self._permission_for_get
+
+    @permission_for_get.setter
+    def permission_for_get(self, value: PermissionForGet) -> None:
+        self._permission_for_get = value
+
+    @property
+    def permission_for_patch(self) -> PermissionForPatch:
+        if self._permission_for_patch is None:
+            self._permission_for_patch = PermissionForPatch()
+        return self._permission_for_patch
+
+    @permission_for_patch.setter
+    def permission_for_patch(self, value: PermissionForPatch) -> None:
+        self._permission_for_patch = value
+
+    @property
+    def permission_for_post(self) -> PermissionForPost:
+        if self._permission_for_post is None:
+            self._permission_for_post = PermissionForPost()
+        return self._permission_for_post
+
+    @permission_for_post.setter
+    def permission_for_post(self, value: PermissionForPost) -> None:
+        self._permission_for_post = value
 
     def get(self, *args, many=True, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
         """
@@ -344,7 +776,7 @@ class PermissionMixin:
         :param args:
         :param many: запрос отрабатывает для выгрузки списка или одного элемекнта
         :param PermissionUser user_permission: объект, на инстанс с пермишеннами данного пользователя в данном запросе
-        :param kwargs:
+        :param kwargs: в PermissionUser.permission_for_get_many передаётся ids - frozenset id выгружаемых объектов
         :return:
         """
         return self.permission_for_get
@@ -403,3 +835,44 @@ class PermissionMixin:
         :return: True - может удалить, False - нельзя удалить
         """
         return True
+
+    def delete_permission(self, *args, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+        """
+        Ограничения на удаление в виде filters и joins (остальные атрибуты PermissionForGet не учитываются).
+        PermissionPlugin навешивает их на запрос, который выгружает удаляемый объект, поэтому проверку доступа
+        можно сделать в том же запросе, а не загружать связи объекта в delete
+        :param args:
+        :param PermissionUser user_permission: объект, на инстанс с пермишеннами данного пользователя в данном запросе
+        :param kwargs:
+        :return:
+        """
+        return PermissionForGet()
+
+    def patch_data_many(self, *args, data_list: Sequence[dict] = (), objs: Sequence = (),
+                        user_permission: PermissionUser = None, **kwargs) -> List[dict]:
+        """
+        Предобработка данных для обновления нескольких объектов. По умолчанию вызывает patch_data
+        для каждого объекта, кейсы могут переопределить метод и проверить все объекты одним запросом
+        :param args:
+        :param data_list: входные данные для каждого объекта
+        :param objs: обновляемые объекты из БД (в том же порядке, что и data_list)
+        :param PermissionUser user_permission: объект, на инстанс с пермишеннами данного пользователя в данном запросе
+        :param kwargs:
+        :return: очищенные данные для каждого объекта
+        """
+        return [
+            self.patch_data(*args, data=i_data, obj=i_obj, user_permission=user_permission, **kwargs)
+            for i_data, i_obj in zip(data_list, objs)
+        ]
+
+    def delete_many(self, *args, objs: Sequence = (), user_permission: PermissionUser = None, **kwargs) -> List[bool]:
+        """
+        Проверка пермишеннов на возможность удалить несколько объектов. По умолчанию вызывает delete
+        для каждого объекта, кейсы могут переопределить метод и проверить все объекты одним запросом
+        :param args:
+        :param objs: удаляемые объекты из БД
+        :param PermissionUser user_permission: объект, на инстанс с пермишеннами данного пользователя в данном запросе
+        :param kwargs:
+        :return: для каждого объекта True - может удалить, False - нельзя удалить
+        """
+        return [self.delete(*args, obj=i_obj, user_permission=user_permission, **kwargs) for i_obj in objs]
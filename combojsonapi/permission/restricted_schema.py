@@ -0,0 +1,73 @@
+from copy import copy
+from typing import FrozenSet, Set, Type
+
+from marshmallow import fields
+from marshmallow.base import SchemaABC
+from marshmallow_jsonapi.fields import BaseRelationship
+
+from combojsonapi.permission.lru_cache import LRUCache
+
+# Подклассы схем, ограниченные набором доступных атрибутов, см. get_restricted_schema
+_restricted_schemas = LRUCache(maxsize=256)
+
+
+def get_restricted_schema(schema_cls: Type[SchemaABC], columns: FrozenSet[str]) -> Type[SchemaABC]:
+    """
+    Подкласс схемы, в котором объявлены только доступные поля (ограничения на поля вложенных схем JSONB
+    тоже учитываются). Классы создаются один раз для схемы и набора доступных атрибутов, поэтому
+    marshmallow связывает поля и разбирает хуки для каждого набора пермишенов, а не в каждом запросе.
+    Поле id и связи (Relationship) остаются в схеме, ограничения на них навешивает PermissionPlugin
+    :param schema_cls: класс схемы
+    :param columns: доступные атрибуты модели (PermissionForGet.columns_and_jsonb_columns)
+    :return: подкласс схемы, либо сама схема, если все её поля доступны
+    """
+    key = (schema_cls, columns)
+    restricted_schema = _restricted_schemas.get(key)
+    if restricted_schema is None:
+        restricted_schema = _build_restricted_schema(schema_cls, columns, "")
+        _restricted_schemas.set(key, restricted_schema)
+    return restricted_schema
+
+
+def _build_restricted_schema(schema_cls: Type[SchemaABC], columns: FrozenSet[str], prefix_name_column: str):
+    _prefix = f"{prefix_name_column}." if prefix_name_column else ""
+    permission_column: Set[str] = {
+        i_column[len(_prefix):].split(".")[0]
+        for i_column in columns
+        if i_column.startswith(_prefix) and i_column != prefix_name_column
+    }
+    # как и в PermissionPlugin._permission_for_link_schema: нет ни одного разрешённого атрибута - доступны все
+    if not permission_column:
+        return schema_cls
+
+    declared_fields = {}
+    for i_name, i_field in schema_cls._declared_fields.items():
+        if isinstance(i_field, BaseRelationship) or i_name == "id":
+            declared_fields[i_name] = i_field
+        elif i_name in permission_column:
+            declared_fields[i_name] = _restrict_nested_field(i_field, columns, f"{_prefix}{i_name}")
+    if declared_fields == schema_cls._declared_fields:
+        return schema_cls
+
+    # схема не регистрируется в class_registry, чтобы не конфликтовать с исходной по имени
+    meta = type("Meta", (getattr(schema_cls, "Meta", object),), {"register": False})
+    restricted_schema = type(schema_cls)(
+        schema_cls.__name__, (schema_cls,), {"Meta": meta, "__module__": schema_cls.__module__}
+    )
+    restricted_schema._declared_fields = declared_fields
+    return restricted_schema
+
+
+def _restrict_nested_field(field: fields.Field, columns: FrozenSet[str], prefix_name_column: str) -> fields.Field:
+    if not isinstance(field, fields.Nested):
+        return field
+    nested = field.nested
+    if not isinstance(nested, type) or not issubclass(nested, SchemaABC):
+        # схемы, заданные по имени или экземпляром, ограничиваются PermissionPlugin в каждом запросе
+        return field
+    restricted_nested = _build_restricted_schema(nested, columns, prefix_name_column)
+    if restricted_nested is nested:
+        return field
+    field = copy(field)
+    field.nested = restricted_nested
+    return field
@@ -0,0 +1,99 @@
+from unittest import mock
+
+import pytest
+from sqlalchemy import Column, ForeignKey, Integer, String, create_engine
+from sqlalchemy.orm import joinedload, load_only, relationship, sessionmaker
+
+from combojsonapi.permission.collection_count import CollectionCountCache, check_collection_count_mode, get_count_query
+from tests.test_permission import Base
+
+
+class CountOwner(Base):
+    __tablename__ = 'count_owner'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+
+
+class CountItem(Base):
+    __tablename__ = 'count_item'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    type = Column(String)
+    owner_id = Column(Integer, ForeignKey('count_owner.id'))
+    owner = relationship(CountOwner)
+
+    __mapper_args__ = {'polymorphic_on': type, 'polymorphic_identity': 'item'}
+
+
+class CountSubItem(CountItem):
+    __mapper_args__ = {'polymorphic_identity': 'sub_item'}
+
+
+@pytest.fixture()
+def session():
+    engine = create_engine('sqlite:///:memory:')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    owner = CountOwner(id=1, name='owner')
+    session.add_all([
+        CountItem(id=1, name='a', owner=owner),
+        CountItem(id=2, name='b', owner=owner),
+        CountItem(id=3, name='c'),
+        CountSubItem(id=4, name='d', owner=owner),
+    ])
+    session.flush()
+    yield session
+    session.close()
+
+
+def test_check_collection_count_mode():
+    assert check_collection_count_mode('cached') == 'cached'
+    with pytest.raises(ValueError):
+        check_collection_count_mode('estimated')
+
+
+def test_get_count_query(session):
+    query = (session.query(CountItem)
+             .join(CountOwner, CountOwner.id == CountItem.owner_id)
+             .filter(CountOwner.name == 'owner')
+             .options(load_only('name'), joinedload(CountItem.owner))
+             .order_by(CountItem.name))
+    count_query = get_count_query(query)
+
+    sql = str(count_query)
+    assert sql.startswith('SELECT count(count_item.id)')
+    assert 'ORDER BY' not in sql
+    assert 'count_item.name' not in sql
+    assert count_query.scalar() == query.count() == 3
+
+
+@pytest.mark.parametrize('update_query', (
+        pytest.param(lambda query: query.distinct(), id='distinct'),
+        pytest.param(lambda query: query.limit(1), id='limit'),
+        pytest.param(lambda query: query.group_by(CountItem.owner_id), id='group by'),
+        pytest.param(lambda query: query.add_entity(CountOwner), id='several entities'),
+))
+def test_get_count_query__not_supported(session, update_query):
+    assert get_count_query(update_query(session.query(CountItem))) is None
+
+
+def test_get_count_query__single_table_inheritance(session):
+    assert get_count_query(session.query(CountSubItem)) is None
+
+
+def test_collection_count_cache(session):
+    now = [0.0]
+    cache = CollectionCountCache(ttl=10, timer=lambda: now[0])
+    count_query = get_count_query(session.query(CountItem).filter(CountItem.owner_id == 1))
+    with mock.patch.object(type(count_query), 'scalar', return_value=3) as mock_scalar:
+        assert cache.count(count_query) == 3
+        assert cache.count(get_count_query(session.query(CountItem).filter(CountItem.owner_id == 1))) == 3
+        assert mock_scalar.call_count == 1
+        # other params are counted separately
+        cache.count(get_count_query(session.query(CountItem).filter(CountItem.owner_id == 2)))
+        assert mock_scalar.call_count == 2
+        now[0] = 11
+        cache.count(count_query)
+        assert mock_scalar.call_count == 3
@@ -0,0 +1,159 @@
+import datetime
+from urllib.parse import urlsplit
+
+import pytest
+from flask import Flask
+from flask_combo_jsonapi import Api, ResourceList
+from marshmallow_jsonapi import Schema, fields
+from sqlalchemy import Column, DateTime, Integer, String, create_engine
+from sqlalchemy.orm import sessionmaker
+
+from combojsonapi.permission import PermissionForGet, PermissionMixin, PermissionPlugin, PermissionUser
+from combojsonapi.permission.keyset_pagination import KeysetPage
+from tests.test_permission import Base
+
+
+class KeysetItem(Base):
+    __tablename__ = 'keyset_item'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    rank = Column(Integer, nullable=False)
+    created = Column(DateTime, nullable=False)
+    secret = Column(String)
+
+
+class KeysetItemSchema(Schema):
+    class Meta:
+        type_ = 'keyset_item'
+        model = KeysetItem
+
+    id = fields.Integer(as_string=True)
+    name = fields.String()
+    rank = fields.Integer()
+    created = fields.DateTime()
+    secret = fields.String()
+
+
+class KeysetItemPermission(PermissionMixin):
+    def get(self, *args, many=True, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+        return PermissionForGet(allow_columns=['id', 'name', 'rank', 'created'], filters=[KeysetItem.id != 9])
+
+
+# 9 is filtered by permissions, ranks are repeated to check the primary key in the sort key
+ITEMS = [(i, i % 3, datetime.datetime(2020, 1, 1) + datetime.timedelta(hours=i % 4)) for i in range(1, 11)]
+VISIBLE_IDS = [i_id for i_id, _, _ in ITEMS if i_id != 9]
+
+
+@pytest.fixture(scope='module')
+def client():
+    engine = create_engine('sqlite:///:memory:')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([
+        KeysetItem(id=i_id, name=f'item {i_id}', rank=i_rank, created=i_created, secret='secret')
+        for i_id, i_rank, i_created in ITEMS
+    ])
+    session.commit()
+
+    class KeysetItemList(ResourceList):
+        schema = KeysetItemSchema
+        methods = ['GET']
+        data_layer = {
+            'session': session,
+            'model': KeysetItem,
+            'keyset_pagination': True,
+            'permission_get': [KeysetItemPermission],
+        }
+
+    app = Flask(__name__)
+    api = Api(app, plugins=[PermissionPlugin()])
+    api.route(KeysetItemList, 'keyset_item_list', '/keyset_items')
+    yield app.test_client()
+    session.close()
+
+
+def get(client, url: str, **params):
+    response = client.get(url, query_string=params) if params else client.get(url)
+    return response.status_code, response.json
+
+
+def relative(link: str) -> str:
+    url = urlsplit(link)
+    return f'{url.path}?{url.query}'
+
+
+def walk(client, url: str, direction: str, **params):
+    ids = []
+    pages = 0
+    link = url
+    while link:
+        status, result = get(client, link, **params)
+        assert status == 200, result
+        # meta count is the count of all visible rows, not of rows after the cursor
+        assert result['meta']['count'] == len(VISIBLE_IDS)
+        page_ids = [int(i_item['id']) for i_item in result['data']]
+        ids = ids + page_ids if direction == 'next' else page_ids + ids
+        pages += 1
+        link = relative(result['links'][direction]) if direction in result['links'] else None
+        params = {}
+    return ids, pages
+
+
+@pytest.mark.parametrize('sort, key', (
+        pytest.param('-rank', lambda i_item: (-i_item[1], i_item[0]), id='desc with ties'),
+        pytest.param('created,-id', lambda i_item: (i_item[2], -i_item[0]), id='datetime'),
+        pytest.param('', lambda i_item: i_item[0], id='primary key'),
+))
+def test_walk_pages(client, sort, key):
+    expected = [i_item[0] for i_item in sorted(ITEMS, key=key) if i_item[0] != 9]
+    params = {'page[size]': 2}
+    if sort:
+        params['sort'] = sort
+
+    ids, pages = walk(client, '/keyset_items', 'next', **params)
+    assert ids == expected
+    assert pages == 5
+
+    status, result = get(client, '/keyset_items', **params)
+    ids, pages = walk(client, relative(result['links']['last']), 'prev')
+    assert ids == expected
+    assert pages == 5
+
+
+def test_first_page_links(client):
+    status, result = get(client, '/keyset_items', **{'page[size]': 2})
+    assert set(result['links']) == {'self', 'first', 'last', 'next'}
+    assert 'page%5Bcursor%5D' not in result['links']['first']
+
+
+def test_sort_key_is_loaded_without_fields(client):
+    status, result = get(client, '/keyset_items', **{'page[size]': 3, 'sort': 'rank', 'fields[keyset_item]': 'name'})
+    assert status == 200
+    assert set(result['data'][0]['attributes']) == {'name'}
+    status, result = get(client, relative(result['links']['next']))
+    assert [int(i_item['id']) for i_item in result['data']] == [4, 7, 10]
+
+
+@pytest.mark.parametrize('params', (
+        pytest.param({'sort': 'secret'}, id='forbidden column'),
+        pytest.param({'sort': 'name'}, id='nullable column'),
+        pytest.param({'page[number]': 2}, id='page number'),
+        pytest.param({'page[cursor]': 'wrong'}, id='wrong cursor'),
+))
+def test_bad_request(client, params):
+    status, result = get(client, '/keyset_items', **params)
+    assert status == 400
+
+
+def test_cursor_of_another_sorting(client):
+    status, result = get(client, '/keyset_items', **{'page[size]': 2, 'sort': 'rank'})
+    status, result = get(client, relative(result['links']['next']).replace('sort=rank', 'sort=-rank'))
+    assert status == 400
+
+
+def test_encode_cursor():
+    page = KeysetPage(KeysetItem, 'created', (('created', False), ('id', False)))
+    values = [datetime.datetime(2020, 1, 1, 3), 4]
+    assert page.decode_cursor(page.encode_cursor(True, values)) == (True, values)
+    assert page.decode_cursor(page.encode_cursor(False, None)) == (False, None)
@@ -0,0 +1,82 @@
+from unittest import mock
+
+import pytest
+
+from combojsonapi.permission import PermissionCache
+
+
+class ModelOne:
+    pass
+
+
+class ModelTwo:
+    pass
+
+
+class TestPermissionCache:
+
+    @pytest.fixture()
+    def cache(self):
+        return PermissionCache(fingerprint=lambda permission_user: 'role', maxsize=2)
+
+    def test__init__wrong_maxsize(self):
+        with pytest.raises(ValueError):
+            PermissionCache(fingerprint=lambda permission_user: None, maxsize=0)
+
+    def test_get_or_create(self, cache):
+        factory = mock.Mock(return_value='permission')
+        assert cache.get_or_create(ModelOne, 'get', 'admin', factory) == 'permission'
+        assert cache.get_or_create(ModelOne, 'get', 'admin', factory) == 'permission'
+        factory.assert_called_once_with()
+
+    @pytest.mark.parametrize('key', (
+            pytest.param((ModelTwo, 'get', 'admin'), id='other model'),
+            pytest.param((ModelOne, 'get_list', 'admin'), id='other request type'),
+            pytest.param((ModelOne, 'get', 'user'), id='other fingerprint'),
+    ))
+    def test_get_or_create__different_keys(self, cache, key):
+        cache.get_or_create(ModelOne, 'get', 'admin', lambda: 'first')
+        assert cache.get_or_create(*key, lambda: 'second') == 'second'
+
+    def test_get_or_create__lru_eviction(self, cache):
+        cache.get_or_create(ModelOne, 'get', 'admin', lambda: 1)
+        cache.get_or_create(ModelOne, 'get', 'user', lambda: 2)
+        # touch the first one, so the second one becomes least recently used
+        cache.get_or_create(ModelOne, 'get', 'admin', lambda: 3)
+        cache.get_or_create(ModelTwo, 'get', 'admin', lambda: 4)
+
+        assert len(cache) == 2
+        assert cache.get_or_create(ModelOne, 'get', 'admin', lambda: 5) == 1
+        assert cache.get_or_create(ModelOne, 'get', 'user', lambda: 6) == 6
+
+    @mock.patch('combojsonapi.permission.permission_cache.time.monotonic')
+    def test_get_or_create__ttl(self, mock_monotonic):
+        cache = PermissionCache(fingerprint=lambda permission_user: 'role', ttl=10)
+        mock_monotonic.return_value = 100
+        cache.get_or_create(ModelOne, 'get', 'admin', lambda: 1)
+
+        mock_monotonic.return_value = 109
+        assert cache.get_or_create(ModelOne, 'get', 'admin', lambda: 2) == 1
+
+        mock_monotonic.return_value = 110
+        assert cache.get_or_create(ModelOne, 'get', 'admin', lambda: 3) == 3
+
+    @pytest.mark.parametrize('kwargs, left_keys', (
+            pytest.param({}, set(), id='everything'),
+            pytest.param({'model': ModelOne}, {(ModelTwo, 'get', 'admin')}, id='by model'),
+            pytest.param({'fingerprint': 'admin'}, {(ModelOne, 'get', 'user')}, id='by fingerprint'),
+            pytest.param({'model': ModelOne, 'fingerprint': 'admin'},
+                         {(ModelOne, 'get', 'user'), (ModelTwo, 'get', 'admin')}, id='by model and fingerprint'),
+    ))
+    def test_invalidate(self, kwargs, left_keys):
+        cache = PermissionCache(fingerprint=lambda permission_user: 'role')
+        for key in ((ModelOne, 'get', 'admin'), (ModelOne, 'get', 'user'), (ModelTwo, 'get', 'admin')):
+            cache.get_or_create(*key, lambda: 'permission')
+
+        cache.invalidate(**kwargs)
+        assert set(cache._data.keys()) == left_keys
+
+    def test_clear(self, cache):
+        cache.get_or_create(ModelOne, 'get', 'admin', lambda: 'permission')
+        cache.clear()
+        assert len(cache) == 0
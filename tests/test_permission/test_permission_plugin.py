@@ -2,6 +2,7 @@ from functools import wraps
 from unittest import mock
 
 import pytest
+from flask import Flask
 from flask_combo_jsonapi import ResourceList, ResourceDetail, Api, JsonApiException
 from flask_combo_jsonapi.data_layers.alchemy import SqlalchemyDataLayer
 from flask_combo_jsonapi.exceptions import BadRequest, InvalidInclude
@@ -9,19 +10,37 @@ from flask_combo_jsonapi.querystring import QueryStringManager
 from marshmallow import fields, Schema
 from marshmallow_jsonapi import Schema as JsonApiSchema
 from marshmallow_jsonapi.fields import Relationship
-from sqlalchemy import Column, Integer, String, create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Column, ForeignKey, Integer, String, bindparam, create_engine
+from sqlalchemy.orm import Query, sessionmaker, column_property, relationship
 
 from combojsonapi.permission import (
     PermissionPlugin,
     PermissionMixin,
-    PermissionToMapper,
     PermissionUser,
     PermissionForGet,
+    PermissionForPatch,
+    PermissionForPost,
+    PermissionCache,
+    PermissionStats,
+    PermissionToMapper,
 )
 from combojsonapi.permission.exceptions import PermissionException
-from combojsonapi.permission.permission_plugin import get_columns_for_query, get_required_fields, permission
+from combojsonapi.permission.effective_query import EffectiveQuery, update_querystring
+from combojsonapi.permission.include_plan import IncludePlanCache
+from combojsonapi.permission.permission_plugin import (
+    SchemaLayout,
+    EagerloadStrategy,
+    check_eagerload_strategy,
+    get_columns_for_query,
+    get_forbidden_columns,
+    strip_forbidden_columns,
+    check_required_fields,
+    get_required_fields_closure,
+    get_required_columns,
+    permission,
+)
 from tests.test_permission import Base
+from tests.test_permission.test_permission_system import MyModelAccess, MyModelWithAccess
 
 
 JsonApi = Api()
@@ -63,6 +82,58 @@ class RelatedModel(Base):
     other_field = Column(String)
 
 
+class ModelAccess(Base):
+    __tablename__ = 'model_access'
+
+    id = Column(Integer, primary_key=True)
+    model_with_meta_id = Column(Integer, ForeignKey('model_with_meta.id'))
+    user_id = Column(Integer)
+
+
+class IncludeLeaf(Base):
+    __tablename__ = 'include_leaf'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+
+
+class IncludeChild(Base):
+    __tablename__ = 'include_child'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    first_id = Column(Integer, ForeignKey('include_leaf.id'))
+    first = relationship(IncludeLeaf, foreign_keys=[first_id])
+    second_id = Column(Integer, ForeignKey('include_leaf.id'))
+    second = relationship(IncludeLeaf, foreign_keys=[second_id])
+
+
+class IncludeRoot(Base):
+    __tablename__ = 'include_root'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    child_id = Column(Integer, ForeignKey('include_child.id'))
+    child = relationship(IncludeChild)
+
+
+class InheritedParent(Base):
+    __tablename__ = 'inherited_parent'
+
+    id = Column(Integer, primary_key=True)
+    type = Column(Integer)
+    name = Column(String)
+    __mapper_args__ = {'polymorphic_on': type, 'polymorphic_identity': 1}
+
+
+class InheritedChild(InheritedParent):
+    __tablename__ = 'inherited_child'
+
+    id = Column(Integer, ForeignKey('inherited_parent.id'), primary_key=True)
+    extra = Column(String)
+    __mapper_args__ = {'polymorphic_identity': 2}
+
+
 mock_mapper = mock.Mock()
 mock_mapper.class_ = RelatedModel
 ModelWithMeta.related_model_id.mapper = mock_mapper
@@ -95,6 +166,46 @@ class ModelWithMetaSchema(JsonApiSchema):
     related_model_id = Relationship(nested=RelatedModelSchema, schema='RelatedModelSchema', type_='related_model')
 
 
+class IncludeLeafSchema(JsonApiSchema):
+    class Meta:
+        model = IncludeLeaf
+        type_ = 'include_leaf'
+
+    id = fields.Integer()
+    name = fields.String()
+
+
+class IncludeChildSchema(JsonApiSchema):
+    class Meta:
+        model = IncludeChild
+        type_ = 'include_child'
+
+    id = fields.Integer()
+    name = fields.String()
+    first = Relationship(nested=IncludeLeafSchema, schema='IncludeLeafSchema', type_='include_leaf')
+    second = Relationship(nested=IncludeLeafSchema, schema='IncludeLeafSchema', type_='include_leaf')
+
+
+class InheritedChildSchema(JsonApiSchema):
+    class Meta:
+        type_ = 'inherited_child'
+        model = InheritedChild
+
+    id = fields.Integer()
+    name = fields.String()
+    extra = fields.String()
+
+
+class IncludeRootSchema(JsonApiSchema):
+    class Meta:
+        model = IncludeRoot
+        type_ = 'include_root'
+
+    id = fields.Integer()
+    name = fields.String()
+    child = Relationship(nested=IncludeChildSchema, schema='IncludeChildSchema', type_='include_child')
+
+
 @pytest.fixture(scope="module")
 def engine():
     engine = create_engine("sqlite:///:memory:")
@@ -134,6 +245,23 @@ class PermissionWithJoinsAndFilters(PermissionMixin):
         return self.permission_for_get
 
 
+class PermissionWithBindParams(PermissionMixin):
+    reuse_instance = True
+    # the filter is built once, values are bound in every request
+    FILTERS = [ModelWithMeta.type == bindparam('permission_type')]
+
+    def get(self, *args, many=True, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+        return PermissionForGet(allow_columns=['name', 'type'], filters=self.FILTERS,
+                                params={'permission_type': lambda permission_user: permission_user.many + 1})
+
+
+class PermissionWithAccessTable(PermissionMixin):
+    def get(self, *args, many=True, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+        return PermissionForGet(allow_columns=['name', 'type'], filters=[ModelAccess.user_id.in_([1, 2])],
+                                joins=[(ModelAccess, ModelAccess.model_with_meta_id == ModelWithMeta.id)],
+                                join_mode='exists')
+
+
 def test_get_columns_for_query():
     """
     Test if the model with some names
@@ -143,46 +271,180 @@ def test_get_columns_for_query():
 
     res = get_columns_for_query(MyModel)
     # expecting columns names
-    assert res == ["id", "model_entity"]
+    assert res == frozenset(["id", "model_entity"])
+    # columns are calculated once per mapper
+    assert get_columns_for_query(MyModel) is res
 
 
-@pytest.mark.parametrize('field_name, result_fields', (
-        pytest.param('flags', [], id='no required fields'),
-        pytest.param('name', ['flags'], id='own required fields'),
-        pytest.param('description', ['name', 'type', 'flags'], id='own required fields and their required fields')
+def test_get_columns_for_query__inherited_columns():
+    class ParentModel(Base):
+        __tablename__ = "parent_model"
+        id = Column(Integer, primary_key=True)
+        type = Column(Integer)
+        __mapper_args__ = {"polymorphic_on": type, "polymorphic_identity": 1}
 
-))
-def test_get_required_fields(field_name, result_fields):
-    """
-    Function should parse Meta.required_fields from model recursively
-    """
-    assert get_required_fields(field_name, ModelWithMeta) == result_fields
+    class ChildModel(ParentModel):
+        __mapper_args__ = {"polymorphic_identity": 2}
+        child_type = column_property(ParentModel.type + 1)
+
+    assert get_columns_for_query(ChildModel) == frozenset(["id", "type", "child_type"])
+
+
+def test_get_columns_for_query__mapper_configured():
+    res = get_columns_for_query(MyModel)
+
+    class OtherModel(Base):
+        __tablename__ = "other_model"
+        id = Column(Integer, primary_key=True)
+
+    get_columns_for_query(OtherModel)
+    assert get_columns_for_query(MyModel) is not res
+
+
+def test_get_forbidden_columns():
+    permission = PermissionForPatch(allow_columns=['name', 'settings.first_attr', 'related_model_id'])
+    res = get_forbidden_columns(ModelWithMeta, permission)
+    assert res == frozenset(['id', 'type', 'flags', 'description'])
+    # calculated once for the model and allowed columns
+    assert get_forbidden_columns(ModelWithMeta, permission.copy()) is res
+    # no allowed columns - everything is allowed
+    assert get_forbidden_columns(ModelWithMeta, PermissionForPatch()) == frozenset()
+
+
+def test_get_forbidden_columns__nothing_allowed():
+    all_columns = frozenset(['id', 'name', 'type', 'flags', 'description', 'settings', 'related_model_id'])
+    # every allowed column is forbidden with a greater weight
+    permission = PermissionForPatch(allow_columns=['name'])
+    permission += PermissionForPatch(forbidden_columns=['name'], weight=1)
+    assert permission.columns_and_jsonb_columns == frozenset()
+    assert get_forbidden_columns(ModelWithMeta, permission) == all_columns
+    # only forbidden columns are declared
+    assert get_forbidden_columns(ModelWithMeta, PermissionForPatch(forbidden_columns=['name'])) == all_columns
+    assert strip_forbidden_columns({'name': 'test', 'relationship': 1}, ModelWithMeta,
+                                   PermissionForPatch(forbidden_columns=['name'])) == {'relationship': 1}
+
+
+def test_strip_forbidden_columns():
+    permission = PermissionForPatch(allow_columns=['name'])
+    data = {'name': 'test', 'description': 'forbidden', 'related_model_id': 1}
+    # non-column keys (relationships) are left for permission cases
+    assert strip_forbidden_columns(data, ModelWithMeta, permission) == {'name': 'test'}
+    assert data['description'] == 'forbidden'
+    allowed_data = {'name': 'test', 'relationship': 1}
+    assert strip_forbidden_columns(allowed_data, ModelWithMeta, permission) is allowed_data
+
+
+def test_permission__restrict_schema():
+    class SomeResource:
+        schema = ModelWithMetaSchema
+        data_layer = {'model': ModelWithMeta}
+
+        def get(self, *args, **kwargs):
+            return self.schema
+
+    permission_mapper = PermissionToMapper()
+    permission_mapper.add_permission('get', ModelWithMeta, [SomePermission])
+    new_method = permission(SomeResource.get, request_type='get', permission_mapper=permission_mapper,
+                            restrict_schema=True)
+    restricted_schema = new_method(SomeResource())
+
+    assert issubclass(restricted_schema, ModelWithMetaSchema)
+    assert set(restricted_schema._declared_fields) == {'id', 'name', 'type', 'description', 'settings',
+                                                       'related_model_id'}
+    # the schema of the resource class is not changed
+    assert SomeResource.schema is ModelWithMetaSchema
+
+
+def test_get_required_fields_closure():
+    closure = get_required_fields_closure(ModelWithMeta)
+    assert closure == {'description': ('name', 'type', 'flags'), 'name': ('flags', )}
+    # closure is calculated once per model
+    assert get_required_fields_closure(ModelWithMeta) is closure
+
+
+def test_get_required_fields_closure__cycle():
+    class ModelWithCycle:
+        class Meta:
+            required_fields = {
+                'description': ['name'],
+                'name': ['flags'],
+                'flags': ['name'],
+            }
+
+    with pytest.raises(PermissionException) as e:
+        get_required_fields_closure(ModelWithCycle)
+    assert e.value.args[0] == 'Cycle in ModelWithCycle.Meta.required_fields: name -> flags -> name'
+
+
+def test_check_required_fields():
+    class ModelWithCycle:
+        class Meta:
+            required_fields = {'name': ['flags'], 'flags': ['name']}
+
+    class CycleSchema(JsonApiSchema):
+        class Meta:
+            type_ = 'cycle'
+            model = ModelWithCycle
+
+        id = fields.Integer()
+        parent = Relationship(schema='self', type_='cycle')
+
+    class RootSchema(JsonApiSchema):
+        class Meta:
+            type_ = 'root'
+            model = ModelWithMeta
+
+        id = fields.Integer()
+        related = Relationship(nested=RelatedModelSchema, schema='RelatedModelSchema', type_='related_model')
+        cycle = Relationship(schema=CycleSchema, type_='cycle')
+        not_declared = Relationship(schema='NotDeclaredSchema', type_='not_declared')
+
+    # the cycle is found in the model of the related schema, not declared schemas are skipped
+    with pytest.raises(PermissionException) as e:
+        check_required_fields(RootSchema)
+    assert e.value.args[0] == 'Cycle in ModelWithCycle.Meta.required_fields: name -> flags -> name'
+    check_required_fields(ModelWithMetaSchema)
+
+
+def test_get_required_columns():
+    assert get_required_columns(['id', 'description', 'name'], ModelWithMeta) == {'name', 'type', 'flags'}
 
 
 def test_permission():
     """
     This decorator should create PermissionUser instance and pass it to decorated method
-    and apply other decorators passed as parameter
     """
     def some_method(*args, **kwargs):
         return args, kwargs
 
-    def some_decorator(method):
-        @wraps(method)
-        def wrapper(*args, **kwargs):
-            return method(*args, some_decorator_mark=True, **kwargs)
-        return wrapper
-
-    request_type, many = 'test', 'many'
-    new_method = permission(some_method, request_type=request_type, many=many, decorators=[some_decorator])
+    request_type, many, permission_mapper = 'test', 'many', PermissionToMapper()
+    new_method = permission(some_method, request_type=request_type, many=many, permission_mapper=permission_mapper)
 
     result = new_method()
     # check that permission user passed to decorated method with params
     permission_user = result[1]['_permission_user']
     assert (permission_user.request_type, permission_user.many) == (request_type, many)
+    assert permission_user.permission_mapper is permission_mapper
+
+
+def test_check_eagerload_strategy():
+    assert check_eagerload_strategy('selectin') == 'selectin'
+    with pytest.raises(ValueError):
+        check_eagerload_strategy('lazy')
 
-    # check that some_decorator applied
-    assert result[1]['some_decorator_mark']
+
+@pytest.mark.parametrize('eagerload_strategy, include_path, uselist, result', (
+        pytest.param(EagerloadStrategy(), 'computers', True, 'joined', id='joined by default'),
+        pytest.param(EagerloadStrategy('selectin'), 'computers', False, 'selectin', id='resource strategy'),
+        pytest.param(EagerloadStrategy('joined', {'computers': 'subquery'}), 'computers', True, 'subquery',
+                     id='relationship strategy'),
+        pytest.param(EagerloadStrategy('joined', {'computers': 'subquery'}), 'owner', True, 'joined',
+                     id='other relationship'),
+        pytest.param(EagerloadStrategy('auto'), 'computers', True, 'selectin', id='auto to-many'),
+        pytest.param(EagerloadStrategy('auto'), 'owner', False, 'joined', id='auto to-one'),
+))
+def test_eagerload_strategy(eagerload_strategy, include_path, uselist, result):
+    assert eagerload_strategy.get_strategy(include_path, mock.Mock(uselist=uselist)) == result
 
 
 class TestPermissionPlugin:
@@ -228,7 +490,7 @@ class TestPermissionPlugin:
 
     @pytest.fixture()
     def permission_user(self):
-        return PermissionUser(request_type='get')
+        return PermissionUser(request_type='get', permission_mapper=PermissionToMapper())
 
     @pytest.fixture()
     def sqlalchemy_data_layer(self, session, resource_detail):
@@ -274,11 +536,9 @@ class TestPermissionPlugin:
             resource.data_layer[f'permission_{method}'] = permission_list
             instance._permission_method(resource, method, JsonApi)
 
-            # check that permissions were added to PermissionToMapper
-            assert getattr(PermissionToMapper, permission_type)[ModelWithMeta.__name__] == {
-                'model': ModelWithMeta,
-                'permission': permission_list,
-            }
+            # check that permissions were added to PermissionToMapper of the plugin
+            assert instance.permission_mapper.get_permission_classes(permission_type, ModelWithMeta) == \
+                permission_list
 
             # check that new method is decorated by "permission" decorator
             assert getattr(resource, method) == mock_permission.return_value
@@ -287,7 +547,72 @@ class TestPermissionPlugin:
             kwargs = mock_permission.call_args[1]
             assert kwargs['request_type'] == method
             assert kwargs['many'] == many
-            assert kwargs['decorators'] == list(resource.decorators)
+            assert kwargs['permission_cache'] is instance.permission_cache
+            assert kwargs['permission_mapper'] is instance.permission_mapper
+
+    def test__permission_method__decorators(self, session):
+        calls = []
+
+        def counting_decorator(name):
+            def decorator(view):
+                @wraps(view)
+                def wrapper(*args, **kwargs):
+                    calls.append(name)
+                    return view(*args, **kwargs)
+                return wrapper
+            return decorator
+
+        class DecoratedList(ResourceList):
+            schema = ModelWithMetaSchema
+            methods = ['GET']
+            decorators = (counting_decorator('resource'), )
+            data_layer = {'session': session, 'model': ModelWithMeta, 'permission_get': [SomePermission]}
+
+        app = Flask(__name__)
+        api = Api(app, decorators=(counting_decorator('global'), ), plugins=[PermissionPlugin()])
+        api.route(DecoratedList, 'decorated_list', '/decorated')
+        response = app.test_client().get('/decorated')
+
+        assert response.status_code == 200, response.json
+        # decorators are applied by Flask only, each of them runs once per request
+        assert sorted(calls) == ['global', 'resource']
+
+    @pytest.mark.parametrize('resource_class_type, methods', (
+            ('list', ('get', 'post')),
+            ('detail', ('get', 'patch', 'delete')),
+    ))
+    def test__permission_method__without_permission_cases(self, instance, resource_detail, resource_list,
+                                                          resource_class_type, methods):
+        resource = {'list': resource_list, 'detail': resource_detail}[resource_class_type]
+        for method in methods:
+            old_method = getattr(resource, method)
+            instance._permission_method(resource, method, JsonApi)
+            # the method is not wrapped, PermissionUser is created by the hooks if they need it
+            assert getattr(resource, method) is old_method
+
+    @mock.patch('combojsonapi.permission.permission_plugin.permission')
+    def test__permission_method__event_without_permission_cases(self, mock_permission, instance, resource_list):
+        # events get PermissionUser in kwargs['_permission_user']
+        resource_list.event = True
+        instance._permission_method(resource_list, 'post', JsonApi)
+        assert resource_list.post == mock_permission.return_value
+
+    def test__permission_method__required_fields_of_related_schemas(self, instance, resource_list):
+        # schemas reachable through relationships are checked at registration
+        resource_list.schema = ModelWithMetaSchema
+        with mock.patch('combojsonapi.permission.permission_plugin.get_required_fields_closure') as mock_closure:
+            instance._permission_method(resource_list, 'get', JsonApi)
+        assert {i_call[0][0] for i_call in mock_closure.call_args_list} == {ModelWithMeta, RelatedModel}
+
+    def test__get_or_create_permission_user(self, app, instance):
+        view_kwargs = {}
+        with app.test_request_context(method='PATCH'):
+            result = instance._get_or_create_permission_user(view_kwargs, many=False)
+        assert (result.request_type, result.many) == ('patch', False)
+        assert result.permission_mapper is instance.permission_mapper
+        # the next hooks of the request get the same PermissionUser
+        assert view_kwargs == {'_permission_user': result}
+        assert instance._get_or_create_permission_user(view_kwargs, many=False) is result
 
     @pytest.mark.parametrize('resource_class_type, methods', (
             ('list', {'get': 'get_list', 'post': 'post'}),
@@ -326,7 +651,7 @@ class TestPermissionPlugin:
         assert e.value.detail == 'No method'
 
     def test__permission_for_link_schema(self, permission_user):
-        PermissionToMapper.add_permission('get', ModelWithMeta, [SomePermission])
+        permission_user.permission_mapper.add_permission('get', ModelWithMeta, [SomePermission])
         schema = ModelWithMetaSchema()
         PermissionPlugin._permission_for_link_schema(
             schema=schema, prefix_name_column='',
@@ -341,10 +666,29 @@ class TestPermissionPlugin:
         assert set(settings_schema.fields.keys()) == set(settings_schema.dump_fields.keys()) == \
                set(settings_schema.only) == {'first_attr'}
 
+    def test__permission_for_link_schema__layout_cache(self, permission_user):
+        permission_user.permission_mapper.add_permission('get', ModelWithMeta, [SomePermission])
+        columns = permission_user.permission_for_get(ModelWithMeta).columns_and_jsonb_columns
+        PermissionPlugin._permission_for_link_schema(schema=ModelWithMetaSchema(), columns=columns)
+
+        schema = ModelWithMetaSchema(only=('id', 'name', 'flags', 'settings'))
+        with mock.patch('combojsonapi.permission.permission_plugin.SchemaLayout',
+                        side_effect=SchemaLayout) as mock_schema_layout:
+            PermissionPlugin._permission_for_link_schema(schema=schema, columns=columns)
+            # the same schema with the same permissions and requested fields uses the cached layout
+            PermissionPlugin._permission_for_link_schema(schema=ModelWithMetaSchema(only=('id', 'name', 'flags', 'settings')),
+                                                         columns=columns)
+        # only the layout for requested fields is new, the nested settings schema layout is cached by the first call
+        assert mock_schema_layout.call_count == 1
+        assert set(schema.fields.keys()) == set(schema.only) == {'name', 'settings'}
+        assert set(schema.fields['settings'].schema.only) == {'first_attr'}
+
+    def test__get_schema_layout__no_restrictions(self):
+        assert PermissionPlugin._get_schema_layout(SettingsSchema(), 'settings', frozenset(['settings'])) is None
+
     @mock.patch.object(PermissionPlugin, '_permission_for_link_schema')
     def test__permission_for_schema(self, mock__permission_for_link_schema, permission_user):
         schema, model = 'schema', ModelWithMeta
-        PermissionToMapper.get.clear()
         PermissionPlugin._permission_for_schema(schema=schema, model=model, _permission_user=permission_user)
         mock__permission_for_link_schema.assert_called_once_with(
             schema=schema, prefix_name_column="", _permission_user=permission_user,
@@ -358,7 +702,8 @@ class TestPermissionPlugin:
 
     @classmethod
     def get_args_and_kwargs(cls):
-        return ('arg1', 'arg2'), {'schema': 'schema', 'model': 'model', 'kwarg1': 1, 'kwarg2': 2}
+        return ('arg1', 'arg2'), {'schema': 'schema', 'model': 'model', 'kwarg1': 1, 'kwarg2': 2,
+                                  '_permission_user': mock.sentinel.permission_user}
 
     def test_after_init_schema_in_resource_list_post(self, instance, mock__permission_for_schema):
         args, kwargs = self.get_args_and_kwargs()
@@ -395,7 +740,7 @@ class TestPermissionPlugin:
     @mock.patch.object(PermissionPlugin, '_eagerload_includes', side_effect=lambda q, *_, **__: q)
     def test_data_layer_get_object_update_query(self, mock_eagerload_includes, instance, permission_user, session,
                                                 sqlalchemy_data_layer):
-        PermissionToMapper.add_permission('get', ModelWithMeta, [PermissionWithJoinsAndFilters])
+        permission_user.permission_mapper.add_permission('get', ModelWithMeta, [PermissionWithJoinsAndFilters])
 
         kwargs = dict(
             query=session.query(ModelWithMeta),
@@ -417,10 +762,36 @@ class TestPermissionPlugin:
                    .statement)
         assert str(result.statement) == expected_query
 
+    @pytest.mark.parametrize('hook, many, type_', (
+            ('data_layer_get_object_update_query', False, 'get'),
+            ('data_layer_get_collection_update_query', True, 'get_list'),
+    ))
+    @mock.patch('flask_combo_jsonapi.querystring.current_app', spec=['config'])
+    def test_data_layer_get_update_query__inherited_columns(self, mock_current_app, instance, session, resource_detail,
+                                                            hook, many, type_):
+        class InheritedPermission(PermissionMixin):
+            def get(self, *args, many=True, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+                return PermissionForGet(allow_columns=['name', 'extra'])
+
+        mock_current_app.config.get.return_value = None
+
+        permission_user = PermissionUser(request_type='get', many=many, permission_mapper=PermissionToMapper())
+        permission_user.permission_mapper.add_permission(type_, InheritedChild, [InheritedPermission])
+        resource_detail.schema = InheritedChildSchema
+        data_layer = SqlalchemyDataLayer(dict(session=session, model=InheritedChild, resource=resource_detail))
+
+        result = getattr(instance, hook)(query=session.query(InheritedChild),
+                                         qs=QueryStringManager({}, InheritedChildSchema), self_json_api=data_layer,
+                                         view_kwargs={'_permission_user': permission_user})
+        # columns of the parent table are loaded for the object as well as for the collection
+        sql = str(result.statement)
+        assert 'inherited_parent.name' in sql
+        assert 'inherited_child.extra' in sql
+
     @mock.patch.object(PermissionPlugin, '_eagerload_includes', side_effect=lambda q, *_, **__: q)
     def test_data_layer_get_collection_update_query(self, mock_eagerload_includes, instance, permission_user, session,
                                                     sqlalchemy_data_layer):
-        PermissionToMapper.add_permission('get', ModelWithMeta, [PermissionWithJoinsAndFilters])
+        permission_user.permission_mapper.add_permission('get', ModelWithMeta, [PermissionWithJoinsAndFilters])
 
         kwargs = dict(
             query=session.query(ModelWithMeta),
@@ -442,15 +813,203 @@ class TestPermissionPlugin:
                 .statement)
         assert str(result.statement) == expected_query
 
+    @mock.patch.object(PermissionPlugin, '_eagerload_includes', side_effect=lambda q, *_, **__: q)
+    def test_data_layer_get_collection_update_query__bind_params(self, mock_eagerload_includes, instance, session,
+                                                                 sqlalchemy_data_layer):
+        permission_user = PermissionUser(request_type='get', many=True, permission_mapper=PermissionToMapper())
+        permission_user.permission_mapper.add_permission('get_list', ModelWithMeta, [PermissionWithBindParams])
+        session.add_all([ModelWithMeta(id=1, type=1), ModelWithMeta(id=2, type=2)])
+        session.flush()
+
+        result = instance.data_layer_get_collection_update_query(
+            query=session.query(ModelWithMeta),
+            qs=QueryStringManager({}, ModelWithMetaSchema),
+            self_json_api=sqlalchemy_data_layer,
+            view_kwargs={'_permission_user': permission_user},
+        )
+        assert [i_obj.id for i_obj in result] == [2]
+        assert result.count() == 1
+        session.rollback()
+
+    @pytest.mark.parametrize('collection_count', ('stripped', 'cached'))
+    @mock.patch('flask_combo_jsonapi.querystring.current_app', spec=['config'])
+    def test_data_layer_get_collection_update_query__collection_count(self, mock_current_app, session,
+                                                                      sqlalchemy_data_layer, collection_count):
+        mock_current_app.config.get.return_value = None
+        instance = PermissionPlugin(collection_count=collection_count)
+        permission_user = PermissionUser(request_type='get', many=True, permission_mapper=PermissionToMapper())
+        permission_user.permission_mapper.add_permission('get_list', ModelWithMeta, [PermissionWithAccessTable])
+        session.add_all([
+            ModelWithMeta(id=1), ModelWithMeta(id=2),
+            ModelAccess(model_with_meta_id=1, user_id=1), ModelAccess(model_with_meta_id=2, user_id=3),
+        ])
+        session.flush()
+        qs = QueryStringManager({}, ModelWithMetaSchema)
+
+        result = instance.data_layer_get_collection_update_query(
+            query=session.query(ModelWithMeta),
+            qs=qs,
+            self_json_api=sqlalchemy_data_layer,
+            view_kwargs={'_permission_user': permission_user},
+        )
+        with mock.patch.object(Query, 'count') as mock_count:
+            assert sqlalchemy_data_layer.get_collection_count(result.order_by(ModelWithMeta.name), qs, {}) == 1
+        mock_count.assert_not_called()
+        session.rollback()
+
+    @pytest.mark.parametrize('plugin_kwargs, data_layer_collection_count', (
+            pytest.param({}, None, id='default'),
+            pytest.param({'collection_count': 'stripped'}, 'query', id='overridden by data layer'),
+    ))
+    @mock.patch('flask_combo_jsonapi.querystring.current_app', spec=['config'])
+    def test_data_layer_get_collection_update_query__collection_count_query(self, mock_current_app, session,
+                                                                            sqlalchemy_data_layer, plugin_kwargs,
+                                                                            data_layer_collection_count):
+        mock_current_app.config.get.return_value = None
+        instance = PermissionPlugin(**plugin_kwargs)
+        if data_layer_collection_count is not None:
+            sqlalchemy_data_layer.collection_count = data_layer_collection_count
+        instance.data_layer_get_collection_update_query(
+            query=session.query(ModelWithMeta),
+            qs=QueryStringManager({}, ModelWithMetaSchema),
+            self_json_api=sqlalchemy_data_layer,
+            view_kwargs={'_permission_user': PermissionUser(request_type='get', many=True, permission_mapper=PermissionToMapper())},
+        )
+        assert 'get_collection_count' not in vars(sqlalchemy_data_layer)
+
+    @mock.patch('flask_combo_jsonapi.querystring.current_app', spec=['config'])
+    def test_data_layer_get_collection_update_query__disable_collection_count(self, mock_current_app, instance, session,
+                                                                              sqlalchemy_data_layer):
+        mock_current_app.config.get.return_value = None
+        sqlalchemy_data_layer.disable_collection_count = True
+        result = instance.data_layer_get_collection_update_query(
+            query=session.query(ModelWithMeta),
+            qs=QueryStringManager({}, ModelWithMetaSchema),
+            self_json_api=sqlalchemy_data_layer,
+            view_kwargs={'_permission_user': PermissionUser(request_type='get', many=True, permission_mapper=PermissionToMapper())},
+        )
+        assert sqlalchemy_data_layer.get_collection_count(result, None, {}) == -1
+
+    @pytest.mark.parametrize('request_type, expected_ids', (
+            ('delete', [1]),
+            ('get', [1, 2]),
+    ))
+    def test_data_layer_get_object_update_query__delete_permission(self, instance, session, sqlalchemy_data_layer,
+                                                                   request_type, expected_ids):
+        class DeletePermission(PermissionMixin):
+            def delete_permission(self, *args, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+                return PermissionForGet(filters=[ModelWithMeta.type != 3])
+
+        permission_user = PermissionUser(request_type=request_type, permission_mapper=PermissionToMapper())
+        permission_user.permission_mapper.add_permission('delete', ModelWithMeta, [DeletePermission])
+        session.add_all([ModelWithMeta(id=1, type=1), ModelWithMeta(id=2, type=3)])
+        session.flush()
+
+        result = instance.data_layer_get_object_update_query(
+            query=session.query(ModelWithMeta),
+            qs=None,
+            self_json_api=sqlalchemy_data_layer,
+            view_kwargs={'_permission_user': permission_user},
+        )
+        # the object, which can't be deleted, is not found by the same query
+        assert [i_obj.id for i_obj in result.order_by(ModelWithMeta.id)] == expected_ids
+        session.rollback()
+
+    @mock.patch.object(PermissionPlugin, '_eagerload_includes', side_effect=lambda q, *_, **__: q)
+    def test_data_layer_get_collection_update_query__join_mode_exists(self, mock_eagerload_includes, instance,
+                                                                      session, sqlalchemy_data_layer):
+        permission_user = PermissionUser(request_type='get', many=True, permission_mapper=PermissionToMapper())
+        permission_user.permission_mapper.add_permission('get_list', ModelWithMeta, [PermissionWithAccessTable])
+        session.add_all([
+            ModelWithMeta(id=1), ModelWithMeta(id=2), ModelWithMeta(id=3),
+            ModelAccess(model_with_meta_id=1, user_id=1), ModelAccess(model_with_meta_id=1, user_id=2),
+            ModelAccess(model_with_meta_id=2, user_id=3), ModelAccess(model_with_meta_id=3, user_id=2),
+        ])
+        session.flush()
+
+        result = instance.data_layer_get_collection_update_query(
+            query=session.query(ModelWithMeta),
+            qs=QueryStringManager({}, ModelWithMetaSchema),
+            self_json_api=sqlalchemy_data_layer,
+            view_kwargs={'_permission_user': permission_user},
+        )
+        assert 'JOIN' not in str(result)
+        assert sorted(i_obj.id for i_obj in result) == [1, 3]
+        # rows are not multiplied by the to-many join, so the count is exact
+        assert result.count() == 2
+        session.rollback()
+
+    @pytest.mark.parametrize('join_mode', ('join', 'exists'))
+    def test__apply_row_permissions__join_modes(self, session, join_mode):
+        session.add_all([
+            MyModelWithAccess(id=1), MyModelWithAccess(id=2), MyModelWithAccess(id=3),
+            MyModelAccess(my_model_id=1, user_id=1), MyModelAccess(my_model_id=2, user_id=2),
+            MyModelAccess(my_model_id=3, user_id=1), MyModelAccess(my_model_id=3, user_id=3),
+        ])
+        session.flush()
+        # the same bare relationship attribute works in both modes
+        permission = PermissionForGet() + PermissionForGet(filters=[MyModelAccess.user_id == 1],
+                                                           joins=[MyModelWithAccess.accesses], join_mode=join_mode)
+        permission_user = PermissionUser(request_type='get', many=True, permission_mapper=PermissionToMapper())
+
+        query = PermissionPlugin._apply_row_permissions(session.query(MyModelWithAccess), permission, permission_user)
+        assert sorted(i_obj.id for i_obj in query) == [1, 3]
+        session.rollback()
+
     def test_data_layer_update_object_clean_data(self, instance, sqlalchemy_data_layer, permission_user):
-        PermissionToMapper.add_permission('patch', ModelWithMeta, [SomePermission])
+        permission_user.permission_mapper.add_permission('patch', ModelWithMeta, [SomePermission])
         data = {}
         result = instance.data_layer_update_object_clean_data(data=data, self_json_api=sqlalchemy_data_layer,
                                                               view_kwargs={'_permission_user': permission_user})
         assert result['patched_by_some_permission']
 
+    @pytest.mark.parametrize('request_type, hook', (
+            ('post', 'data_layer_create_object_clean_data'),
+            ('patch', 'data_layer_update_object_clean_data'),
+    ))
+    def test_data_layer_clean_data__strip_forbidden_columns(self, sqlalchemy_data_layer, request_type, hook):
+        class LimitedColumns(PermissionMixin):
+            def post_permission(self, *args, user_permission: PermissionUser = None, **kwargs) -> PermissionForPost:
+                return PermissionForPost(allow_columns=['name'])
+
+            def patch_permission(self, *args, user_permission: PermissionUser = None, **kwargs) -> PermissionForPatch:
+                return PermissionForPatch(allow_columns=['name'])
+
+            def post_data(self, *args, data=None, user_permission: PermissionUser = None, **kwargs) -> dict:
+                return data
+
+            def patch_data(self, *args, data=None, obj=None, user_permission: PermissionUser = None, **kwargs) -> dict:
+                return data
+
+        permission_user = PermissionUser(request_type=request_type, permission_mapper=PermissionToMapper())
+        permission_user.permission_mapper.add_permission(request_type, ModelWithMeta, [LimitedColumns])
+        data = {'name': 'test', 'type': 1}
+        for instance, expected in (
+                (PermissionPlugin(), data),
+                (PermissionPlugin(strip_forbidden_columns=True), {'name': 'test'}),
+        ):
+            result = getattr(instance, hook)(data=data, obj=None, self_json_api=sqlalchemy_data_layer,
+                                             view_kwargs={'_permission_user': permission_user})
+            assert result == expected
+
+    def test_data_layer_clean_data__stats(self, permission_user, sqlalchemy_data_layer):
+        stats = PermissionStats()
+        instance = PermissionPlugin(stats=stats)
+        permission_user.permission_mapper.add_permission('patch', ModelWithMeta, [SomePermission])
+        permission_user.permission_mapper.add_permission('delete', ModelWithMeta, [SomePermission])
+        view_kwargs = {'_permission_user': permission_user}
+        instance.data_layer_update_object_clean_data(data={}, self_json_api=sqlalchemy_data_layer,
+                                                     view_kwargs=view_kwargs)
+        with pytest.raises(JsonApiException):
+            instance.data_layer_delete_object_clean_data(obj=mock.Mock(deletable=False),
+                                                         self_json_api=sqlalchemy_data_layer, view_kwargs=view_kwargs)
+
+        result = stats.snapshot()
+        assert set(result) == {('update_object_clean_data', ModelWithMeta), ('delete_object_clean_data', ModelWithMeta)}
+        assert all(i_stats.count == 1 for i_stats in result.values())
+
     def test_data_layer_delete_object_clean_data(self, instance, permission_user, sqlalchemy_data_layer):
-        PermissionToMapper.add_permission('delete', ModelWithMeta, [SomePermission])
+        permission_user.permission_mapper.add_permission('delete', ModelWithMeta, [SomePermission])
         obj = mock.Mock()
         obj.deletable = True
 
@@ -466,15 +1025,6 @@ class TestPermissionPlugin:
                                                          view_kwargs={'_permission_user': permission_user})
         assert e.value.detail == "It is forbidden to delete the object"
 
-    def test__get_permission_user(self, permission_user):
-        result = PermissionPlugin._get_permission_user({'_permission_user': permission_user})
-        assert result is permission_user
-
-    def test__get_permission_user__no_user(self):
-        with pytest.raises(Exception) as e:
-            PermissionPlugin._get_permission_user({})
-        assert e.value.args[0] == "No permission for user"
-
     def test__get_model(self):
         result = PermissionPlugin._get_model(ModelWithMeta, 'related_model_id')
         assert result is RelatedModel
@@ -490,7 +1040,7 @@ class TestPermissionPlugin:
             pytest.param('flags', False, id='not allowed field'),
     ))
     def test__is_access_foreign_key(self, permission_user, field_name, result):
-        PermissionToMapper.add_permission('get', ModelWithMeta, [SomePermission])
+        permission_user.permission_mapper.add_permission('get', ModelWithMeta, [SomePermission])
         assert result is PermissionPlugin._is_access_foreign_key(field_name, ModelWithMeta, permission_user)
 
     @pytest.mark.parametrize('qs, new_fields, new_include', (
@@ -504,7 +1054,7 @@ class TestPermissionPlugin:
              ''),
     ))
     def test__update_qs_fields(self, permission_user, qs, new_fields, new_include):
-        PermissionToMapper.add_permission('get', ModelWithMeta, [SomePermission])
+        permission_user.permission_mapper.add_permission('get', ModelWithMeta, [SomePermission])
         qs = QueryStringManager(qs,
                                 ModelWithMetaSchema)
         PermissionPlugin._update_qs_fields(ModelWithMetaSchema.Meta.type_,
@@ -547,45 +1097,63 @@ class TestPermissionPlugin:
         assert joinedload_object.path[0] == ModelWithMeta.related_model_id
         assert related_schema is RelatedModelSchema
 
+    @pytest.mark.parametrize('strategy', ('joined', 'selectin', 'subquery'))
     @mock.patch.object(ModelWithMeta.related_model_id, 'property')
-    @mock.patch.object(PermissionPlugin, '_is_access_foreign_key', return_value=True)
-    def test__get_joinedload_object_for_splitted_include(self, mock_is_access_foreign_key, mock_property, permission_user):
-        qs = QueryStringManager({}, ModelWithMeta)
-
-        result = PermissionPlugin._get_joinedload_object_for_splitted_include('related_model_id', qs, permission_user,
-                                                                              ModelWithMetaSchema(), ModelWithMeta)
-        assert result.path[0] == ModelWithMeta.related_model_id
-
-    @mock.patch.object(PermissionPlugin, '_is_access_foreign_key', return_value=False)
-    def test__get_joinedload_object_for_splitted_include__not_allowed(self, mock_is_access_foreign_key, permission_user):
+    def test__get_or_update_joinedload_object__eagerload_strategy(self, mock_property, permission_user, strategy):
+        mock_property.mapper = mock_mapper
         qs = QueryStringManager({}, ModelWithMeta)
+        loader_option, _ = PermissionPlugin._get_or_update_joinedload_object(
+            None, qs, permission_user, ModelWithMeta, ModelWithMetaSchema, 'related_model_id', 'related_model_id', 0,
+            eagerload_strategy=EagerloadStrategy(strategy)
+        )
+        assert loader_option._to_bind[0].strategy == (('lazy', strategy),)
 
-        result = PermissionPlugin._get_joinedload_object_for_splitted_include('related_model_id', qs, permission_user,
-                                                                              ModelWithMetaSchema(), ModelWithMeta)
-        assert result is None
+    def test__init__wrong_eagerload_strategy(self):
+        with pytest.raises(ValueError):
+            PermissionPlugin(eagerload_strategy='lazy')
 
-    def test__get_joinedload_object_for_splitted_include__wrong_field_name(self, permission_user):
+    @mock.patch.object(ModelWithMeta.related_model_id, 'property')
+    @mock.patch.object(PermissionPlugin, '_is_access_foreign_key', return_value=True)
+    def test__get_options_for_include_tree(self, mock_is_access_foreign_key, mock_property, permission_user):
+        mock_property.mapper = mock_mapper
         qs = QueryStringManager({}, ModelWithMeta)
 
-        with pytest.raises(InvalidInclude):
-            PermissionPlugin._get_joinedload_object_for_splitted_include('wrong_field', qs, permission_user,
-                                                                         ModelWithMetaSchema(), ModelWithMeta)
+        result = PermissionPlugin._get_options_for_include_tree({'related_model_id': {}}, qs, permission_user,
+                                                                ModelWithMetaSchema(), ModelWithMeta)
+        assert len(result) == 1
+        assert result[0].path[0] == ModelWithMeta.related_model_id
 
-    @mock.patch.object(ModelWithMeta.related_model_id, 'property')
-    @mock.patch.object(PermissionPlugin, '_is_access_foreign_key', return_value=True)
-    def test__get_joinedload_object_for_include(self, mock_is_access_foreign_key, mock_property, permission_user):
+    @mock.patch.object(PermissionPlugin, '_is_access_foreign_key', return_value=False)
+    def test__get_options_for_include_tree__not_allowed(self, mock_is_access_foreign_key, permission_user):
         qs = QueryStringManager({}, ModelWithMeta)
 
-        result = PermissionPlugin._get_joinedload_object_for_include('related_model_id', qs, permission_user,
-                                                                     ModelWithMetaSchema(), ModelWithMeta)
-        assert result.path[0] == ModelWithMeta.related_model_id
+        result = PermissionPlugin._get_options_for_include_tree({'related_model_id': {'nested': {}}}, qs,
+                                                                permission_user, ModelWithMetaSchema(), ModelWithMeta)
+        assert result == []
 
-    def test__get_joinedload_object_for_include__wrong_field_name(self, permission_user):
+    def test__get_options_for_include_tree__wrong_field_name(self, permission_user):
         qs = QueryStringManager({}, ModelWithMeta)
 
         with pytest.raises(InvalidInclude):
-            PermissionPlugin._get_joinedload_object_for_include('wrong_field', qs, permission_user,
-                                                                ModelWithMetaSchema(), ModelWithMeta)
+            PermissionPlugin._get_options_for_include_tree({'wrong_field': {}}, qs, permission_user,
+                                                           ModelWithMetaSchema(), ModelWithMeta)
+
+    def test__get_options_for_include_tree__nested(self, permission_user):
+        qs = QueryStringManager({}, IncludeRootSchema)
+        tree = PermissionPlugin._get_include_tree(['child.first', 'child.second'])
+
+        with mock.patch.object(PermissionPlugin, '_get_or_update_joinedload_object',
+                               wraps=PermissionPlugin._get_or_update_joinedload_object) as mock_get_or_update:
+            result = PermissionPlugin._get_options_for_include_tree(tree, qs, permission_user, IncludeRootSchema,
+                                                                    IncludeRoot)
+
+        # nested options are built from the option of the parent relationship, only it is returned
+        assert len(result) == 1
+        assert result[0].path[0] is IncludeRoot.child
+        assert [(i_call[1]['include_path'], i_call[1]['path_index']) for i_call in mock_get_or_update.call_args_list] == [
+            ('child', 0), ('child.first', 1), ('child.second', 1),
+        ]
+        assert all(i_call[1]['joinedload_object'] is result[0] for i_call in mock_get_or_update.call_args_list[1:])
 
     @mock.patch('flask_combo_jsonapi.querystring.current_app', spec=['config'])
     def test__eagerload_includes__no_includes(self, mock_current_app, session, permission_user, sqlalchemy_data_layer):
@@ -596,10 +1164,10 @@ class TestPermissionPlugin:
         assert result is query
 
     @mock.patch.object(PermissionPlugin, '_is_access_foreign_key', return_value=False)
-    @mock.patch.object(PermissionPlugin, '_get_joinedload_object_for_include')
+    @mock.patch.object(PermissionPlugin, '_get_or_update_joinedload_object')
     @mock.patch('flask_combo_jsonapi.querystring.current_app', spec=['config'])
     def test__eagerload_includes__with_not_allowed_includes(
-            self, mock_current_app, mock_get_joinedload_object_for_include, mock_is_access_foreign_key, session,
+            self, mock_current_app, mock_get_or_update_joinedload_object, mock_is_access_foreign_key, session,
             permission_user, sqlalchemy_data_layer
     ):
         mock_current_app.config.get.return_value = None
@@ -608,13 +1176,14 @@ class TestPermissionPlugin:
         qs = QueryStringManager({'include': include}, ModelWithMeta)
         result = PermissionPlugin._eagerload_includes(query, qs, permission_user, sqlalchemy_data_layer)
         assert result is query
-        mock_get_joinedload_object_for_include.assert_not_called()
+        mock_get_or_update_joinedload_object.assert_not_called()
 
     @mock.patch.object(PermissionPlugin, '_is_access_foreign_key', return_value=True)
-    @mock.patch.object(PermissionPlugin, '_get_joinedload_object_for_include')
+    @mock.patch.object(PermissionPlugin, '_get_or_update_joinedload_object',
+                       return_value=(mock.sentinel.option, RelatedModelSchema))
     @mock.patch('flask_combo_jsonapi.querystring.current_app', spec=['config'])
     def test__eagerload_includes__with_includes(
-            self, mock_current_app, mock_get_joinedload_object_for_include, mock_is_access_foreign_key,
+            self, mock_current_app, mock_get_or_update_joinedload_object, mock_is_access_foreign_key,
             permission_user, sqlalchemy_data_layer
     ):
         mock_current_app.config.get.return_value = None
@@ -623,24 +1192,144 @@ class TestPermissionPlugin:
         qs = QueryStringManager({'include': include}, ModelWithMeta)
         result = PermissionPlugin._eagerload_includes(query, qs, permission_user, sqlalchemy_data_layer)
 
-        mock_get_joinedload_object_for_include.assert_called_once_with(include, qs, permission_user,
-                                                                       ModelWithMetaSchema, ModelWithMeta)
-        query.options.assert_called_once_with(mock_get_joinedload_object_for_include.return_value)
+        mock_get_or_update_joinedload_object.assert_called_once_with(
+            joinedload_object=None, qs=mock.ANY, permission_user=permission_user, model=ModelWithMeta,
+            current_schema=ModelWithMetaSchema, field='related_model_id', include=include, path_index=0,
+            include_path=include, eagerload_strategy=None,
+        )
+        assert isinstance(mock_get_or_update_joinedload_object.call_args[1]['qs'], EffectiveQuery)
+        query.options.assert_called_once_with(mock.sentinel.option)
         assert result == query.options.return_value
 
-    @mock.patch.object(PermissionPlugin, '_get_joinedload_object_for_splitted_include')
+    def test__get_include_tree(self):
+        assert PermissionPlugin._get_include_tree(['child.first', 'child.second', 'child', 'other']) == {
+            'child': {'first': {}, 'second': {}},
+            'other': {},
+        }
+
+    @pytest.fixture()
+    def include_data_layer(self, session):
+        class IncludeRootList(ResourceList):
+            schema = IncludeRootSchema
+            data_layer = {'session': session, 'model': IncludeRoot}
+        return SqlalchemyDataLayer(dict(session=session, model=IncludeRoot, resource=IncludeRootList))
+
     @mock.patch('flask_combo_jsonapi.querystring.current_app', spec=['config'])
-    def test_eagerload_includes__with_splitted_includes(
-            self, mock_current_app, mock_get_joinedload_object_for_splitted_include, permission_user,
-            sqlalchemy_data_layer
-    ):
+    def test__eagerload_includes__shared_prefix(self, mock_current_app, session, permission_user, include_data_layer):
         mock_current_app.config.get.return_value = None
-        query = mock.Mock()
-        include = 'foo.bar'
-        qs = QueryStringManager({'include': include}, ModelWithMeta)
-        result = PermissionPlugin._eagerload_includes(query, qs, permission_user, sqlalchemy_data_layer)
+        qs = QueryStringManager({'include': 'child.first,child.second'}, IncludeRootSchema)
+        with mock.patch.object(PermissionPlugin, '_get_or_update_joinedload_object',
+                               wraps=PermissionPlugin._get_or_update_joinedload_object) as mock_get_or_update:
+            query = PermissionPlugin._eagerload_includes(session.query(IncludeRoot), qs, permission_user,
+                                                         include_data_layer)
+
+        # the common relationship "child" is processed once
+        assert [i_call[1]['include_path'] for i_call in mock_get_or_update.call_args_list] == [
+            'child', 'child.first', 'child.second',
+        ]
+        sql = str(query)
+        assert sql.count('JOIN include_child') == 1
+        assert sql.count('JOIN include_leaf') == 2
 
-        mock_get_joinedload_object_for_splitted_include.assert_called_once_with(include, qs, permission_user,
-                                                                                ModelWithMetaSchema, ModelWithMeta)
-        query.options.assert_called_once_with(mock_get_joinedload_object_for_splitted_include.return_value)
-        assert result == query.options.return_value
+    @mock.patch('flask_combo_jsonapi.querystring.current_app', spec=['config'])
+    def test__eagerload_includes__pruned_branch(self, mock_current_app, session, include_data_layer):
+        class ChildWithoutFirst(PermissionMixin):
+            def get(self, *args, many=True, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+                return PermissionForGet(allow_columns=['id', 'name', 'second'])
+
+        mock_current_app.config.get.return_value = None
+        permission_user = PermissionUser(request_type='get', permission_mapper=PermissionToMapper())
+        permission_user.permission_mapper.add_permission('get', IncludeChild, [ChildWithoutFirst])
+        qs = QueryStringManager({'include': 'child.first.wrong_field,child.second'}, IncludeRootSchema)
+        query = PermissionPlugin._eagerload_includes(session.query(IncludeRoot), qs, permission_user,
+                                                     include_data_layer)
+
+        # the forbidden relationship is skipped with all nested paths, the rest is loaded
+        sql = str(query)
+        assert sql.count('JOIN include_child') == 1
+        assert 'include_leaf_1.id = include_child_1.second_id' in sql
+        assert 'first_id' not in sql
+
+    @pytest.fixture()
+    def cached_permission_user(self):
+        return PermissionUser(request_type='get', permission_cache=PermissionCache(fingerprint=lambda user: 'role'),
+                              permission_mapper=PermissionToMapper())
+
+    @staticmethod
+    def _get_include_options(qs, permission_user, self_json_api, eagerload_strategy=None):
+        permission_user.permission_for_get(RelatedModel)
+        return ['option'], {'fields[related_model]': 'id'}
+
+    @mock.patch('flask_combo_jsonapi.querystring.current_app', spec=['config'])
+    def test__eagerload_includes__plan_cache(self, mock_current_app, cached_permission_user, sqlalchemy_data_layer):
+        mock_current_app.config.get.return_value = None
+        include_plans = IncludePlanCache()
+        with mock.patch.object(PermissionPlugin, '_get_include_options',
+                               side_effect=self._get_include_options) as mock_get_include_options:
+            for i in range(2):
+                query = mock.Mock()
+                qs = QueryStringManager({'include': 'related_model_id', 'sort': 'id'}, ModelWithMeta)
+                result = PermissionPlugin._eagerload_includes(query, qs, cached_permission_user, sqlalchemy_data_layer,
+                                                              include_plans=include_plans)
+                query.options.assert_called_once_with('option')
+                assert result == query.options.return_value
+                assert dict(qs.qs) == {'include': 'related_model_id', 'sort': 'id', 'fields[related_model]': 'id'}
+        mock_get_include_options.assert_called_once()
+        assert len(include_plans) == 1
+
+    @mock.patch('flask_combo_jsonapi.querystring.current_app', spec=['config'])
+    def test__eagerload_includes__plan_cache_invalidated(self, mock_current_app, cached_permission_user,
+                                                         sqlalchemy_data_layer):
+        mock_current_app.config.get.return_value = None
+        include_plans = IncludePlanCache()
+        with mock.patch.object(PermissionPlugin, '_get_include_options',
+                               side_effect=self._get_include_options) as mock_get_include_options:
+            qs = QueryStringManager({'include': 'related_model_id'}, ModelWithMeta)
+            PermissionPlugin._eagerload_includes(mock.Mock(), qs, cached_permission_user, sqlalchemy_data_layer,
+                                                 include_plans=include_plans)
+            # permissions of the included model are changed, so the plan is built again
+            cached_permission_user.permission_cache.invalidate(model=RelatedModel)
+            permission_user = PermissionUser(request_type='get', permission_cache=cached_permission_user.permission_cache,
+                                             permission_mapper=PermissionToMapper())
+            qs = QueryStringManager({'include': 'related_model_id'}, ModelWithMeta)
+            PermissionPlugin._eagerload_includes(mock.Mock(), qs, permission_user, sqlalchemy_data_layer,
+                                                 include_plans=include_plans)
+        assert mock_get_include_options.call_count == 2
+
+
+class TestEffectiveQuery:
+
+    def test_restrict_fields(self):
+        qs = QueryStringManager({'fields[related_model]': 'id,other_field', 'include': 'related_model_id'},
+                                ModelWithMetaSchema)
+        effective_query = EffectiveQuery(qs)
+        effective_query.restrict_fields('related_model', ['id'], name_foreign_key='related_model_id')
+        effective_query.restrict_fields('model_with_meta', ['name', 'type'], name_foreign_key='other_id')
+
+        assert effective_query.fields == {'related_model': ['id'], 'model_with_meta': ['name', 'type']}
+        assert effective_query.include == ['related_model_id']
+        assert effective_query.updates == {'fields[related_model]': 'id', 'fields[model_with_meta]': 'name,type'}
+        # querystring isn't changed until updates are written
+        assert qs.qs['fields[related_model]'] == 'id,other_field'
+
+    def test_restrict_fields__no_access_fields(self):
+        qs = QueryStringManager({'fields[related_model]': 'other_field', 'include': 'related_model_id,other_id'},
+                                ModelWithMetaSchema)
+        effective_query = EffectiveQuery(qs)
+        effective_query.restrict_fields('related_model', ['id'], name_foreign_key='related_model_id')
+
+        assert effective_query.include == ['other_id']
+        assert effective_query.updates == {'include': 'other_id'}
+
+    def test_updates__not_changed(self):
+        effective_query = EffectiveQuery(QueryStringManager({'include': 'related_model_id'}, ModelWithMetaSchema))
+        assert effective_query.updates is None
+
+    @pytest.mark.parametrize('updates, result', (
+            pytest.param(None, {'include': 'related_model_id', 'sort': ''}, id='without updates'),
+            pytest.param({'include': ''}, {'include': ''}, id='with updates'),
+    ))
+    def test_update_querystring(self, updates, result):
+        qs = QueryStringManager({'include': 'related_model_id', 'sort': ''}, ModelWithMetaSchema)
+        update_querystring(qs, updates)
+        assert dict(qs.qs) == result
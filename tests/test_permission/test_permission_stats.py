@@ -0,0 +1,55 @@
+from unittest import mock
+
+import pytest
+
+from combojsonapi.permission import PermissionStats, PermissionToMapper, PermissionUser
+from combojsonapi.permission.permission_stats import StageStats, measure
+from tests.test_permission.test_permission_system import MyModel
+
+
+class ModelOne:
+    pass
+
+
+class TestPermissionStats:
+
+    def test_record(self):
+        stats = PermissionStats()
+        stats.record('permission_for_get', ModelOne, 0.5)
+        stats.record('permission_for_get', ModelOne, 1.5)
+        stats.record('eagerload_includes', ModelOne, 0.25)
+        assert stats.snapshot() == {
+            ('permission_for_get', ModelOne): StageStats(count=2, total=2.0, max=1.5),
+            ('eagerload_includes', ModelOne): StageStats(count=1, total=0.25, max=0.25),
+        }
+
+    def test_record__callback(self):
+        callback = mock.Mock()
+        stats = PermissionStats(callback=callback)
+        stats.record('permission_for_get', ModelOne, 0.5)
+        callback.assert_called_once_with('permission_for_get', ModelOne, 0.5)
+
+    def test_measure__exception(self):
+        stats = PermissionStats()
+        with pytest.raises(ValueError):
+            with stats.measure('delete_object_clean_data', ModelOne):
+                raise ValueError
+        assert stats.snapshot()[('delete_object_clean_data', ModelOne)].count == 1
+
+    def test_measure__without_stats(self):
+        with measure(None, 'permission_for_get', ModelOne):
+            pass
+
+    def test_reset(self):
+        stats = PermissionStats()
+        stats.record('permission_for_get', ModelOne, 0.5)
+        stats.reset()
+        assert stats.snapshot() == {}
+
+    def test_permission_for_get(self):
+        stats = PermissionStats()
+        permission_user = PermissionUser(request_type='get', stats=stats, permission_mapper=PermissionToMapper())
+        permission_user.permission_for_get(MyModel)
+        # permissions calculated in the request are not measured again
+        permission_user.permission_for_get(MyModel)
+        assert stats.snapshot()[('permission_for_get', MyModel)].count == 1
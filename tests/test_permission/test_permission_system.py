@@ -4,10 +4,12 @@ from unittest import mock
 import pytest
 from flask_combo_jsonapi import JsonApiException
 from flask_combo_jsonapi.utils import SPLIT_REL
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, ForeignKey, Integer, String, and_, bindparam, create_engine, or_, select
+from sqlalchemy.orm import relationship, sessionmaker
 
 from combojsonapi.permission import PermissionFields, PermissionForGet, PermissionToMapper, PermissionUser, \
-    PermissionMixin, PermissionForPost, PermissionForPatch
+    PermissionMixin, PermissionForPost, PermissionForPatch, PermissionCache
+from combojsonapi.permission.exceptions import PermissionException
 from tests.test_permission import Base
 
 module_path = 'combojsonapi.permission'
@@ -19,22 +21,78 @@ class MyModel(Base):
     name = Column(String)
 
 
+class MyModelWithAccess(Base):
+    __tablename__ = 'my_model_with_access'
+    id = Column(Integer, primary_key=True)
+    accesses = relationship('MyModelAccess')
+
+
+class MyModelAccess(Base):
+    __tablename__ = 'my_model_access'
+    id = Column(Integer, primary_key=True)
+    my_model_id = Column(Integer, ForeignKey('my_model_with_access.id'))
+    user_id = Column(Integer)
+
+
+class MyNode(Base):
+    __tablename__ = 'my_node'
+    id = Column(Integer, primary_key=True)
+    parent_id = Column(Integer, ForeignKey('my_node.id'))
+    parent = relationship('MyNode', remote_side=[id])
+
+
 class TestPermissionToMapper:
 
-    permissions = ['some permission', 'foo', 'bar']
+    class SomePermission(PermissionMixin):
+        pass
+
+    class ReusablePermission(PermissionMixin):
+        reuse_instance = True
+
+    permissions = [SomePermission, ReusablePermission]
 
     types = ['get', 'get_list', 'post', 'patch', 'delete']
 
-    @pytest.mark.parametrize('type_', types)
-    def test_add_permission_success(self, type_):
-        PermissionToMapper.add_permission(type_, MyModel, self.permissions)
-        assert getattr(PermissionToMapper, type_)[MyModel.__name__] == {'model': MyModel,
-                                                                        'permission': self.permissions}
-        getattr(PermissionToMapper, type_).clear()
+    @pytest.fixture()
+    def instance(self):
+        return PermissionToMapper()
 
-    def test_add_permission__fail__wrong_type(self):
-        with pytest.raises(AttributeError):
-            PermissionToMapper.add_permission('wrong_type', MyModel, self.permissions)
+    @pytest.mark.parametrize('type_', types)
+    def test_add_permission_success(self, instance, type_):
+        instance.add_permission(type_, MyModel, self.permissions)
+        model_permissions = instance.get_model_permissions(MyModel)
+        assert [i_permission for i_permission, _ in getattr(model_permissions, type_)] == self.permissions
+        assert instance.get_permission_classes(type_, MyModel) == self.permissions
+        for other_type in set(self.types) - {type_}:
+            assert getattr(model_permissions, other_type) == ()
+
+    def test_add_permission__models_with_the_same_name(self, instance):
+        other_model = type(MyModel.__name__, (), {})
+        instance.add_permission('get', MyModel, self.permissions)
+        instance.add_permission('get', other_model, self.permissions[:1])
+        assert instance.get_permission_classes('get', MyModel) == self.permissions
+        assert instance.get_permission_classes('get', other_model) == self.permissions[:1]
+
+    def test_add_permission__registries_are_independent(self, instance):
+        instance.add_permission('get', MyModel, self.permissions)
+        assert PermissionToMapper().get_permission_classes('get', MyModel) == []
+
+    def test_get_permission_cases(self, instance):
+        instance.add_permission('get', MyModel, self.permissions)
+        first_cases = instance.get_permission_cases('get', MyModel)
+        second_cases = instance.get_permission_cases('get', MyModel)
+
+        assert [type(i_case) for i_case in first_cases] == self.permissions
+        # reusable permission case is instantiated once
+        assert first_cases[0] is not second_cases[0]
+        assert first_cases[1] is second_cases[1]
+
+    def test_get_permission_cases__no_permissions(self, instance):
+        assert instance.get_permission_cases('get', MyModel) == []
+
+    def test_add_permission__fail__wrong_type(self, instance):
+        with pytest.raises(ValueError):
+            instance.add_permission('wrong_type', MyModel, self.permissions)
 
 
 class TestPermissionFields:
@@ -98,7 +156,27 @@ class TestPermissionFields:
         result = instance.columns_for_jsonb('settings')
 
         # 0 and 1 elements aren't jsonb, -1 element is forbidden
-        assert result == [i.split(SPLIT_REL)[1] for i in self.PermissionsWithJSONB[2:-1]]
+        assert result == tuple(i.split(SPLIT_REL)[1] for i in self.PermissionsWithJSONB[2:-1])
+        # forbidden columns are not removed from allowed ones
+        assert instance.allow_columns == {name: 5 for name in self.PermissionsWithJSONB}
+
+    def test_columns_for_jsonb__no_jsonb_columns(self, instance):
+        instance.allow_columns = self.PermissionsWithJSONB[:2], 5
+        assert instance.columns_for_jsonb('settings') is None
+
+    def test_columns__resolved_once(self, instance, other_instance):
+        instance.allow_columns = self.PermissionsWithJSONB, 5
+        columns = instance.columns
+        assert instance.columns is columns
+
+        # resolved columns are dropped when permissions are changed
+        other_instance.forbidden_columns = [self.PermissionsWithJSONB[0]], 10
+        instance += other_instance
+        assert instance.columns == {self.PermissionsWithJSONB[1]}
+
+        instance.allow_columns = self.PermissionsWithJSONB[2:], 5
+        assert instance.columns == set()
+        assert instance.columns_and_jsonb_columns == set(self.PermissionsWithJSONB[2:])
 
     def test_columns(self, instance):
         instance.allow_columns = self.PermissionsWithJSONB, 5
@@ -131,6 +209,38 @@ class TestPermissionFields:
         assert instance.allow_columns == {'foo': 1, 'bar': 1}
         assert instance.forbidden_columns == {'spam': 1, 'eggs': 1}
 
+    def test__init__no_shared_state(self):
+        instance = PermissionFields()
+        instance.allow_columns = ['foo'], 1
+        assert PermissionFields().allow_columns == {}
+        with pytest.raises(AttributeError):
+            instance.some_attribute = 1
+
+    def test_freeze(self, instance):
+        instance.allow_columns = self.PermissionsWithJSONB, 5
+        assert instance.freeze() is instance
+        assert instance.frozen
+        assert instance.columns_and_jsonb_columns == set(self.PermissionsWithJSONB)
+
+        with pytest.raises(PermissionException):
+            instance.allow_columns = ['foo'], 1
+        with pytest.raises(PermissionException):
+            instance.forbidden_columns = ['foo'], 1
+        with pytest.raises(TypeError):
+            instance.allow_columns['foo'] = 1
+
+    def test__add__frozen(self, instance, other_instance):
+        instance.allow_columns = self.PermissionsWithJSONB[:2], 5
+        instance.freeze()
+        other_instance.allow_columns = self.PermissionsWithJSONB[2:], 10
+
+        result = instance + other_instance
+        # frozen permissions are merged into a copy
+        assert result is not instance
+        assert not result.frozen
+        assert instance.allow_columns == {k: 5 for k in self.PermissionsWithJSONB[:2]}
+        assert result.allow_columns == {k: 5 if i < 2 else 10 for i, k in enumerate(self.PermissionsWithJSONB)}
+
 
 class TestPermissionForGet:
     @mock.patch(f'{module_path}.PermissionFields.__init__', autospec=True)
@@ -141,11 +251,12 @@ class TestPermissionForGet:
         instance = PermissionForGet(allow_columns=allow_columns, forbidden_columns=forbidden_columns, weight=weight,
                                     filters=filters, joins=joins)
         assert instance.filters == filters
-        assert instance.joins == joins
+        # every join is normalized to arguments of query.join
+        assert instance.joins == [('bar', )]
         mock_super_init.assert_called_once_with(instance, allow_columns=allow_columns,
                                                 forbidden_columns=forbidden_columns, weight=weight)
 
-    @mock.patch(f'{module_path}.PermissionFields.__add__', autospec=True)
+    @mock.patch(f'{module_path}.PermissionFields.__add__', autospec=True, side_effect=lambda self, other: self)
     def test__add__(self, mock_super_add):
         filters = ['foo', 'bar']
         joins = ['spam', 'eggs']
@@ -154,9 +265,160 @@ class TestPermissionForGet:
 
         result = instance_one + instance_two
         assert result.filters == filters
-        assert result.joins == joins
+        assert result.joins == [('spam', ), ('eggs', )]
         mock_super_add.assert_called_once_with(instance_one, instance_two)
 
+    def test_freeze(self):
+        filters, joins = ['foo'], ['bar']
+        instance = PermissionForGet(filters=filters, joins=joins).freeze()
+        assert instance.filters == ('foo', )
+        assert instance.joins == (('bar', ), )
+
+        result = instance + PermissionForGet(filters=['spam'], joins=['eggs'])
+        assert result.filters == ['foo', 'spam']
+        assert result.joins == [('bar', ), ('eggs', )]
+        # frozen permissions are not changed
+        assert (instance.filters, instance.joins) == (('foo', ), (('bar', ), ))
+        assert (filters, joins) == (['foo'], ['bar'])
+
+    def test__init__unique_joins(self):
+        join = (MyModel, 'on clause')
+        instance = PermissionForGet(joins=[join, (MyModel, 'on clause'), join, MyModel, (MyModel, )])
+        assert instance.joins == [join, (MyModel, )]
+
+    def test__add__params(self):
+        get_user_id = mock.Mock(return_value=7)
+        join = (MyModel, )
+        instance_one = PermissionForGet(joins=[join], params={'user_id': get_user_id, 'status': 'active'})
+        instance_two = PermissionForGet(joins=[join], params={'user_id': get_user_id, 'limit': 10})
+
+        result = instance_one + instance_two
+        assert result.joins == [join]
+        assert result.params == {'user_id': get_user_id, 'status': 'active', 'limit': 10}
+        assert result.resolve_params('permission_user') == {'user_id': 7, 'status': 'active', 'limit': 10}
+        get_user_id.assert_called_once_with('permission_user')
+
+    def test__add__params_conflict(self):
+        with pytest.raises(PermissionException):
+            PermissionForGet(params={'user_id': 1}) + PermissionForGet(params={'user_id': 2})
+
+    def test__add__filters_with_different_bindparams(self):
+        instance_one = PermissionForGet(filters=[MyModel.id == bindparam('user_id')], params={'user_id': 1})
+        instance_two = PermissionForGet(filters=[MyModel.id == bindparam('manager_id')], params={'manager_id': 2})
+        result = instance_one + instance_two
+        # both restrictions are kept
+        assert [str(i_filter.right) for i_filter in result.filters] == [':user_id', ':manager_id']
+        assert (instance_one + PermissionForGet(filters=[MyModel.id == bindparam('user_id')])).filters == \
+            instance_one.filters
+
+    def test_freeze_params(self):
+        instance = PermissionForGet(params={'user_id': 1}).freeze()
+        with pytest.raises(TypeError):
+            instance.params['user_id'] = 2
+        result = instance + PermissionForGet(params={'status': 'active'})
+        assert result.params == {'user_id': 1, 'status': 'active'}
+        assert instance.params == {'user_id': 1}
+
+    def test__add__structural_deduplication(self):
+        instance_one = PermissionForGet(filters=[MyModel.id > 1, MyModel.name == 'test'],
+                                        joins=[(MyModel, MyModel.id == 1)])
+        instance_two = PermissionForGet(filters=[MyModel.id > 1, MyModel.id > 2], joins=[(MyModel, MyModel.id == 1)])
+
+        result = instance_one + instance_two
+        assert [str(i_filter) for i_filter in result.filters] == [
+            str(MyModel.id > 1), str(MyModel.name == 'test'), str(MyModel.id > 2)
+        ]
+        assert len(result.joins) == 1
+
+    def test__init__wrong_combine_filters(self):
+        with pytest.raises(ValueError):
+            PermissionForGet(combine_filters='xor')
+
+    def test_get_filters__or(self):
+        restrict = PermissionForGet(filters=[MyModel.name != 'blocked'])
+        allow_one = PermissionForGet(filters=[MyModel.id == 1], combine_filters='or')
+        allow_two = PermissionForGet(filters=[MyModel.id > 10, MyModel.name == 'public'], combine_filters='or')
+
+        result = PermissionForGet() + restrict + allow_one + allow_two + allow_one
+        filters = result.get_filters()
+        assert len(filters) == 2
+        assert filters[0] is restrict.filters[0]
+        assert filters[1].compare(or_(MyModel.id == 1, and_(MyModel.id > 10, MyModel.name == 'public')))
+
+    def test_get_filters__or_allows_everything(self):
+        result = PermissionForGet() + PermissionForGet(filters=[MyModel.id == 1], combine_filters='or') + \
+            PermissionForGet(combine_filters='or')
+        assert result.get_filters() == []
+
+    def test__init__wrong_join_mode(self):
+        with pytest.raises(ValueError):
+            PermissionForGet(join_mode='subquery')
+
+    def test__add__join_mode_exists(self):
+        joins = [(MyModel, MyModel.id == 1)]
+        permission = PermissionForGet(filters=[MyModel.name == 'test'], joins=joins, join_mode='exists')
+
+        result = PermissionForGet() + PermissionForGet(filters=[MyModel.id > 1]) + permission
+        assert result.joins == []
+        assert len(result.filters) == 2
+        assert str(result.filters[1]) == str(permission.get_exists_clause())
+        assert 'EXISTS (SELECT 1' in str(result.filters[1])
+        # the case itself is not changed
+        assert permission.joins == joins and permission.join_mode == 'exists'
+
+    def test__add__join_mode_exists_without_joins(self):
+        result = PermissionForGet() + PermissionForGet(filters=[MyModel.id > 1], join_mode='exists')
+        assert [str(i_filter) for i_filter in result.filters] == [str(MyModel.id > 1)]
+
+    def test_get_exists_clause__relationship(self):
+        permission = PermissionForGet(filters=[MyModelAccess.user_id == 1], joins=[MyModelWithAccess.accesses],
+                                      join_mode='exists')
+        query = str(select([MyModelWithAccess.id]).where(permission.get_exists_clause()))
+        assert query == 'SELECT my_model_with_access.id \nFROM my_model_with_access \nWHERE EXISTS (SELECT 1 \n' \
+                        'FROM my_model_access \nWHERE my_model_with_access.id = my_model_access.my_model_id ' \
+                        'AND my_model_access.user_id = :user_id_1)'
+
+    def test_get_exists_clause__self_referential_relationship(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        session.add_all([MyNode(id=1), MyNode(id=2, parent_id=1), MyNode(id=3, parent_id=2)])
+        session.flush()
+        permission = PermissionForGet(filters=[MyNode.id > 2], joins=[MyNode.parent], join_mode='exists')
+
+        # the related node is aliased, filters without alias are applied to the outer node
+        query = session.query(MyNode).filter(permission.get_exists_clause())
+        assert [i_node.id for i_node in query] == [3]
+        session.close()
+
+    def test_get_exists_clause__join_without_on_clause(self):
+        permission = PermissionForGet(joins=[MyModel], join_mode='exists')
+        with pytest.raises(PermissionException):
+            permission.get_exists_clause()
+
+    def test_get_filters__not_merged_or(self):
+        permission = PermissionForGet(filters=[MyModel.id == 1, MyModel.id == 2], combine_filters='or')
+        assert permission.get_filters()[0].compare(and_(MyModel.id == 1, MyModel.id == 2))
+
+
+class TestPermissionMixin:
+
+    def test__init__(self):
+        instance = PermissionMixin()
+        # permission objects are created on demand
+        assert (instance._permission_for_get, instance._permission_for_patch, instance._permission_for_post) == \
+            (None, None, None)
+        assert isinstance(instance.permission_for_get, PermissionForGet)
+        assert instance.permission_for_get is instance.permission_for_get
+        assert isinstance(instance.permission_for_patch, PermissionForPatch)
+        assert isinstance(instance.permission_for_post, PermissionForPost)
+
+    def test_permission_setters(self):
+        instance = PermissionMixin()
+        permissions = PermissionForGet(), PermissionForPatch(), PermissionForPost()
+        instance.permission_for_get, instance.permission_for_patch, instance.permission_for_post = permissions
+        assert (instance.get(), instance.patch_permission(), instance.post_permission()) == permissions
+
 
 class TestPermissionUser:
 
@@ -217,34 +479,30 @@ class TestPermissionUser:
 
     @pytest.fixture()
     def instance_get(self):
-        return PermissionUser(request_type='get')
+        return PermissionUser(request_type='get', permission_mapper=PermissionToMapper())
 
     @pytest.fixture()
     def instance_get_many(self):
-        return PermissionUser(request_type='get', many=True)
+        return PermissionUser(request_type='get', many=True, permission_mapper=PermissionToMapper())
 
     @pytest.fixture()
     def instance_post(self):
-        return PermissionUser(request_type='post')
+        return PermissionUser(request_type='post', permission_mapper=PermissionToMapper())
 
     @pytest.fixture()
     def instance_patch(self):
-        return PermissionUser(request_type='patch')
+        return PermissionUser(request_type='patch', permission_mapper=PermissionToMapper())
 
     @pytest.fixture()
     def instance_delete(self):
-        return PermissionUser(request_type='delete')
+        return PermissionUser(request_type='delete', permission_mapper=PermissionToMapper())
 
-    @pytest.fixture()
-    def clean_permission_to_mapper(self):
-        model_name = MyModel.__name__
-        PermissionToMapper.get.pop(model_name, None)
-        PermissionToMapper.get_list.pop(model_name, None)
-        PermissionToMapper.post.pop(model_name, None)
-        PermissionToMapper.patch.pop(model_name, None)
-        PermissionToMapper.delete.pop(model_name, None)
-
-    def test_permission_for_get__no_permissions(self, instance_get, clean_permission_to_mapper):
+    def test_init__no_permission_mapper(self):
+        # without permission cases every object would be available
+        with pytest.raises(TypeError):
+            PermissionUser(request_type='get')
+
+    def test_permission_for_get__no_permissions(self, instance_get):
         """
         If model is not in PermissionToMapper, all fields should be added to `allow_columns` property.
         """
@@ -260,12 +518,12 @@ class TestPermissionUser:
     ))
     def test_permission_for_get__with_permissions(self, instance_get, permission_list, expected_allow_columns,
                                                   expected_forbidden_columns):
-        PermissionToMapper.add_permission('get', MyModel, permission_list)
+        instance_get.permission_mapper.add_permission('get', MyModel, permission_list)
         result = instance_get.permission_for_get(MyModel)
         assert result.allow_columns == expected_allow_columns
         assert result.forbidden_columns == expected_forbidden_columns
 
-    def test_permission_for_get__many__no_permissions(self, instance_get_many, clean_permission_to_mapper):
+    def test_permission_for_get__many__no_permissions(self, instance_get_many):
         """
         If model is not in PermissionToMapper, all fields should be added to `allow_columns` property.
         """
@@ -281,12 +539,45 @@ class TestPermissionUser:
     ))
     def test_permission_for_get__many__with_permissions(self, instance_get_many, permission_list,
                                                         expected_allow_columns, expected_forbidden_columns):
-        PermissionToMapper.add_permission('get_list', MyModel, permission_list)
+        instance_get_many.permission_mapper.add_permission('get_list', MyModel, permission_list)
         result = instance_get_many.permission_for_get(MyModel)
         assert result.allow_columns == expected_allow_columns
         assert result.forbidden_columns == expected_forbidden_columns
 
-    def test_permission_for_post_permission__no_permissions(self, instance_post, clean_permission_to_mapper):
+    def test_permission_for_get__permission_cache(self):
+        permission_mapper = PermissionToMapper()
+        permission_mapper.add_permission('get', MyModel, [self.NameOnlyPermission])
+        permission_mapper.add_permission('get_list', MyModel, [self.NameOnlyPermission])
+        permission_cache = PermissionCache(fingerprint=lambda permission_user: permission_user.request_type)
+
+        def permission_for_get(many=False):
+            permission_user = PermissionUser(request_type='get', many=many, permission_cache=permission_cache,
+                                             permission_mapper=permission_mapper)
+            return permission_user.permission_for_get(MyModel)
+
+        result = permission_for_get()
+        assert result.frozen
+        # permissions are shared between requests of users with the same fingerprint
+        assert permission_for_get() is result
+        assert permission_for_get(many=True) is not result
+
+        permission_cache.invalidate(model=MyModel)
+        assert permission_for_get() is not result
+
+    def test_permission_for_get__permission_cache__no_fingerprint(self):
+        permission_mapper = PermissionToMapper()
+        permission_mapper.add_permission('get', MyModel, [self.NameOnlyPermission])
+        permission_cache = PermissionCache(fingerprint=lambda permission_user: None)
+
+        def permission_for_get():
+            permission_user = PermissionUser(request_type='get', permission_cache=permission_cache,
+                                             permission_mapper=permission_mapper)
+            return permission_user.permission_for_get(MyModel)
+
+        assert permission_for_get() is not permission_for_get()
+        assert len(permission_cache) == 0
+
+    def test_permission_for_post_permission__no_permissions(self, instance_post):
         result = instance_post.permission_for_post_permission(MyModel)
         assert isinstance(result, PermissionForPost)
         assert result.allow_columns == {'id': 0, 'name': 0}
@@ -299,12 +590,12 @@ class TestPermissionUser:
     ))
     def test_permission_for_post_permission__with_permissions(self, instance_post, permission_list,
                                                               expected_allow_columns, expected_forbidden_columns):
-        PermissionToMapper.add_permission('post', MyModel, permission_list)
+        instance_post.permission_mapper.add_permission('post', MyModel, permission_list)
         result = instance_post.permission_for_post_permission(MyModel)
         assert result.allow_columns == expected_allow_columns
         assert result.forbidden_columns == expected_forbidden_columns
 
-    def test_permission_for_patch_permission__no_permissions(self, instance_patch, clean_permission_to_mapper):
+    def test_permission_for_patch_permission__no_permissions(self, instance_patch):
         result = instance_patch.permission_for_patch_permission(MyModel)
         assert isinstance(result, PermissionForPatch)
         assert result.allow_columns == {'id': 0, 'name': 0}
@@ -317,7 +608,7 @@ class TestPermissionUser:
     ))
     def test_permission_for_patch_permission__with_permissions(self, instance_patch, permission_list,
                                                                expected_allow_columns, expected_forbidden_columns):
-        PermissionToMapper.add_permission('patch', MyModel, permission_list)
+        instance_patch.permission_mapper.add_permission('patch', MyModel, permission_list)
         result = instance_patch.permission_for_patch_permission(MyModel)
         assert result.allow_columns == expected_allow_columns
         assert result.forbidden_columns == expected_forbidden_columns
@@ -327,7 +618,7 @@ class TestPermissionUser:
             {'name': 'test'},
             {'id': 1, 'name': 'test'}
     ))
-    def test_permission_for_post_data__no_permissions(self, instance_post, clean_permission_to_mapper, data):
+    def test_permission_for_post_data__no_permissions(self, instance_post, data):
         result = instance_post.permission_for_post_data(model=MyModel, data=deepcopy(data))
         assert result == data
 
@@ -342,7 +633,7 @@ class TestPermissionUser:
                          {'id': 1, 'name': 'test'}, id='process all: do nothing')
     ))
     def test_permission_for_post_data__with_permissions(self, instance_post, data, permission_list, expected_result):
-        PermissionToMapper.add_permission('post', MyModel, permission_list)
+        instance_post.permission_mapper.add_permission('post', MyModel, permission_list)
         result = instance_post.permission_for_post_data(model=MyModel, data=data)
         assert result == expected_result
 
@@ -351,7 +642,7 @@ class TestPermissionUser:
             {'name': 'test'},
             {'id': 1, 'name': 'test'}
     ))
-    def test_permission_for_patch_data__no_permissions(self, instance_patch, clean_permission_to_mapper, data):
+    def test_permission_for_patch_data__no_permissions(self, instance_patch, data):
         result = instance_patch.permission_for_patch_data(model=MyModel, data=deepcopy(data))
         assert result == data
 
@@ -366,7 +657,7 @@ class TestPermissionUser:
                          {'id': '1', 'name': 'test'}, id='process all: do nothing')
     ))
     def test_permission_for_patch_data__with_permissions(self, instance_patch, data, permission_list, expected_result):
-        PermissionToMapper.add_permission('patch', MyModel, permission_list)
+        instance_patch.permission_mapper.add_permission('patch', MyModel, permission_list)
         result = instance_patch.permission_for_patch_data(model=MyModel, data=data)
         assert result == expected_result
 
@@ -376,10 +667,73 @@ class TestPermissionUser:
         pytest.param([DeletePermission, DontDeletePermission], True, id='1 of permissions forbids to delete'),
     ))
     def test_permission_for_delete(self, instance_delete, permission_list, expected_raise):
-        PermissionToMapper.add_permission('delete', MyModel, permission_list)
+        instance_delete.permission_mapper.add_permission('delete', MyModel, permission_list)
         raised = False
         try:
             instance_delete.permission_for_delete(model=MyModel)
         except JsonApiException as e:
             raised = True
         assert raised is expected_raise
+
+    class BulkDeletePermission(PermissionMixin):
+        def delete_many(self, *args, objs=(), user_permission: PermissionUser = None, **kwargs):
+            return [i_obj != 'forbidden' for i_obj in objs]
+
+    class NoneDeletePermission(PermissionMixin):
+        def delete(self, *args, obj=None, user_permission: PermissionUser = None, **kwargs):
+            pass
+
+    class IdsPermission(PermissionMixin):
+        def get(self, *args, many=True, user_permission: PermissionUser = None, ids=None, **kwargs):
+            return PermissionForGet(allow_columns=['id'] if ids == {1, 2} else ['name'])
+
+    @pytest.mark.parametrize('permission_list, objs, expected_raise', (
+        pytest.param([], ['obj'], False, id='no permissions: dont raise'),
+        pytest.param([DeletePermission], ['obj', 'obj'], False, id='fallback to delete: allowed'),
+        pytest.param([DeletePermission, DontDeletePermission], ['obj'], True, id='fallback to delete: forbidden'),
+        pytest.param([BulkDeletePermission], ['obj', 'obj'], False, id='bulk: allowed'),
+        pytest.param([BulkDeletePermission], ['obj', 'forbidden'], True, id='bulk: 1 of objects is forbidden'),
+        pytest.param([NoneDeletePermission], ['obj', 'obj'], False, id='None is not a denial'),
+    ))
+    def test_permission_for_delete_many(self, instance_delete, permission_list, objs, expected_raise):
+        instance_delete.permission_mapper.add_permission('delete', MyModel, permission_list)
+        if expected_raise:
+            with pytest.raises(JsonApiException):
+                instance_delete.permission_for_delete_many(model=MyModel, objs=objs)
+        else:
+            instance_delete.permission_for_delete_many(model=MyModel, objs=objs)
+
+    class DeleteFilterPermission(PermissionMixin):
+        def delete_permission(self, *args, user_permission: PermissionUser = None, **kwargs) -> PermissionForGet:
+            return PermissionForGet(filters=[MyModel.name != 'protected'])
+
+    def test_permission_for_delete_permission(self, instance_delete):
+        instance_delete.permission_mapper.add_permission(
+            'delete', MyModel, [PermissionMixin, self.DeleteFilterPermission]
+        )
+        result = instance_delete.permission_for_delete_permission(MyModel)
+        assert [str(i_filter) for i_filter in result.get_filters()] == [str(MyModel.name != 'protected')]
+        assert result.frozen
+
+    def test_permission_for_delete_permission__no_permissions(self, instance_delete):
+        result = instance_delete.permission_for_delete_permission(MyModel)
+        assert result.get_filters() == [] and result.joins == ()
+
+    def test_permission_for_patch_data_many(self, instance_patch):
+        permission_list = [self.NameOnlyPermission, self.IdFieldPermission]
+        instance_patch.permission_mapper.add_permission('patch', MyModel, permission_list)
+        result = instance_patch.permission_for_patch_data_many(model=MyModel, data_list=[{'id': 1}, {'name': 'test'}],
+                                                               objs=['first', 'second'])
+        assert result == [{'id': '1', 'name': 'patch-placeholder'}, {'name': 'test'}]
+
+    def test_permission_for_patch_data_many__wrong_length(self, instance_patch):
+        with pytest.raises(ValueError):
+            instance_patch.permission_for_patch_data_many(model=MyModel, data_list=[{}], objs=[])
+
+    def test_permission_for_get_many(self, instance_get_many):
+        instance_get_many.permission_mapper.add_permission('get_list', MyModel, [self.IdsPermission])
+        assert instance_get_many.permission_for_get_many(MyModel, [2, 1]).columns == {'id'}
+        assert instance_get_many.permission_for_get_many(MyModel, [3]).columns == {'name'}
+
+    def test_permission_for_get_many__no_permissions(self, instance_get_many):
+        assert instance_get_many.permission_for_get_many(MyModel, [1]) is instance_get_many.permission_for_get(MyModel)
@@ -0,0 +1,51 @@
+from marshmallow import class_registry, fields, Schema
+from marshmallow_jsonapi import Schema as JsonApiSchema
+from marshmallow_jsonapi.fields import Relationship
+
+from combojsonapi.permission.restricted_schema import get_restricted_schema
+
+
+class ComputerSettingsSchema(Schema):
+    os = fields.String()
+    ram = fields.Integer()
+
+
+class ComputerSchema(JsonApiSchema):
+    class Meta:
+        type_ = 'restricted_computer'
+
+    id = fields.Integer()
+    serial = fields.String()
+    comment = fields.String()
+    settings = fields.Nested(ComputerSettingsSchema)
+    owner = Relationship(type_='person', schema='PersonSchema')
+
+
+def test_get_restricted_schema():
+    restricted_schema = get_restricted_schema(ComputerSchema, frozenset(['serial', 'settings', 'settings.os']))
+
+    assert issubclass(restricted_schema, ComputerSchema)
+    assert restricted_schema.__name__ == ComputerSchema.__name__
+    assert restricted_schema.Meta.type_ == 'restricted_computer'
+    # id and relationships are restricted by PermissionPlugin in requests
+    assert list(restricted_schema._declared_fields) == ['id', 'serial', 'settings', 'owner']
+    # nested schema of JSONB field is restricted too
+    settings_schema = restricted_schema._declared_fields['settings'].nested
+    assert list(settings_schema._declared_fields) == ['os']
+    assert list(ComputerSettingsSchema._declared_fields) == ['os', 'ram']
+    # generated schemas are not registered, so the original schema is still found by name
+    assert class_registry.get_class('ComputerSchema') is ComputerSchema
+
+    assert set(restricted_schema().fields) == {'id', 'serial', 'settings', 'owner'}
+
+
+def test_get_restricted_schema__cache():
+    columns = frozenset(['serial', 'comment'])
+    restricted_schema = get_restricted_schema(ComputerSchema, columns)
+    assert get_restricted_schema(ComputerSchema, frozenset(['serial', 'comment'])) is restricted_schema
+    assert get_restricted_schema(ComputerSchema, frozenset(['serial'])) is not restricted_schema
+
+
+def test_get_restricted_schema__all_fields_allowed():
+    assert get_restricted_schema(ComputerSchema, frozenset()) is ComputerSchema
+    assert get_restricted_schema(ComputerSchema, frozenset(['id', 'serial', 'comment', 'settings'])) is ComputerSchema